@@ -1,68 +1,407 @@
 import argparse
 import os
 import sys
-from typing import Dict, Set
+from pathlib import Path
+from threading import Event
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
 
-from microovn_rebuilder.ovn import rebuild
-from microovn_rebuilder.remote import BaseConnector, ConnectorException, create_connector
+from microovn_rebuilder.daemon import (
+    ControlServer,
+    DaemonException,
+    default_socket_path,
+)
+from microovn_rebuilder.index import ContentIndex, default_index_path
+from microovn_rebuilder.ovn import BuildOptions, make_goals, rebuild
+from microovn_rebuilder.pipeline import TargetShipper
+from microovn_rebuilder.remote import (
+    BaseConnector,
+    ConnectorException,
+    ConnectorOptions,
+    UpdateException,
+    create_connector,
+)
+from microovn_rebuilder.remote.compression import CODECS
+from microovn_rebuilder.remote.hooks import readiness_probes
+from microovn_rebuilder.report import DeployReport
+from microovn_rebuilder.strip import StripCache, default_strip_cache_path
 from microovn_rebuilder.target import ConfigException, Target, parse_config
+from microovn_rebuilder.watcher import SourceWatcher, WatcherException
 
-NOT_FOUND_TS = float(-1)
+DEFAULT_CODEC = "gzip"
+# Statuses of cycles that did not deploy what they were asked to
+FAILED_STATUSES = ("failed", "build failed")
 
 
-def get_file_timestamps(targets: Set[Target]) -> Dict[Target, float]:
-    """Retrieve the last modified timestamps of WATCHED_FILES."""
-    timestamps = {}
+def get_changed_targets(
+    targets: Set[Target], index: ContentIndex, remotes: List[str]
+) -> Set[Target]:
+    """Return targets whose content differs from what was deployed to the remotes."""
+    return {target for target in targets if index.is_changed(target, remotes)}
+
+
+def update_targets(
+    targets: Set[Target],
+    connector: BaseConnector,
+    index: ContentIndex,
+    staged: Optional[Set[Target]] = None,
+) -> None:
+    try:
+        connector.update_many(targets, staged)
+    except UpdateException as exc:
+        # Remotes updated despite failures elsewhere are not updated again
+        for target in targets:
+            index.mark_deployed(target, exc.updated)
+        raise
     for target in targets:
-        try:
-            timestamps[target] = os.path.getmtime(target.local_path)
-        except OSError:
-            timestamps[target] = NOT_FOUND_TS
+        index.mark_deployed(target, connector.remotes)
 
-    return timestamps
 
+def deploy(
+    targets: Set[Target],
+    connector: BaseConnector,
+    index: ContentIndex,
+    report: DeployReport,
+    staged: Optional[Set[Target]] = None,
+) -> bool:
+    """Deploy targets that changed since the last deployment.
 
-def get_changed_targets(
-    initial_ts: Dict[Target, float], current_ts: Dict[Target, float]
-) -> Set[Target]:
-    need_restart = set()
-    for target, ts in current_ts.items():
-        if ts == NOT_FOUND_TS:
-            continue
+    Returns False if there was nothing to deploy.
+    """
+    with report.timed("detect"):
+        # Files matched by glob and directory targets may come and go with builds
+        index.expand(targets)
+        need_restart = get_changed_targets(targets, index, connector.remotes)
+    if need_restart:
+        update_targets(need_restart, connector, index, staged)
+    else:
+        print("[local] No changes in watched files")
+    index.save()
+    return bool(need_restart)
 
-        if ts != initial_ts[target]:
-            need_restart.add(target)
 
-    return need_restart
+def sync(
+    targets: Set[Target],
+    connector: BaseConnector,
+    index: ContentIndex,
+    report: DeployReport,
+) -> None:
+    """Upload targets whose remote files differ from the local build.
 
+    Each remote computes checksums of all targets with a single command. Matching
+    files are recorded as deployed, mismatched files are uploaded only to the
+    remotes where they differ, and services of uploaded targets are restarted.
+    """
+    report.start_cycle()
+    pending: Dict[str, Set[Target]] = {}
+    try:
+        with report.timed("detect"):
+            local = {target: index.digest(target.local_path) for target in targets}
+            # Remote files of stripped targets are compared with the stripped copies
+            uploaded = {
+                target: index.digest(connector.upload_target(target).local_path)
+                for target in targets
+            }
+        for remote, checksums in connector.remote_checksums(targets).items():
+            for target, digest in local.items():
+                if digest is None:
+                    continue
+                if checksums.get(target) == uploaded[target]:
+                    index.mark_deployed(target, [remote], digest)
+                else:
+                    pending.setdefault(remote, set()).add(target)
 
-def update_targets(targets: Set[Target], connector: BaseConnector) -> None:
-    for target in targets:
-        connector.update(target)
+        if pending:
+            count = sum(len(remote_targets) for remote_targets in pending.values())
+            print(f"[local] {count} remote file(s) differ from local build")
+            connector.sync(pending)
+            for remote, remote_targets in pending.items():
+                for target in remote_targets:
+                    index.mark_deployed(target, [remote], local[target])
+        else:
+            print("[local] Remote files match local build")
+        index.save()
+    except ConnectorException:
+        _finish_cycle(connector, report, "failed")
+        raise
+    _finish_cycle(connector, report, "synced" if pending else "in sync")
+
+
+def build_and_deploy(
+    targets: Set[Target],
+    connector: BaseConnector,
+    ovn_dir: str,
+    build_options: BuildOptions,
+    index: ContentIndex,
+    report: DeployReport,
+    cancel: Optional[Event] = None,
+) -> None:
+    """Rebuild OVN and deploy changed targets if the build succeeds.
+
+    In pipelined mode, targets are uploaded as soon as they are built, while the
+    build is still running. Services are restarted only after the build succeeds.
+    Timings of the whole cycle are reported at the end.
+    """
+    report.start_cycle()
+    try:
+        status = _build_and_deploy(
+            targets, connector, ovn_dir, build_options, index, report, cancel
+        )
+    except ConnectorException:
+        _finish_cycle(connector, report, "failed")
+        raise
+    _finish_cycle(connector, report, status)
+
+
+def deploy_changes(
+    targets: Set[Target],
+    connector: BaseConnector,
+    index: ContentIndex,
+    report: DeployReport,
+) -> None:
+    """Deploy targets that changed since the last deployment, without building OVN."""
+    report.start_cycle()
+    try:
+        deployed = deploy(targets, connector, index, report)
+    except ConnectorException:
+        _finish_cycle(connector, report, "failed")
+        raise
+    _finish_cycle(connector, report, "deployed" if deployed else "no changes")
+
+
+def restart_services(
+    targets: Set[Target],
+    connector: BaseConnector,
+    report: DeployReport,
+    services: List[str],
+) -> None:
+    """Restart selected services, or services of all targets if none are selected,
+    waiting for their readiness probes."""
+    services = services or sorted(
+        {target.service for target in targets if target.service}
+    )
+    probes = readiness_probes(t for t in targets if t.service in services)
+    report.start_cycle()
+    try:
+        connector.restart(services, probes)
+    except ConnectorException:
+        _finish_cycle(connector, report, "failed")
+        raise
+    _finish_cycle(connector, report, "restarted")
+
+
+def _finish_cycle(connector: BaseConnector, report: DeployReport, status: str) -> None:
+    report.add(connector.collect_timings())
+    report.finish_cycle(status)
+
+
+def _build_and_deploy(
+    targets: Set[Target],
+    connector: BaseConnector,
+    ovn_dir: str,
+    build_options: BuildOptions,
+    index: ContentIndex,
+    report: DeployReport,
+    cancel: Optional[Event],
+) -> str:
+    shipper = None
+    if build_options.pipeline:
+        shipper = TargetShipper(targets, connector, index)
+        shipper.start()
+    try:
+        with report.timed("build"):
+            built = rebuild(ovn_dir, build_options, cancel=cancel)
+    finally:
+        if shipper is not None:
+            shipper.stop()
+    if not built:
+        return "build failed"
+
+    staged = shipper.shipped() if shipper is not None else None
+    if deploy(targets, connector, index, report, staged):
+        return "deployed"
+    return "no changes"
+
+
+def upload_debug_info(
+    targets: Set[Target], connector: BaseConnector, remotes: List[str]
+) -> None:
+    """Upload debug info of stripped targets to selected remotes, or to all remotes
+    if none are selected."""
+    unknown = [remote for remote in remotes if remote not in connector.remotes]
+    if unknown:
+        print(f"[local] Unknown remote host(s): {', '.join(unknown)}")
+        return
+    if connector.strip_cache is None:
+        print("[local] No stripped targets")
+        return
+
+    try:
+        debug_targets = connector.strip_cache.debug_targets(targets)
+        if not debug_targets:
+            print("[local] No stripped targets")
+            return
+        connector.sync(
+            {remote: debug_targets for remote in remotes or connector.remotes}
+        )
+    except ConnectorException as exc:
+        print(exc)
+        return
+    print(f"[local] Uploaded debug info of {len(debug_targets)} target(s)")
 
 
 def watch(
-    targets: Set[Target], connector: BaseConnector, ovn_dir: str, jobs: int
+    targets: Set[Target],
+    connector: BaseConnector,
+    ovn_dir: str,
+    build_options: BuildOptions,
+    index: ContentIndex,
+    report: DeployReport,
 ) -> None:
+    index.seed(targets, connector.remotes)
+    index.save()
+    prompt = "Press 'Enter' to rebuild and deploy OVN."
+    if connector.strip_cache is not None:
+        prompt += " Type 'debug [HOST...]' to upload debug info of stripped targets."
     while True:
         try:
-            initial_timestamps = get_file_timestamps(targets)
-            input("Press 'Enter' to rebuild and deploy OVN. (Ctrl-C for exit)")
-            if not rebuild(ovn_dir, jobs):
-                continue
-            current_timestamps = get_file_timestamps(targets)
-
-            need_restart = get_changed_targets(initial_timestamps, current_timestamps)
-            if need_restart:
-                update_targets(need_restart, connector)
-            else:
-                print("[local] No changes in watched files")
+            command = input(f"{prompt} (Ctrl-C for exit)").split()
+            try:
+                if command[:1] == ["debug"]:
+                    upload_debug_info(targets, connector, command[1:])
+                    continue
+                build_and_deploy(
+                    targets, connector, ovn_dir, build_options, index, report
+                )
+            except ConnectorException as exc:
+                # Keep watching, next 'Enter' will trigger new deployment attempt
+                print(exc)
         except KeyboardInterrupt:
             print()
             connector.teardown()
             break
 
 
+def watch_auto(
+    targets: Set[Target],
+    connector: BaseConnector,
+    ovn_dir: str,
+    build_options: BuildOptions,
+    index: ContentIndex,
+    report: DeployReport,
+    watcher: SourceWatcher,
+    debounce: float,
+) -> None:
+    """Rebuild and deploy OVN whenever its source files change.
+
+    Changes that arrive while OVN is being built cancel the build, and a new build
+    starts once the changes settle down.
+    """
+    index.seed(targets, connector.remotes)
+    index.save()
+    watcher.start()
+    print(f"[local] Watching {ovn_dir} for changes. (Ctrl-C for exit)")
+    while True:
+        try:
+            changes = watcher.wait(debounce)
+            print(f"[local] Detected changes in {len(changes)} file(s)")
+            try:
+                build_and_deploy(
+                    targets,
+                    connector,
+                    ovn_dir,
+                    build_options,
+                    index,
+                    report,
+                    cancel=watcher.changed,
+                )
+            except ConnectorException as exc:
+                # Keep watching, next change will trigger new deployment attempt
+                print(exc)
+        except KeyboardInterrupt:
+            print()
+            watcher.stop()
+            connector.teardown()
+            break
+
+
+def serve(
+    targets: Set[Target],
+    connector: BaseConnector,
+    ovn_dir: str,
+    build_options: BuildOptions,
+    index: ContentIndex,
+    report: DeployReport,
+    socket_path: str,
+) -> None:
+    """Run commands received on the control socket until interrupted.
+
+    Connections to remote hosts and the index stay in memory between the commands,
+    so each cycle starts without any setup.
+    """
+    index.seed(targets, connector.remotes)
+    index.save()
+
+    def cycle(run: Callable[[], None]) -> Dict[str, Any]:
+        try:
+            run()
+        except ConnectorException as exc:
+            return {"ok": False, "error": str(exc), "result": report.last}
+        assert report.last is not None
+        return {
+            "ok": report.last["status"] not in FAILED_STATUSES,
+            "result": report.last,
+        }
+
+    commands = {
+        "build": lambda args, cancel: cycle(
+            lambda: build_and_deploy(
+                targets, connector, ovn_dir, build_options, index, report, cancel
+            )
+        ),
+        "deploy": lambda args, cancel: cycle(
+            lambda: deploy_changes(targets, connector, index, report)
+        ),
+        "restart": lambda args, cancel: cycle(
+            lambda: restart_services(targets, connector, report, args)
+        ),
+    }
+
+    def status() -> Dict[str, Any]:
+        return {"remotes": connector.remotes, "result": report.last}
+
+    try:
+        server = ControlServer(socket_path, commands, status)
+    except (OSError, DaemonException) as exc:
+        print(f"Failed to listen on control socket {socket_path}: {exc}")
+        connector.teardown()
+        sys.exit(1)
+    print(f"[local] Listening for commands on {socket_path}. (Ctrl-C for exit)")
+    with server:
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            print()
+        finally:
+            # 'make' runs in its own session, so it does not get the interrupt and has
+            # to be cancelled. The connector must not be torn down under the command.
+            server.cancel_running()
+    connector.teardown()
+
+
+def parse_type_parallel(value: str) -> Tuple[str, int]:
+    """Parse '--type-parallel' value in the form 'TYPE=N'."""
+    connector_type, _, parallel = value.partition("=")
+    try:
+        count = int(parallel)
+    except ValueError:
+        count = 0
+    if not connector_type or count < 1:
+        raise argparse.ArgumentTypeError(
+            f"'{value}' is not valid. Expected format is '<remote_type>=<count>'"
+        )
+    return connector_type, count
+
+
 def parse_args() -> argparse.Namespace:  # pragma: no cover
     parser = argparse.ArgumentParser(description="Monitor file changes.")
     parser.add_argument("-c", "--config", required=True, help="Path to config file")
@@ -88,7 +427,8 @@ def parse_args() -> argparse.Namespace:  # pragma: no cover
         help="Comma-separated list of remote host to which changes will be synced. For "
         "details on supported connectors and their syntax, please see "
         "documentation. Generally, the format is:"
-        "'<connection_type>:<remote_host>'",
+        "'<connection_type>:<remote_host>'. Remote hosts of different connection "
+        "types can be mixed.",
     )
     parser.add_argument(
         "-j",
@@ -97,26 +437,296 @@ def parse_args() -> argparse.Namespace:  # pragma: no cover
         default=os.cpu_count(),
         help="Number of parallel jobs directly passed to 'make' when building OVN. (defaults to cpu count)",
     )
+    parser.add_argument(
+        "-t",
+        "--targeted",
+        action="store_true",
+        help="Build only files of the targets from the config file, instead of "
+        "the whole OVN.",
+    )
+    parser.add_argument(
+        "--check-fresh",
+        action="store_true",
+        help="Before each build, check with 'make -q' whether anything needs to be "
+        "rebuilt, and skip the build if not.",
+    )
+    parser.add_argument(
+        "-P",
+        "--pipeline",
+        action="store_true",
+        help="Upload each target as soon as it is built, while the build is still "
+        "running. Services are restarted once the whole build succeeds.",
+    )
+    parser.add_argument(
+        "-p",
+        "--parallel",
+        type=int,
+        default=1,
+        help="Number of remote hosts that are updated concurrently. (default: 1)",
+    )
+    parser.add_argument(
+        "--type-parallel",
+        type=parse_type_parallel,
+        action="append",
+        default=[],
+        metavar="TYPE=N",
+        help="Number of remote hosts of the given connection type that are updated "
+        "concurrently, in place of '-p'. Remote hosts of each connection type are "
+        "updated at the same time as the others. Can be repeated.",
+    )
+    parser.add_argument(
+        "--async",
+        dest="use_async",
+        action="store_true",
+        help="Work on all remote hosts from a single thread using asyncio, with one "
+        "task per remote host. '-p' and '--channels' limit the number of concurrent "
+        "operations.",
+    )
+    parser.add_argument(
+        "-b",
+        "--bulk",
+        action="store_true",
+        help="Upload all changed files to each remote host in a single tar archive.",
+    )
+    parser.add_argument(
+        "-d",
+        "--delta",
+        action="store_true",
+        help="Upload only parts of files that changed, using rsync-like delta transfer. "
+        "Requires 'python3' on remote hosts. (SSH connector only)",
+    )
+    parser.add_argument(
+        "--channels",
+        type=int,
+        default=1,
+        help="Number of files uploaded concurrently to each remote host. The SSH "
+        "connector uploads each of them over its own SFTP channel. Applies to all "
+        "connectors with --async, otherwise to the SSH connector only. (default: 1)",
+    )
+    parser.add_argument(
+        "--compress",
+        choices=CODECS,
+        help="Compress uploaded files with selected codec. The codec must be "
+        "installed locally and on remote hosts. (default: no compression)",
+    )
+    parser.add_argument(
+        "--compress-level",
+        type=int,
+        help="Compression level passed to the codec. (default: codec's default)",
+    )
+    parser.add_argument(
+        "--compress-below",
+        type=float,
+        metavar="MBPS",
+        help="Compress uploads only to remote hosts with measured upload throughput "
+        f"below MBPS megabytes per second. (default codec: {DEFAULT_CODEC})",
+    )
+    parser.add_argument(
+        "--restart-window",
+        type=int,
+        metavar="N",
+        help="Number of remote hosts that restart services at the same time. With "
+        "'ready_check' set for the targets, next remote host is restarted only after "
+        "the services pass their checks. (default: value of '-p')",
+    )
+    parser.add_argument(
+        "--ready-timeout",
+        type=float,
+        default=120.0,
+        metavar="SECONDS",
+        help="Time limit for restarted services to pass their 'ready_check'. If a remote "
+        "host does not get ready in time, the remaining hosts are not restarted. "
+        "(default: 120)",
+    )
+    parser.add_argument(
+        "--pre-exec-timeout",
+        type=float,
+        default=60.0,
+        metavar="SECONDS",
+        help="Time limit for each 'pre_exec' hook of the targets, run on remote hosts "
+        "before the files are uploaded. (default: 60)",
+    )
+    parser.add_argument(
+        "--fanout",
+        type=int,
+        metavar="N",
+        help="Upload files only to the first N remote hosts, which forward them to the "
+        "other hosts in a tree. With SSH connector, remote hosts must be able to log "
+        "in to each other without a password. LXD instances get the files through "
+        "this host. (default: upload to all hosts)",
+    )
+    parser.add_argument(
+        "--connect-timeout",
+        type=float,
+        default=10.0,
+        metavar="SECONDS",
+        help="Time limit for connecting to each remote host and checking the remote "
+        "path on it at startup. All remote hosts are connected to at once. "
+        "(default: 10)",
+    )
+    parser.add_argument(
+        "--skip-unreachable",
+        action="store_true",
+        help="Continue with the reachable remote hosts only if some remote hosts can "
+        "not be connected to or checked at startup.",
+    )
+    parser.add_argument(
+        "-a",
+        "--auto",
+        action="store_true",
+        help="Rebuild and deploy OVN automatically whenever its source files change, "
+        "instead of waiting for user input.",
+    )
+    parser.add_argument(
+        "--daemon",
+        action="store_true",
+        help="Keep running in the background and rebuild, deploy or restart services "
+        "on commands received on the control socket (see 'microovn-rebuilder-ctl'), "
+        "instead of waiting for user input.",
+    )
+    parser.add_argument(
+        "--socket",
+        default=default_socket_path(),
+        help="Path to the control socket in '--daemon' mode. (default: "
+        f"{default_socket_path()})",
+    )
+    parser.add_argument(
+        "--debounce",
+        type=float,
+        default=1.0,
+        metavar="SECONDS",
+        help="In '--auto' mode, wait until no source file changed for this amount of "
+        "seconds before starting the build. (default: 1.0)",
+    )
+    parser.add_argument(
+        "-i",
+        "--index",
+        type=Path,
+        default=default_index_path(),
+        help="Path to the file that keeps hashes of watched files and of files "
+        f"deployed to remote hosts. (default: {default_index_path()})",
+    )
+    parser.add_argument(
+        "-s",
+        "--sync",
+        action="store_true",
+        help="On startup, compare checksums of files on remote hosts with the local "
+        "build and upload the ones that differ.",
+    )
+    parser.add_argument(
+        "--report",
+        type=Path,
+        help="Append timings of each rebuild and deploy cycle to this file, as a "
+        "single JSON line per cycle.",
+    )
+
+    args = parser.parse_args()
+    if args.daemon and args.auto:
+        parser.error("argument --daemon: not allowed with argument -a/--auto")
+    return args
+
+
+def get_build_options(args: argparse.Namespace, targets: Set[Target]) -> BuildOptions:
+    return BuildOptions(
+        jobs=args.jobs,
+        goals=make_goals(targets) if args.targeted else (),
+        check_fresh=args.check_fresh,
+        pipeline=args.pipeline,
+    )
 
-    return parser.parse_args()
+
+def get_connector_options(args: argparse.Namespace) -> ConnectorOptions:
+    compression = args.compress
+    if compression is None and args.compress_below is not None:
+        compression = DEFAULT_CODEC
+
+    return ConnectorOptions(
+        parallel=args.parallel,
+        bulk=args.bulk,
+        delta=args.delta,
+        channels=args.channels,
+        compression=compression,
+        compression_level=args.compress_level,
+        compression_threshold=args.compress_below,
+        pre_exec_timeout=args.pre_exec_timeout,
+        restart_window=args.restart_window,
+        ready_timeout=args.ready_timeout,
+        fanout=args.fanout,
+        connect_timeout=args.connect_timeout,
+        skip_unreachable=args.skip_unreachable,
+    )
 
 
 def main() -> None:
     args = parse_args()
     try:
-        targets = parse_config(args.config, args.ovn_src, args.remote_path)
+        targets, patterns = parse_config(args.config, args.ovn_src, args.remote_path)
     except ConfigException as exc:
         print(exc)
         sys.exit(1)
 
     try:
-        connector = create_connector(args.hosts)
+        connector = create_connector(
+            args.hosts,
+            get_connector_options(args),
+            args.use_async,
+            dict(args.type_parallel),
+        )
         connector.check_remote(args.remote_path)
     except ConnectorException as exc:
         print(f"Failed to create connection to remote host: {exc}")
         sys.exit(1)
 
-    watch(targets, connector, args.ovn_src, args.jobs)
+    # Make goals are only the targets listed explicitly, not files matched by patterns
+    build_options = get_build_options(args, targets)
+    index = ContentIndex(args.index)
+    index.load()
+    index.patterns = patterns
+    index.expand(targets)
+    if any(target.strip for target in targets):
+        connector.strip_cache = StripCache(default_strip_cache_path(), index)
+    report = DeployReport(args.report)
+
+    if args.sync:
+        try:
+            sync(targets, connector, index, report)
+        except ConnectorException as exc:
+            print(f"Failed to sync remote hosts: {exc}")
+            connector.teardown()
+            sys.exit(1)
+
+    if args.daemon:
+        serve(
+            targets,
+            connector,
+            args.ovn_src,
+            build_options,
+            index,
+            report,
+            args.socket,
+        )
+        return
+
+    if not args.auto:
+        watch(targets, connector, args.ovn_src, build_options, index, report)
+        return
+
+    try:
+        watcher = SourceWatcher(args.ovn_src)
+    except WatcherException as exc:
+        print(f"Failed to watch OVN source directory: {exc}")
+        connector.teardown()
+        sys.exit(1)
+    watch_auto(
+        targets,
+        connector,
+        args.ovn_src,
+        build_options,
+        index,
+        report,
+        watcher,
+        args.debounce,
+    )
 
 
 if __name__ == "__main__":  # pragma: no cover
@@ -0,0 +1,179 @@
+import argparse
+import json
+import os
+import shlex
+import socket
+import socketserver
+import stat
+import sys
+import threading
+from typing import Any, Callable, Dict, List, Optional
+
+from microovn_rebuilder.remote import ConnectorException
+
+# Command handler gets arguments of the command and event that is set when the daemon
+# shuts down (see ControlServer.cancel_running), and returns JSON-serializable result
+Handler = Callable[[List[str], threading.Event], Dict[str, Any]]
+
+
+def default_socket_path() -> str:
+    runtime_dir = os.environ.get("XDG_RUNTIME_DIR") or "/tmp"
+    return os.path.join(runtime_dir, f"microovn-rebuilder-{os.getuid()}.sock")
+
+
+class DaemonException(Exception):
+    pass
+
+
+class ControlServer(socketserver.ThreadingUnixStreamServer):
+    """Unix socket server that runs commands of the daemon mode.
+
+    Client sends a single line with the command and its arguments and gets back a
+    single line with JSON object, which has "ok" key set to false and "error" set to
+    the error message if the command failed.
+
+    Commands share the connector, so they run one at a time, in the order they
+    arrive. Only the 'status' command is answered immediately, even while another
+    command runs.
+
+    When the daemon shuts down, the running command is cancelled through the event
+    passed to its handler, see cancel_running.
+    """
+
+    daemon_threads = True
+
+    def __init__(
+        self,
+        path: str,
+        commands: Dict[str, Handler],
+        status: Callable[[], Dict[str, Any]],
+    ) -> None:
+        _remove_stale_socket(path)
+        old_umask = os.umask(0o077)
+        try:
+            super().__init__(path, _ControlHandler)
+        finally:
+            os.umask(old_umask)
+        self.path = path
+        self.commands = commands
+        self.status = status
+        self.running: Optional[str] = None
+        self.cancel = threading.Event()
+        self._lock = threading.Lock()
+
+    def execute(self, line: str) -> Dict[str, Any]:
+        try:
+            args = shlex.split(line)
+        except ValueError as exc:
+            return {"ok": False, "error": f"Invalid command: {exc}"}
+        if not args:
+            return {"ok": False, "error": "Empty command"}
+        name, args = args[0], args[1:]
+        if name == "status":
+            return {"ok": True, "running": self.running, **self.status()}
+        handler = self.commands.get(name)
+        if handler is None:
+            available = ", ".join(["status", *self.commands])
+            return {
+                "ok": False,
+                "error": f"Unknown command '{name}'. Available commands: {available}",
+            }
+
+        with self._lock:
+            if self.cancel.is_set():
+                return {"ok": False, "error": "Daemon is shutting down"}
+            self.running = name
+            try:
+                return {"ok": True, **handler(args, self.cancel)}
+            except ConnectorException as exc:
+                return {"ok": False, "error": str(exc)}
+            finally:
+                self.running = None
+
+    def cancel_running(self) -> None:
+        """Cancel the running command, if any, and wait until it finishes.
+
+        Commands run in threads of the server, so the main thread must wait for them
+        before it tears down what they use. Commands that arrive afterwards are
+        refused.
+        """
+        self.cancel.set()
+        with self._lock:
+            pass
+
+    def server_close(self) -> None:
+        super().server_close()
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
+
+
+class _ControlHandler(socketserver.StreamRequestHandler):
+    server: ControlServer
+
+    def handle(self) -> None:
+        line = self.rfile.readline().decode("utf-8", errors="replace")
+        response = self.server.execute(line)
+        self.wfile.write(json.dumps(response).encode() + b"\n")
+
+
+def _remove_stale_socket(path: str) -> None:
+    """Remove socket left behind by a daemon that did not exit cleanly. Raise
+    DaemonException if another daemon still listens on it."""
+    try:
+        mode = os.stat(path).st_mode
+    except FileNotFoundError:
+        return
+    if not stat.S_ISSOCK(mode):
+        raise DaemonException(f"{path} exists and is not a socket")
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        try:
+            sock.connect(path)
+        except OSError:
+            os.unlink(path)
+            return
+    raise DaemonException(f"Another daemon is already listening on {path}")
+
+
+def send_command(path: str, command: List[str]) -> Dict[str, Any]:
+    """Send command to the daemon listening on 'path' and return its response."""
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(path)
+        sock.sendall(shlex.join(command).encode() + b"\n")
+        with sock.makefile("rb") as response:
+            line = response.readline()
+    try:
+        result: Dict[str, Any] = json.loads(line)
+    except ValueError as exc:
+        raise DaemonException(f"Invalid response from daemon: {exc}") from exc
+    return result
+
+
+def control_main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Send command to microovn-rebuilder running in daemon mode."
+    )
+    parser.add_argument(
+        "--socket",
+        default=default_socket_path(),
+        help=f"Path to the control socket of the daemon. (default: "
+        f"{default_socket_path()})",
+    )
+    parser.add_argument(
+        "command",
+        nargs="+",
+        help="One of: 'build' (rebuild and deploy OVN), 'deploy' (deploy changed "
+        "targets without building), 'restart [SERVICE...]' (restart services, all "
+        "services of the targets by default) or 'status' (result of the last cycle).",
+    )
+    args = parser.parse_args()
+
+    try:
+        response = send_command(args.socket, args.command)
+    except (OSError, DaemonException) as exc:
+        print(f"Failed to send command to daemon at {args.socket}: {exc}")
+        sys.exit(1)
+    print(json.dumps(response, indent=2))
+    if not response.get("ok"):
+        sys.exit(1)
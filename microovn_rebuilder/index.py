@@ -0,0 +1,232 @@
+import dataclasses
+import fnmatch
+import hashlib
+import json
+import os
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+from microovn_rebuilder.target import Target, TargetPattern
+
+
+def default_index_path() -> Path:
+    cache_dir = os.environ.get("XDG_CACHE_HOME") or Path.home() / ".cache"
+    return Path(cache_dir, "microovn-rebuilder", "index.json")
+
+
+def hash_file(path: Path) -> str:
+    with open(path, "rb") as f:
+        return hashlib.file_digest(f, "sha256").hexdigest()
+
+
+def _not_hidden(names: Iterable[str]) -> Tuple[str, ...]:
+    return tuple(name for name in names if not name.startswith("."))
+
+
+@dataclasses.dataclass(frozen=True)
+class FileRecord:
+    inode: int
+    size: int
+    mtime_ns: int
+    digest: str
+
+    def matches(self, stat: os.stat_result) -> bool:
+        return (self.inode, self.size, self.mtime_ns) == (
+            stat.st_ino,
+            stat.st_size,
+            stat.st_mtime_ns,
+        )
+
+
+@dataclasses.dataclass(frozen=True)
+class DirRecord:
+    mtime_ns: int
+    # Names of regular files in the directory
+    files: Tuple[str, ...]
+    # Names of symbolic links to regular files
+    links: Tuple[str, ...]
+    # Names of subdirectories, not following links
+    dirs: Tuple[str, ...]
+
+
+class ContentIndex:
+    """Persistent index of local file digests and of digests deployed to remotes.
+
+    Files are rehashed only when their (inode, size, mtime) changes, so repeated
+    change detection on unchanged build artifacts costs just a 'stat' call.
+    Similarly, directories that glob and directory targets expand against are
+    scanned again only when their mtime changes.
+    """
+
+    def __init__(self, path: Optional[Path] = None) -> None:
+        self.path = path
+        self.files: Dict[str, FileRecord] = {}
+        self.deployed: Dict[str, Dict[str, str]] = {}
+        # Glob and directory targets, see expand
+        self.patterns: List[TargetPattern] = []
+        # Listings of local directories, kept only in memory
+        self.dirs: Dict[str, DirRecord] = {}
+        self._expanded: Set[Target] = set()
+
+    def load(self) -> None:
+        if self.path is None:
+            return
+        try:
+            with open(self.path, "r") as f:
+                data = json.load(f)
+            files = {
+                path: FileRecord(**record) for path, record in data["files"].items()
+            }
+            deployed = data["deployed"]
+        except (OSError, ValueError, KeyError, TypeError):
+            # Missing or corrupted index is not fatal, it will be rebuilt.
+            return
+        self.files = files
+        self.deployed = deployed
+
+    def save(self) -> None:
+        if self.path is None:
+            return
+        data = {
+            "files": {
+                path: dataclasses.asdict(record) for path, record in self.files.items()
+            },
+            "deployed": self.deployed,
+        }
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_name(f"{self.path.name}.tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(data, f)
+        os.replace(tmp_path, self.path)
+
+    def digest(self, path: Path) -> Optional[str]:
+        """Return content digest of a local file, or None if it does not exist."""
+        key = str(Path(path).absolute())
+        try:
+            stat = os.stat(key)
+        except OSError:
+            self.files.pop(key, None)
+            return None
+
+        record = self.files.get(key)
+        if record is None or not record.matches(stat):
+            try:
+                digest = hash_file(Path(key))
+            except OSError:
+                return None
+            record = FileRecord(stat.st_ino, stat.st_size, stat.st_mtime_ns, digest)
+            self.files[key] = record
+
+        return record.digest
+
+    def list_dir(self, path: Path) -> Optional[DirRecord]:
+        """Return listing of a local directory, or None if it does not exist."""
+        key = str(Path(path).absolute())
+        try:
+            mtime_ns = os.stat(key).st_mtime_ns
+        except OSError:
+            self.dirs.pop(key, None)
+            return None
+
+        record = self.dirs.get(key)
+        if record is None or record.mtime_ns != mtime_ns:
+            files, links, dirs = [], [], []
+            try:
+                with os.scandir(key) as entries:
+                    for entry in entries:
+                        if entry.is_dir(follow_symlinks=False):
+                            dirs.append(entry.name)
+                        elif entry.is_file(follow_symlinks=False):
+                            files.append(entry.name)
+                        elif entry.is_file():
+                            links.append(entry.name)
+            except OSError:
+                return None
+            record = DirRecord(
+                mtime_ns,
+                tuple(sorted(files)),
+                tuple(sorted(links)),
+                tuple(sorted(dirs)),
+            )
+            self.dirs[key] = record
+
+        return record
+
+    def expand(self, targets: Set[Target]) -> None:
+        """Update 'targets' in place with targets of files that currently match
+        'patterns'.
+
+        Targets expanded by the previous call, whose files no longer match, are
+        removed. Only directories that changed since the previous call are scanned.
+        """
+        if not self.patterns:
+            return
+        explicit = targets - self._expanded
+        expanded = {
+            pattern.target(rel_path)
+            for pattern in self.patterns
+            for rel_path in self._match(pattern)
+        }
+        targets.difference_update(self._expanded - expanded)
+        targets.update(expanded)
+        self._expanded = expanded - explicit
+
+    def _match(self, pattern: TargetPattern) -> Iterator[str]:
+        """Yield paths of files matching the pattern, relative to its directory.
+
+        Wildcards match regular files and links to them (e.g. versioned names of
+        shared libraries), but hidden files only if the pattern starts with '.', as
+        in the shell. Directory patterns match only regular files, skipping links and
+        hidden files and directories like '.deps' or '.libs', as the watcher does.
+        """
+        if not pattern.recursive:
+            record = self.list_dir(pattern.local_dir)
+            if record is not None:
+                names = record.files + record.links
+                if not pattern.name_pattern.startswith("."):
+                    names = _not_hidden(names)
+                yield from fnmatch.filter(names, pattern.name_pattern)
+            return
+
+        pending = [""]
+        while pending:
+            rel_dir = pending.pop()
+            record = self.list_dir(pattern.local_dir / rel_dir)
+            if record is None:
+                continue
+            yield from (
+                os.path.join(rel_dir, name) for name in _not_hidden(record.files)
+            )
+            pending.extend(
+                os.path.join(rel_dir, name) for name in _not_hidden(record.dirs)
+            )
+
+    def deployed_digest(self, remote: str, target: Target) -> Optional[str]:
+        return self.deployed.get(remote, {}).get(str(target.remote_path))
+
+    def mark_deployed(
+        self, target: Target, remotes: Iterable[str], digest: Optional[str] = None
+    ) -> None:
+        digest = digest or self.digest(target.local_path)
+        if digest is None:
+            return
+        for remote in remotes:
+            self.deployed.setdefault(remote, {})[str(target.remote_path)] = digest
+
+    def seed(self, targets: Iterable[Target], remotes: Iterable[str]) -> None:
+        """Assume that remotes without a record run the current local build."""
+        remotes = list(remotes)
+        for target in targets:
+            unknown = [r for r in remotes if self.deployed_digest(r, target) is None]
+            if unknown:
+                self.mark_deployed(target, unknown)
+
+    def is_changed(self, target: Target, remotes: Iterable[str]) -> bool:
+        """Check if local file differs from the one last deployed to any remote.
+
+        Targets whose local file does not exist are never considered changed.
+        """
+        digest = self.digest(target.local_path)
+        if digest is None:
+            return False
+        return any(self.deployed_digest(remote, target) != digest for remote in remotes)
@@ -1,10 +1,86 @@
+import dataclasses
+import os
+import signal
 import subprocess
+import threading
+from typing import Iterable, List, Optional, Tuple
 
+from microovn_rebuilder.target import Target
+
+# How often (in seconds) is running build checked for cancellation
+CANCEL_POLL_INTERVAL = 0.2
+
+
+@dataclasses.dataclass(frozen=True)
+class BuildOptions:
+    # Number of parallel jobs passed to 'make'
+    jobs: int = 1
+    # Make goals to build. Default goal (everything) is built if empty.
+    goals: Tuple[str, ...] = ()
+    # Skip the build if 'make -q' reports that all goals are up to date
+    check_fresh: bool = False
+    # Upload targets as soon as they are built, while the build is still running
+    pipeline: bool = False
+
+
+def make_goals(targets: Iterable[Target]) -> Tuple[str, ...]:
+    """Return make goals that build local files of the targets."""
+    return tuple(sorted({target.local_rel_path for target in targets}))
+
+
+def is_fresh(ovn_dir: str, goals: Tuple[str, ...]) -> bool:
+    """Return True if 'make -q' reports that all goals are up to date."""
+    result = subprocess.run(["make", "-q", *goals], cwd=ovn_dir, capture_output=True)
+    # Return code 1 means that some goal is stale, 2 means that 'make' failed. In
+    # both cases the build has to run (and report the error, if any).
+    return result.returncode == 0
+
+
+def _make_command(options: BuildOptions) -> List[str]:
+    return ["make", f"-j{options.jobs}", *options.goals]
+
+
+def _terminate(process: subprocess.Popen) -> None:
+    os.killpg(process.pid, signal.SIGTERM)
+    process.communicate()
+
+
+def rebuild(
+    ovn_dir: str, options: BuildOptions, cancel: Optional[threading.Event] = None
+) -> bool:
+    """Run 'make' in the OVN directory and return True if it succeeded.
+
+    If 'cancel' event gets set while the build is running, 'make' is terminated and
+    the build is considered unsuccessful.
+    """
+    if options.check_fresh and is_fresh(ovn_dir, options.goals):
+        print(f"[local] OVN at {ovn_dir} is up to date, skipping the build")
+        return True
 
-def rebuild(ovn_dir: str, jobs: int) -> bool:
     print(f"[local] Rebuilding OVN at {ovn_dir}")
-    result = subprocess.run(["make", f"-j{jobs}"], cwd=ovn_dir, capture_output=True)
-    if result.returncode != 0:
-        print(result.stdout.decode("utf-8"))
-        print(result.stderr.decode("utf-8"))
-    return not result.returncode
+    process = subprocess.Popen(
+        _make_command(options),
+        cwd=ovn_dir,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        # Own process group allows to terminate 'make' together with its children
+        start_new_session=True,
+    )
+    try:
+        while True:
+            try:
+                stdout, stderr = process.communicate(timeout=CANCEL_POLL_INTERVAL)
+                break
+            except subprocess.TimeoutExpired:
+                if cancel is not None and cancel.is_set():
+                    _terminate(process)
+                    print("[local] Build cancelled")
+                    return False
+    except KeyboardInterrupt:
+        _terminate(process)
+        raise
+
+    if process.returncode != 0:
+        print(stdout.decode("utf-8"))
+        print(stderr.decode("utf-8"))
+    return not process.returncode
@@ -0,0 +1,99 @@
+import os
+import threading
+import time
+from typing import Dict, Optional, Set, Tuple
+
+from microovn_rebuilder.index import ContentIndex
+from microovn_rebuilder.remote import BaseConnector, ConnectorException
+from microovn_rebuilder.target import Target
+
+# How often (in seconds) are local files of targets checked during the build
+POLL_INTERVAL = 0.2
+
+# Local file must stay unchanged for this long (in seconds) before it is uploaded, so
+# that files that are still being written by the linker are not uploaded.
+STABLE_AFTER = 1.0
+
+Signature = Tuple[int, int, int]
+
+
+def _signature(target: Target) -> Optional[Signature]:
+    try:
+        stat = os.stat(target.local_path)
+    except OSError:
+        return None
+    return stat.st_ino, stat.st_size, stat.st_mtime_ns
+
+
+class TargetShipper:
+    """Upload targets to remotes as soon as the build writes them.
+
+    A background thread started with 'start' watches local files of the targets
+    while OVN is being built. A file that was written during the build, stopped
+    changing and differs from the deployed one is uploaded right away to its staging
+    path (see BaseConnector.stage). Remote files are replaced and services restarted
+    only once the whole build succeeds.
+    """
+
+    def __init__(
+        self, targets: Set[Target], connector: BaseConnector, index: ContentIndex
+    ) -> None:
+        self.targets = targets
+        self.connector = connector
+        self.index = index
+
+        self._baseline: Dict[Target, Optional[Signature]] = {}
+        self._observed: Dict[Target, Tuple[Signature, float]] = {}
+        self._shipped: Dict[Target, Signature] = {}
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        self._baseline = {target: _signature(target) for target in self.targets}
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def shipped(self) -> Set[Target]:
+        """Return targets whose current local files were already staged."""
+        return {
+            target
+            for target, signature in self._shipped.items()
+            if _signature(target) == signature
+        }
+
+    def poll(self) -> None:
+        now = time.monotonic()
+        for target in self.targets:
+            signature = _signature(target)
+            if signature is None or signature in (
+                self._baseline.get(target),
+                self._shipped.get(target),
+            ):
+                continue
+
+            observed = self._observed.get(target)
+            if observed is None or observed[0] != signature:
+                self._observed[target] = (signature, now)
+                continue
+            if now - observed[1] < STABLE_AFTER:
+                continue
+
+            if self.index.is_changed(target, self.connector.remotes):
+                print(f"[local] {target.local_path} is built, uploading it")
+                try:
+                    self.connector.stage({target})
+                except ConnectorException as exc:
+                    # Upload is retried once the build finishes
+                    print(exc)
+                    self._baseline[target] = signature
+                    continue
+            self._shipped[target] = signature
+
+    def _run(self) -> None:
+        while not self._stop.wait(POLL_INTERVAL):
+            self.poll()
@@ -1,39 +1,95 @@
-from .base import BaseConnector, ConnectorException
-from .lxd import LXDConnector
+import dataclasses
+from typing import Dict, List, Optional, Type
+
+from .aio import AsyncConnector, ThreadedConnector
+from .base import (
+    BaseConnector,
+    ConnectorException,
+    ConnectorOptions,
+    UpdateException,
+)
+from .composite import CompositeConnector
+from .lxd import AsyncLXDConnector, LXDConnector
+from .lxd_api import LXDAPIConnector
 from .ssh import SSHConnector
 
-_CONNECTORS = {
+_CONNECTORS: Dict[str, Type[BaseConnector]] = {
     "lxd": LXDConnector,
+    "lxd-api": LXDAPIConnector,
     "ssh": SSHConnector,
 }
 
+# Connectors with native asyncio implementation. Other connectors run on the asyncio
+# engine wrapped in ThreadedConnector.
+_ASYNC_CONNECTORS: Dict[str, Type[AsyncConnector]] = {
+    "lxd": AsyncLXDConnector,
+}
+
 
-def create_connector(remote_spec: str) -> BaseConnector:
-    remotes = []
-    types = set()
+def create_connector(
+    remote_spec: str,
+    options: Optional[ConnectorOptions] = None,
+    use_async: bool = False,
+    type_parallel: Optional[Dict[str, int]] = None,
+) -> BaseConnector:
+    """Create and initialize connector for remotes in 'remote_spec'.
+
+    Remotes of different connector types are driven by CompositeConnector, with one
+    connector per type. 'type_parallel' overrides the 'parallel' option for remotes
+    of the given connector types.
+    """
+    remotes: Dict[str, List[str]] = {}
     for spec in remote_spec.split(","):
         connector_type, found, remote = spec.partition(":")
         if not found:
             raise ConnectorException(
                 f"'{spec}' is not valid remote specification. Expected format is '<remote_type>:<remote_address>'"
             )
+        if connector_type not in _CONNECTORS:
+            raise ConnectorException(
+                f"{connector_type} is not a valid connector type. Available types: {", ".join(_CONNECTORS.keys())}"
+            )
+        if any(remote in type_remotes for type_remotes in remotes.values()):
+            raise ConnectorException(
+                f"'{remote_spec}' is not valid remote specification. Remote '{remote}' is listed more than once"
+            )
 
-        remotes.append(remote)
-        types.add(connector_type)
-
-    if len(types) != 1:
-        raise ConnectorException(
-            f"'{remote_spec}' is not valid remote specification. All remotes must be of the same type'"
-        )
+        remotes.setdefault(connector_type, []).append(remote)
 
-    connector_type = types.pop()
-    connector_class = _CONNECTORS.get(connector_type)
-    if connector_class is None:
-        raise ConnectorException(
-            f"{connector_type} is not a valid connector type. Available types: {", ".join(_CONNECTORS.keys())}"
+    options = options or ConnectorOptions()
+    connectors = {
+        connector_type: _create_single(
+            connector_type,
+            type_remotes,
+            dataclasses.replace(
+                options,
+                parallel=(type_parallel or {}).get(connector_type, options.parallel),
+            ),
+            use_async,
         )
+        for connector_type, type_remotes in remotes.items()
+    }
 
-    connector = connector_class(remotes)
+    connector: BaseConnector
+    if len(connectors) == 1:
+        (connector,) = connectors.values()
+    else:
+        connector = CompositeConnector(connectors, options)
     connector.initialize()
 
     return connector
+
+
+def _create_single(
+    connector_type: str,
+    remotes: List[str],
+    options: ConnectorOptions,
+    use_async: bool,
+) -> BaseConnector:
+    connector_class = _CONNECTORS[connector_type]
+    async_class = _ASYNC_CONNECTORS.get(connector_type)
+    if not use_async:
+        return connector_class(remotes, options)
+    if async_class is not None:
+        return async_class(remotes, options)
+    return ThreadedConnector(connector_class(remotes, options))
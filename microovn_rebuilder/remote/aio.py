@@ -0,0 +1,160 @@
+import asyncio
+import threading
+from pathlib import Path
+from typing import Any, Coroutine, Dict, List, Optional, Set, TypeVar
+
+from microovn_rebuilder.remote.base import (
+    BaseConnector,
+    ConnectorException,
+    RemoteAction,
+)
+from microovn_rebuilder.target import Target
+
+T = TypeVar("T")
+
+
+class AsyncConnector(BaseConnector):
+    """Connector that works on all remotes from a single thread, using asyncio.
+
+    Each remote is handled by its own task on an event loop that runs in a background
+    thread. Up to 'parallel' remotes are worked on at once, with up to 'channels'
+    uploads in flight on each of them. Public methods block until the tasks finish.
+    If the wait is interrupted (Ctrl-C), all in-flight tasks are cancelled before
+    the KeyboardInterrupt is re-raised.
+
+    Subclasses implement asynchronous variants of BaseConnector's remote operations.
+    """
+
+    def __init__(self, *args: Any, **kwargs: Any) -> None:
+        super().__init__(*args, **kwargs)
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread: Optional[threading.Thread] = None
+        self._loop_lock = threading.Lock()
+
+    def initialize(self) -> None:
+        self._event_loop()
+
+    def teardown(self) -> None:
+        with self._loop_lock:
+            if self._loop is None or self._loop_thread is None:
+                return
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._loop_thread.join()
+            self._loop.close()
+            self._loop = self._loop_thread = None
+
+    def _run_on_remotes(
+        self,
+        action: RemoteAction,
+        parallel: Optional[int] = None,
+        remotes: Optional[List[str]] = None,
+    ) -> None:
+        """Execute 'action' for each remote (or each of 'remotes') in its own task,
+        up to 'parallel' at once ('self.parallel' by default).
+
+        Output of each task is printed as a single block once the task finishes and
+        failures on all remotes are raised together as a single ConnectorException.
+        """
+        self._run_coroutine(
+            self._on_remotes(
+                action,
+                parallel or self.parallel,
+                self.remotes if remotes is None else remotes,
+            )
+        )
+
+    async def _on_remotes(
+        self, action: RemoteAction, parallel: int, remotes: List[str]
+    ) -> None:
+        limit = asyncio.Semaphore(parallel)
+
+        async def run(remote: str) -> Optional[ConnectorException]:
+            async with limit:
+                return await self._run_action(action, remote, buffered=True)
+
+        async with asyncio.TaskGroup() as group:
+            tasks = [group.create_task(run(remote)) for remote in remotes]
+        self._raise_errors(task.result() for task in tasks)
+
+    def _run_coroutine(self, coroutine: Coroutine[Any, Any, T]) -> T:
+        """Run coroutine on the event loop and wait for its result."""
+        loop = self._event_loop()
+        future = asyncio.run_coroutine_threadsafe(coroutine, loop)
+        try:
+            return future.result()
+        except KeyboardInterrupt:
+            future.cancel()
+            # Wait until the cancelled tasks clean up (e.g. kill their processes)
+            asyncio.run_coroutine_threadsafe(self._drain(), loop).result()
+            raise
+
+    @staticmethod
+    async def _drain() -> None:
+        tasks = asyncio.all_tasks() - {asyncio.current_task()}
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def _event_loop(self) -> asyncio.AbstractEventLoop:
+        with self._loop_lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                self._loop_thread = threading.Thread(
+                    target=self._loop.run_forever, daemon=True
+                )
+                self._loop_thread.start()
+            return self._loop
+
+
+class ThreadedConnector(AsyncConnector):
+    """Run connector that uses blocking I/O (paramiko, http.client) on the asyncio
+    engine.
+
+    Remotes are still handled by tasks of the event loop, but each remote operation of
+    the wrapped connector runs in a worker thread. Worker threads share the output
+    group of the task, so output of the wrapped connector is grouped with it.
+    """
+
+    def __init__(self, connector: BaseConnector) -> None:
+        super().__init__(remotes=connector.remotes, options=connector.options)
+        self.connector = connector
+        # Throughput measured by either side decides compression of the uploads made
+        # by the other, see BaseConnector._compression
+        self.throughput = connector.throughput
+
+    def initialize(self) -> None:
+        self.connector.initialize()
+        self.remotes = self.connector.remotes
+        super().initialize()
+
+    def teardown(self) -> None:
+        self.connector.teardown()
+        super().teardown()
+
+    def check_remote(self, remote_dst: str) -> None:
+        self.connector.check_remote(remote_dst)
+        self.remotes = self.connector.remotes
+
+    async def _transfer_target_async(self, remote: str, target: Target) -> None:
+        await asyncio.to_thread(self.connector._transfer_target, remote, target)
+
+    async def _transfer_archive_async(
+        self, remote: str, archive: Path, targets: Set[Target]
+    ) -> None:
+        await asyncio.to_thread(
+            self.connector._transfer_archive, remote, archive, targets
+        )
+
+    async def _restart_services_async(self, remote: str, services: List[str]) -> None:
+        await asyncio.to_thread(self.connector._restart_services, remote, services)
+
+    async def _remote_checksums_async(
+        self, remote: str, targets: Set[Target]
+    ) -> Dict[Target, Optional[str]]:
+        return await asyncio.to_thread(self.connector._remote_checksums, remote, targets)
+
+    async def _run_script_async(self, remote: str, script: str) -> None:
+        await asyncio.to_thread(self.connector._run_script, remote, script)
+
+    async def _forward_target_async(
+        self, source: str, remote: str, target: Target
+    ) -> None:
+        await asyncio.to_thread(self.connector._forward_target, source, remote, target)
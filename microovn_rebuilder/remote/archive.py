@@ -0,0 +1,59 @@
+import shlex
+import tarfile
+import tempfile
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterable, Iterator, List, Optional
+
+from microovn_rebuilder.target import Target
+
+# Command that extracts archive created by 'target_archive' from stdin on the remote
+# host. Files are extracted to their absolute staging paths, keeping their modes.
+EXTRACT_COMMAND: List[str] = ["tar", "-x", "-p", "-C", "/", "-f", "-"]
+
+
+def extract_command(targets: Iterable[Target], codec: Optional[str] = None) -> str:
+    """Shell command that extracts the archive from stdin and then renames each
+    extracted file over the target's remote path."""
+    command = EXTRACT_COMMAND
+    if codec is not None:
+        command = [*command, f"--use-compress-program={codec}"]
+    return " && ".join([shlex.join(command), rename_command(targets)])
+
+
+def rename_command(targets: Iterable[Target]) -> str:
+    """Shell command that renames staging path of each target over its remote path."""
+    return " && ".join(
+        shlex.join(["mv", "-f", str(target.staging_path), str(target.remote_path)])
+        for target in _sorted(targets)
+    )
+
+
+def _sorted(targets: Iterable[Target]) -> List[Target]:
+    return sorted(targets, key=lambda t: str(t.remote_path))
+
+
+def _as_root(info: tarfile.TarInfo) -> tarfile.TarInfo:
+    info.uid = info.gid = 0
+    info.uname = info.gname = "root"
+    return info
+
+
+@contextmanager
+def target_archive(targets: Iterable[Target]) -> Iterator[Path]:
+    """Pack local files of all targets into a temporary tar archive.
+
+    Members are named after the targets' staging paths (relative to '/') and the
+    archive is removed when the context exits.
+    """
+    with tempfile.TemporaryDirectory(prefix="microovn-rebuilder-") as tmp_dir:
+        archive_path = Path(tmp_dir, "targets.tar")
+        with tarfile.open(archive_path, "w") as archive:
+            for target in _sorted(targets):
+                archive.add(
+                    target.local_path,
+                    arcname=str(target.staging_path).lstrip("/"),
+                    recursive=False,
+                    filter=_as_root,
+                )
+        yield archive_path
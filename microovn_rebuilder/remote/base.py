@@ -1,17 +1,168 @@
+import asyncio
+import contextvars
+import dataclasses
+import inspect
+import os
+import threading
+import time
 from abc import ABC, abstractmethod
-from typing import List
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager, nullcontext
+from pathlib import Path
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Awaitable,
+    Callable,
+    Coroutine,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Set,
+    Tuple,
+    TypeVar,
+)
 
+from microovn_rebuilder.remote.archive import rename_command, target_archive
+from microovn_rebuilder.remote.fanout import forward_round
+from microovn_rebuilder.remote.hooks import (
+    pre_exec_command,
+    pre_exec_hooks,
+    readiness_command,
+    readiness_probes,
+)
+from microovn_rebuilder.report import Timing, TransferProgress, measure
 from microovn_rebuilder.target import Target
 
+if TYPE_CHECKING:  # pragma: no cover
+    from microovn_rebuilder.strip import StripCache
+
+T = TypeVar("T")
+
+# Work done on a single remote, either a plain function or a coroutine function
+RemoteAction = Callable[[str], Optional[Awaitable[None]]]
+
+# Messages printed by the work on a single remote, see BaseConnector._grouped_output
+_output_buffer: contextvars.ContextVar[Optional[List[str]]] = contextvars.ContextVar(
+    "output_buffer", default=None
+)
+
 
 class ConnectorException(Exception):
     pass
 
 
+class UpdateException(ConnectorException):
+    """Update failed on some of the remotes. 'updated' lists the remotes where the
+    targets were uploaded and their services restarted nevertheless."""
+
+    def __init__(self, message: str, updated: List[str]) -> None:
+        super().__init__(message)
+        self.updated = updated
+
+
+@dataclasses.dataclass(frozen=True)
+class ConnectorOptions:
+    # Number of remotes that are updated concurrently
+    parallel: int = 1
+    # Transfer all changed targets to each remote in a single tar archive
+    bulk: bool = False
+    # Upload only changed blocks of files that already exist on the remote (SSH only)
+    delta: bool = False
+    # Number of files uploaded concurrently to each remote (SSH only, unless the
+    # connector runs on the asyncio engine)
+    channels: int = 1
+    # Codec used to compress uploaded files (see remote.compression.CODECS)
+    compression: Optional[str] = None
+    # Compression level passed to the codec, codec's default is used if not set
+    compression_level: Optional[int] = None
+    # Compress uploads only to remotes with measured throughput (in MB/s) below this
+    # value. If not set, uploads are always compressed when 'compression' is set.
+    compression_threshold: Optional[float] = None
+    # Time limit (in seconds) for each pre_exec hook of the targets
+    pre_exec_timeout: float = 60.0
+    # Number of remotes that restart services at the same time, 'parallel' if not set
+    restart_window: Optional[int] = None
+    # Time limit (in seconds) for restarted services to pass their readiness probes
+    ready_timeout: float = 120.0
+    # Upload files from the local host only to this many remotes ("seeds"), which then
+    # forward them to the other remotes. All remotes get files from the local host if
+    # not set.
+    fanout: Optional[int] = None
+    # Time limit (in seconds) for connecting to each remote and checking it at startup
+    connect_timeout: float = 10.0
+    # Continue only with remotes that are reachable at startup, instead of failing
+    skip_unreachable: bool = False
+
+
+# Uploads smaller than this are not used for measuring link throughput
+MIN_MEASURED_SIZE = 1024 * 1024
+
+# Time limit (in seconds) for a single run of the readiness probes
+PROBE_TIMEOUT = 10.0
+# Delays (in seconds) between failed runs of the readiness probes. The delay starts
+# at the first value and doubles after each failure, up to the second value.
+PROBE_BACKOFF = (0.5, 5.0)
+
+
+def _local_size(path: Path) -> Optional[int]:
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return None
+
+
+def _targets_size(targets: Iterable[Target]) -> int:
+    return sum(_local_size(target.local_path) or 0 for target in targets)
+
+
+def transfer_order(targets: Iterable[Target]) -> List[Target]:
+    """Return targets in the order in which they should be uploaded.
+
+    Targets that restart a service go first, so that a small utility does not delay
+    the upload of a daemon. Larger files go before smaller ones, so that when files
+    are uploaded over multiple channels, the small files fill the gaps at the end,
+    instead of a large file starting last and keeping the other channels idle.
+    """
+    return sorted(
+        targets,
+        key=lambda target: (
+            target.service is None,
+            -(_local_size(target.local_path) or 0),
+            str(target.remote_path),
+        ),
+    )
+
+
 class BaseConnector(ABC):
+    """Connector that updates remotes over some transport.
+
+    Updates are orchestrated by coroutines that each work on a single remote, and
+    _run_on_remotes decides how they run: this class runs each of them to completion
+    in its own thread, AsyncConnector runs all of them as tasks of one event loop.
+
+    Connectors implement either the blocking or the asynchronous variant of each
+    remote operation (e.g. _transfer_target or _transfer_target_async). By default,
+    each variant calls the other one.
+    """
 
-    def __init__(self, remotes: List[str]) -> None:
+    def __init__(
+        self, remotes: List[str], options: Optional[ConnectorOptions] = None
+    ) -> None:
         self.remotes = remotes
+        self.options = options or ConnectorOptions()
+        self.parallel = max(self.options.parallel, 1)
+        # Last measured upload throughput (in bytes per second) of each remote
+        self.throughput: Dict[str, float] = {}
+        # Store of stripped copies that are uploaded in place of targets with 'strip'
+        self.strip_cache: Optional["StripCache"] = None
+
+        self._output_lock = threading.Lock()
+        self._timings: List[Timing] = []
+        # Progress of the running transfer, see _start_progress
+        self._progress: Optional[TransferProgress] = None
 
     @abstractmethod
     def initialize(self) -> None:
@@ -25,6 +176,653 @@ class BaseConnector(ABC):
     def check_remote(self, remote_dst: str) -> None:
         pass  # pragma: no cover
 
-    @abstractmethod
-    def update(self, target: Target) -> None:
-        pass  # pragma: no cover
+    def _transfer_target(self, remote: str, target: Target) -> None:
+        self._run_coroutine(self._transfer_target_async(remote, target))
+
+    async def _transfer_target_async(self, remote: str, target: Target) -> None:
+        self._transfer_target(remote, target)
+
+    def _transfer_archive(
+        self, remote: str, archive: Path, targets: Set[Target]
+    ) -> None:
+        self._run_coroutine(self._transfer_archive_async(remote, archive, targets))
+
+    async def _transfer_archive_async(
+        self, remote: str, archive: Path, targets: Set[Target]
+    ) -> None:
+        self._transfer_archive(remote, archive, targets)
+
+    def _restart_services(self, remote: str, services: List[str]) -> None:
+        self._run_coroutine(self._restart_services_async(remote, services))
+
+    async def _restart_services_async(self, remote: str, services: List[str]) -> None:
+        self._restart_services(remote, services)
+
+    def _remote_checksums(
+        self, remote: str, targets: Set[Target]
+    ) -> Dict[Target, Optional[str]]:
+        return self._run_coroutine(self._remote_checksums_async(remote, targets))
+
+    async def _remote_checksums_async(
+        self, remote: str, targets: Set[Target]
+    ) -> Dict[Target, Optional[str]]:
+        return self._remote_checksums(remote, targets)
+
+    def _run_script(self, remote: str, script: str) -> None:
+        self._run_coroutine(self._run_script_async(remote, script))
+
+    async def _run_script_async(self, remote: str, script: str) -> None:
+        self._run_script(remote, script)
+
+    def _forward_target(self, source: str, remote: str, target: Target) -> None:
+        """Copy target's remote file from the 'source' remote to the 'remote'."""
+        self._run_coroutine(self._forward_target_async(source, remote, target))
+
+    async def _forward_target_async(
+        self, source: str, remote: str, target: Target
+    ) -> None:
+        self._forward_target(source, remote, target)
+
+    def update_many(
+        self, targets: Set[Target], staged: Optional[Set[Target]] = None
+    ) -> None:
+        """Upload all targets to every remote and restart affected services.
+
+        pre_exec hooks of all targets run first, with a single invocation on each
+        remote. All uploads finish before any service is restarted. Remotes where the
+        upload succeeded then restart all affected services with a single command, as
+        a rolling restart, see restart. Targets in 'staged' were already uploaded by
+        'stage', so their staged files are only moved into place.
+
+        Failures on any remote are raised together as UpdateException, once the
+        other remotes are updated.
+        """
+        staged = targets & (staged or set())
+        pending = targets - staged
+        self.pre_exec({remote: targets for remote in self.remotes})
+        updated = self.remotes
+        errors: List[str] = []
+        if pending:
+            updated, error = self._transfer(self.upload_targets(pending))
+            if error is not None:
+                errors.append(str(error))
+        if staged:
+            updated, error = self._apply_staged(staged, updated)
+            if error is not None:
+                errors.append(str(error))
+        services = self._services(targets)
+        if services:
+            probes = readiness_probes(targets)
+            updated, error = self._restart_remotes(
+                {remote: (services, probes) for remote in updated}
+            )
+            if error is not None:
+                errors.append(str(error))
+        if errors:
+            raise UpdateException(os.linesep.join(errors), updated)
+
+    def stage(self, targets: Set[Target]) -> None:
+        """Upload targets to their staging paths on every remote.
+
+        Remote files of the targets stay in place, so services that run them are not
+        affected until 'apply_staged' moves the staged files over them.
+        """
+        self.transfer({self.upload_target(target).staged() for target in targets})
+
+    def apply_staged(self, targets: Set[Target]) -> None:
+        """Move files uploaded by 'stage' over remote files of the targets on every
+        remote, after running pre_exec hooks of the targets."""
+        self.pre_exec({remote: targets for remote in self.remotes})
+        _, error = self._apply_staged(targets, self.remotes)
+        if error is not None:
+            raise error
+
+    def _apply_staged(
+        self, targets: Set[Target], remotes: List[str]
+    ) -> Tuple[List[str], Optional[ConnectorException]]:
+        """Move staged files of targets into place on 'remotes', returning remotes
+        where it succeeded and the failures on the other remotes."""
+        command = rename_command(targets)
+
+        async def apply(remote: str) -> None:
+            self._print(f"[{remote}] Replacing {len(targets)} staged file(s)")
+            await self._run_script_async(remote, command)
+
+        return self._ordered(*self._run_on_some(apply, remotes))
+
+    def transfer(self, targets: Set[Target]) -> None:
+        """Upload all targets to every remote, without restarting any services.
+
+        In bulk mode, targets are packed into a single archive that is extracted on
+        each remote with one command. Otherwise, targets are uploaded one by one.
+        pre_exec hooks of the targets run on all remotes before any file is uploaded.
+        """
+        targets = self.upload_targets(targets)
+        self.pre_exec({remote: targets for remote in self.remotes})
+        _, error = self._transfer(targets)
+        if error is not None:
+            raise error
+
+    def _transfer(
+        self, targets: Set[Target]
+    ) -> Tuple[List[str], Optional[ConnectorException]]:
+        """Upload targets, which are already replaced by their upload targets, to
+        every remote, without running their pre_exec hooks, see transfer. Return
+        remotes that received the targets and the failures on the other remotes."""
+        self._start_progress([targets] * self._local_uploads())
+        if self._fanout_enabled():
+            return self._ordered(*self._transfer_tree(targets))
+        return self._ordered(*self._upload_to(self.remotes, targets))
+
+    def restart(self, services: List[str], probes: Optional[List[str]] = None) -> None:
+        """Restart services on every remote, up to 'restart_window' remotes at once.
+
+        With readiness probes, the restart of a remote finishes only once all probes
+        pass on it, so the next remote starts restarting only after that. If a remote
+        fails to restart or does not get ready within 'ready_timeout', the remaining
+        remotes are not restarted.
+        """
+        if not services:
+            return
+        _, error = self._restart_remotes(
+            {remote: (services, probes or []) for remote in self.remotes}
+        )
+        if error is not None:
+            raise error
+
+    def _restart_remotes(
+        self, plan: Dict[str, Tuple[List[str], List[str]]]
+    ) -> Tuple[List[str], Optional[ConnectorException]]:
+        """Restart services of each remote in 'plan' and wait for its readiness
+        probes to pass, as a rolling restart described in restart. Return remotes
+        that restarted and the failures on the other remotes."""
+        halted = threading.Event()
+
+        async def restart_remote(remote: str) -> None:
+            if halted.is_set():
+                raise ConnectorException(
+                    f"[{remote}] Restart skipped after failure on another remote"
+                )
+            services, probes = plan[remote]
+            try:
+                await self._restart_services_timed_async(remote, services)
+                if probes:
+                    await self._wait_ready_async(remote, probes)
+            except ConnectorException:
+                if probes:
+                    halted.set()
+                raise
+
+        return self._ordered(
+            *self._run_on_some(
+                restart_remote,
+                list(plan),
+                parallel=self.options.restart_window or self.parallel,
+            )
+        )
+
+    def remote_checksums(
+        self, targets: Set[Target]
+    ) -> Dict[str, Dict[Target, Optional[str]]]:
+        """Return SHA-256 checksums of remote files of targets on every remote.
+
+        Each remote computes checksums of all targets with a single command. Targets
+        whose remote file does not exist have checksum None.
+        """
+        checksums: Dict[str, Dict[Target, Optional[str]]] = {}
+
+        async def collect(remote: str) -> None:
+            with measure(self._timings, "checksum", remote=remote):
+                checksums[remote] = await self._remote_checksums_async(remote, targets)
+
+        self._run_on_remotes(collect)
+        return checksums
+
+    def sync(self, pending: Dict[str, Set[Target]]) -> None:
+        """Upload different set of targets to each remote and restart their services.
+
+        Remotes missing from 'pending' are left untouched. All uploads finish before
+        any service is restarted. Remotes where the upload succeeded then restart
+        services of their targets as a rolling restart, see restart.
+        """
+        pending = {
+            remote: self.upload_targets(targets) for remote, targets in pending.items()
+        }
+        self.pre_exec(pending)
+        self._start_progress(pending.values())
+
+        async def upload(remote: str) -> None:
+            targets = pending[remote]
+            if self.options.bulk:
+                with target_archive(targets) as archive:
+                    await self._transfer_archive_timed_async(remote, archive, targets)
+            else:
+                await self._transfer_targets_async(remote, targets)
+
+        uploaded, error = self._run_on_some(
+            upload, [remote for remote in self.remotes if pending.get(remote)]
+        )
+        errors = [] if error is None else [str(error)]
+        plan = {}
+        for remote in self.remotes:
+            services = self._services(pending.get(remote, set()))
+            if remote in uploaded and services:
+                plan[remote] = (services, readiness_probes(pending[remote]))
+        _, error = self._restart_remotes(plan)
+        if error is not None:
+            errors.append(str(error))
+        if errors:
+            raise ConnectorException(os.linesep.join(errors))
+
+    def pre_exec(self, pending: Dict[str, Set[Target]]) -> None:
+        """Run pre_exec hooks of targets on each remote.
+
+        All hooks for a remote run in a single shell invocation, each limited by
+        'pre_exec_timeout'. Remotes run their hooks concurrently, regardless of the
+        'parallel' option.
+        """
+        scripts = self._hook_scripts(pending)
+        if not scripts:
+            return
+
+        async def run(remote: str) -> None:
+            script = scripts.get(remote)
+            if script is None:
+                return
+            count = len(pre_exec_hooks(pending[remote]))
+            self._print(f"[{remote}] Running {count} pre_exec hook(s)")
+            with measure(self._timings, "pre_exec", remote=remote):
+                await self._run_script_async(remote, script)
+
+        self._run_on_remotes(run, parallel=len(self.remotes))
+
+    def upload_target(self, target: Target) -> Target:
+        """Return target that is uploaded in place of 'target'.
+
+        Targets with 'strip' enabled upload stripped copy of their local file, if the
+        strip cache is set.
+        """
+        if self.strip_cache is None:
+            return target
+        return self.strip_cache.stripped(target)
+
+    def upload_targets(self, targets: Set[Target]) -> Set[Target]:
+        return {self.upload_target(target) for target in targets}
+
+    def collect_timings(self) -> List[Timing]:
+        """Return timings of remote operations recorded since the last call."""
+        timings, self._timings = self._timings, []
+        return timings
+
+    def _fanout_enabled(self) -> bool:
+        fanout = self.options.fanout
+        return fanout is not None and 0 < fanout < len(self.remotes)
+
+    def _transfer_tree(
+        self, targets: Set[Target]
+    ) -> Tuple[List[str], Optional[ConnectorException]]:
+        """Upload targets to the first 'fanout' remotes, which forward them to the
+        other remotes in a tree.
+
+        In each round, every remote that already has the targets forwards them to one
+        remote that does not, so the amount of data uploaded from the local host does
+        not grow with the number of remotes. Remotes that failed to receive the
+        targets do not forward them further. Return remotes that received the targets
+        and the failures on the other remotes.
+        """
+        assert self.options.fanout is not None
+        seeds = self.remotes[: self.options.fanout]
+        pending = self.remotes[self.options.fanout :]
+        errors: List[str] = []
+
+        holders, error = self._upload_to(seeds, targets)
+        if error is not None:
+            errors.append(str(error))
+        while pending and holders:
+            sources = forward_round(holders, pending)
+            pending = pending[len(sources) :]
+            forwarded, error = self._forward_round(sources, targets)
+            if error is not None:
+                errors.append(str(error))
+            holders = holders + forwarded
+        errors.extend(
+            f"[{remote}] No remote to forward files from" for remote in pending
+        )
+        if errors:
+            return holders, ConnectorException(os.linesep.join(errors))
+        return holders, None
+
+    def _upload_to(
+        self, remotes: List[str], targets: Set[Target]
+    ) -> Tuple[List[str], Optional[ConnectorException]]:
+        """Upload targets from the local host to 'remotes'. In bulk mode, targets
+        are packed into a single archive that is extracted on each remote with one
+        command."""
+        if not self.options.bulk:
+            return self._run_on_some(
+                lambda remote: self._transfer_targets_async(remote, targets), remotes
+            )
+        with target_archive(targets) as archive:
+            return self._run_on_some(
+                lambda remote: self._transfer_archive_timed_async(
+                    remote, archive, targets
+                ),
+                remotes,
+            )
+
+    def _forward_round(
+        self, sources: Dict[str, str], targets: Set[Target]
+    ) -> Tuple[List[str], Optional[ConnectorException]]:
+        """Forward targets to each remote in 'sources' from its source remote, all
+        at once, as forwarding does not use the local host's uplink."""
+
+        async def forward(remote: str) -> None:
+            self._print(
+                f"{os.linesep}[{remote}] Forwarding {len(targets)} file(s) from "
+                f"{sources[remote]}"
+            )
+            for target in transfer_order(targets):
+                await self._forward_target_timed_async(sources[remote], remote, target)
+
+        return self._run_on_some(forward, list(sources), parallel=len(sources))
+
+    async def _forward_target_timed_async(
+        self, source: str, remote: str, target: Target
+    ) -> None:
+        with measure(
+            self._timings,
+            "forward",
+            remote=remote,
+            target=str(target.remote_path),
+            size=_local_size(target.local_path),
+        ):
+            await self._forward_target_async(source, remote, target)
+
+    def _run_on_reachable(self, action: RemoteAction) -> None:
+        """Execute 'action' (connecting to or checking a remote) on all remotes at
+        once and handle the remotes where it failed, see _keep_reachable."""
+        self._keep_reachable(
+            *self._run_on_some(action, self.remotes, parallel=len(self.remotes))
+        )
+
+    def _keep_reachable(
+        self, reachable: List[str], error: Optional[ConnectorException]
+    ) -> None:
+        """Raise 'error' from the remotes that are not reachable or, if
+        'skip_unreachable' is set, drop them and continue with the 'reachable'
+        remotes, as long as there is any."""
+        if error is None:
+            return
+        if not self.options.skip_unreachable or not reachable:
+            raise error
+        self._print(f"Continuing without unreachable remote hosts:{os.linesep}{error}")
+        self.remotes = [remote for remote in self.remotes if remote in reachable]
+
+    def _run_on_some(
+        self,
+        action: RemoteAction,
+        remotes: List[str],
+        parallel: Optional[int] = None,
+    ) -> Tuple[List[str], Optional[ConnectorException]]:
+        """Execute 'action' for each of 'remotes', returning remotes where it
+        succeeded and the failures on the other remotes."""
+        succeeded: List[str] = []
+
+        async def run(remote: str) -> None:
+            result = action(remote)
+            if inspect.isawaitable(result):
+                await result
+            succeeded.append(remote)
+
+        try:
+            self._run_on_remotes(run, parallel=parallel, remotes=remotes)
+        except ConnectorException as exc:
+            return succeeded, exc
+        return succeeded, None
+
+    def _ordered(
+        self, remotes: List[str], error: Optional[ConnectorException]
+    ) -> Tuple[List[str], Optional[ConnectorException]]:
+        """Return 'remotes', which are in the order they finished in, in the order of
+        self.remotes, along with 'error'."""
+        return [remote for remote in self.remotes if remote in remotes], error
+
+    async def _transfer_targets_async(self, remote: str, targets: Set[Target]) -> None:
+        """Upload targets to the remote, up to 'channels' of them concurrently, in the
+        order given by transfer_order.
+
+        With multiple channels, output of each upload is printed as a single block.
+        No upload starts after an upload failed, failures of the uploads that were
+        already in flight are raised together as a single ConnectorException.
+        """
+        channels = max(self.options.channels, 1)
+        limit = asyncio.Semaphore(channels)
+        failed = asyncio.Event()
+
+        async def upload(target: Target) -> Optional[ConnectorException]:
+            async with limit:
+                if failed.is_set():
+                    return None
+                error = await self._run_action(
+                    lambda remote: self._transfer_target_timed_async(remote, target),
+                    remote,
+                    buffered=channels > 1,
+                )
+            if error is not None:
+                failed.set()
+            return error
+
+        self._raise_errors(
+            await asyncio.gather(*(upload(target) for target in transfer_order(targets)))
+        )
+
+    async def _transfer_target_timed_async(self, remote: str, target: Target) -> None:
+        size = _local_size(target.local_path)
+        with measure(
+            self._timings,
+            "upload",
+            remote=remote,
+            target=str(target.remote_path),
+            size=size,
+        ):
+            await self._transfer_target_async(remote, target)
+        self._report_progress(size or 0)
+
+    async def _transfer_archive_timed_async(
+        self, remote: str, archive: Path, targets: Set[Target]
+    ) -> None:
+        size = archive.stat().st_size
+        # Only uncompressed uploads measure throughput of the link, see _compression
+        measured = self._compression(remote) is None
+        start = time.monotonic()
+        with measure(self._timings, "upload", remote=remote, size=size):
+            await self._transfer_archive_async(remote, archive, targets)
+        if measured:
+            self._record_throughput(remote, size, time.monotonic() - start)
+        self._report_progress(_targets_size(targets))
+
+    def _local_uploads(self) -> int:
+        """Number of remotes that receive the targets from the local host."""
+        if self._fanout_enabled():
+            assert self.options.fanout is not None
+            return self.options.fanout
+        return len(self.remotes)
+
+    def _start_progress(self, uploads: Iterable[Set[Target]]) -> None:
+        """Start tracking progress of a transfer that uploads each of the target sets
+        from the local host."""
+        self._progress = TransferProgress(
+            sum(_targets_size(targets) for targets in uploads)
+        )
+
+    def _report_progress(self, size: int) -> None:
+        """Print progress of the running transfer after upload of 'size' bytes.
+
+        The line is printed right away, not buffered with the output of the remote,
+        so that the progress is visible while the remotes are being updated.
+        """
+        if self._progress is None:
+            return
+        line = self._progress.advance(size)
+        with self._output_lock:
+            print(line)
+
+    async def _restart_services_timed_async(
+        self, remote: str, services: List[str]
+    ) -> None:
+        with measure(self._timings, "restart", remote=remote):
+            await self._restart_services_async(remote, services)
+
+    async def _wait_ready_async(self, remote: str, probes: List[str]) -> None:
+        """Run readiness probes on the remote until they pass, with growing delays
+        between the attempts."""
+        script = readiness_command(probes, PROBE_TIMEOUT)
+        assert script is not None
+        deadline = time.monotonic() + self.options.ready_timeout
+        delay, max_delay = PROBE_BACKOFF
+        with measure(self._timings, "ready", remote=remote):
+            while True:
+                try:
+                    await self._run_script_async(remote, script)
+                    break
+                except ConnectorException as exc:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise ConnectorException(
+                            f"[{remote}] Services not ready after "
+                            f"{self.options.ready_timeout:g}s: {exc}"
+                        ) from exc
+                    await asyncio.sleep(min(delay, remaining))
+                    delay = min(delay * 2, max_delay)
+        self._print(f"[{remote}] Services are ready")
+
+    def _record_throughput(self, remote: str, size: int, seconds: float) -> None:
+        if size >= MIN_MEASURED_SIZE and seconds > 0:
+            self.throughput[remote] = size / seconds
+
+    def _compression(self, remote: str) -> Optional[str]:
+        """Return codec that should be used for uploads to the remote, if any.
+
+        With 'compression_threshold' set, uploads are compressed only after an
+        uncompressed upload to the remote measured throughput below the threshold.
+        """
+        codec = self.options.compression
+        threshold = self.options.compression_threshold
+        if codec is None or threshold is None:
+            return codec
+
+        measured = self.throughput.get(remote)
+        if measured is not None and measured < threshold * 1000 * 1000:
+            return codec
+        return None
+
+    def _hook_scripts(self, pending: Dict[str, Set[Target]]) -> Dict[str, str]:
+        scripts = {}
+        for remote, targets in pending.items():
+            script = pre_exec_command(targets, self.options.pre_exec_timeout)
+            if script is not None:
+                scripts[remote] = script
+        return scripts
+
+    @staticmethod
+    def _services(targets: Set[Target]) -> List[str]:
+        return sorted({target.service for target in targets if target.service})
+
+    def _print(self, message: str) -> None:
+        """Print message, or buffer it if it is printed within a group of output,
+        see _grouped_output."""
+        buffer = _output_buffer.get()
+        if buffer is None:
+            print(message)
+        else:
+            buffer.append(message)
+
+    @contextmanager
+    def _grouped_output(self) -> Iterator[None]:
+        """Buffer messages printed within the block and print them as one block at
+        its end, so that output of work that runs concurrently does not interleave.
+
+        Messages of a group nested in another group are added to the enclosing group.
+        """
+        enclosing = _output_buffer.get()
+        buffer: List[str] = []
+        token = _output_buffer.set(buffer)
+        try:
+            yield
+        finally:
+            _output_buffer.reset(token)
+            if enclosing is not None:
+                enclosing.extend(buffer)
+            else:
+                with self._output_lock:
+                    for message in buffer:
+                        print(message)
+
+    def _run_on_remotes(
+        self,
+        action: RemoteAction,
+        parallel: Optional[int] = None,
+        remotes: Optional[List[str]] = None,
+    ) -> None:
+        """Execute 'action' for each remote (or each of 'remotes'), running up to
+        'parallel' at once ('self.parallel' by default).
+
+        Each remote is worked on from its own thread, with output grouped per remote
+        when more than one runs at once. Failure on one remote does not prevent the
+        action from running on the others. All failures are collected and raised
+        together as a single ConnectorException.
+        """
+        parallel = parallel or self.parallel
+        remotes = self.remotes if remotes is None else remotes
+        if parallel == 1:
+            results = [
+                self._run_coroutine(self._run_action(action, remote))
+                for remote in remotes
+            ]
+        else:
+            with ThreadPoolExecutor(max_workers=parallel) as executor:
+                # Threads see the output group of the caller, see _grouped_output
+                futures = [
+                    executor.submit(
+                        contextvars.copy_context().run,
+                        self._run_buffered,
+                        action,
+                        remote,
+                    )
+                    for remote in remotes
+                ]
+            results = [future.result() for future in futures]
+        self._raise_errors(results)
+
+    def _run_buffered(
+        self, action: RemoteAction, remote: str
+    ) -> Optional[ConnectorException]:
+        return self._run_coroutine(self._run_action(action, remote, buffered=True))
+
+    async def _run_action(
+        self, action: RemoteAction, remote: str, buffered: bool = False
+    ) -> Optional[ConnectorException]:
+        """Execute 'action' for the remote and return its failure, if any. With
+        'buffered', its output is printed as a single block."""
+        try:
+            with self._grouped_output() if buffered else nullcontext():
+                result = action(remote)
+                if inspect.isawaitable(result):
+                    await result
+        except ConnectorException as exc:
+            return exc
+        return None
+
+    def _run_coroutine(self, coroutine: Coroutine[Any, Any, T]) -> T:
+        """Run coroutine to completion in the current thread, on its own event loop."""
+        loop = asyncio.new_event_loop()
+        try:
+            return loop.run_until_complete(coroutine)
+        finally:
+            loop.close()
+
+    @staticmethod
+    def _raise_errors(results: Iterable[Optional[ConnectorException]]) -> None:
+        errors = [str(error) for error in results if error is not None]
+        if errors:
+            raise ConnectorException(os.linesep.join(errors))
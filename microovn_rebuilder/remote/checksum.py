@@ -0,0 +1,31 @@
+import shlex
+from typing import Dict, Iterable, Optional
+
+from microovn_rebuilder.target import Target
+
+
+def checksum_command(targets: Iterable[Target]) -> str:
+    """Shell command that prints SHA-256 checksums of remote files of all targets.
+
+    Missing remote files are left out of the output, but any other failure (e.g.
+    missing 'sha256sum' binary) makes the command fail.
+    """
+    paths = sorted(str(target.remote_path) for target in targets)
+    return f"{shlex.join(['sha256sum', '--', *paths])} 2>/dev/null; [ $? -le 1 ]"
+
+
+def parse_checksums(
+    output: bytes, targets: Iterable[Target]
+) -> Dict[Target, Optional[str]]:
+    """Map targets to checksums printed by 'checksum_command'.
+
+    Targets whose remote file does not exist are mapped to None.
+    """
+    by_path = {str(target.remote_path): target for target in targets}
+    checksums: Dict[Target, Optional[str]] = dict.fromkeys(by_path.values())
+    for line in output.decode("utf-8").splitlines():
+        digest, _, path = line.partition("  ")
+        target = by_path.get(path)
+        if target is not None:
+            checksums[target] = digest
+    return checksums
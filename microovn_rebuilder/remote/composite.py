@@ -0,0 +1,228 @@
+import asyncio
+import os
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+from microovn_rebuilder.remote.base import (
+    BaseConnector,
+    ConnectorException,
+    ConnectorOptions,
+)
+from microovn_rebuilder.report import Timing
+from microovn_rebuilder.target import Target
+
+
+class CompositeConnector(BaseConnector):
+    """Drive remotes of different connector types as a single connector.
+
+    Each connector type keeps its own connector, with its own options, so each type
+    updates its remotes with its own 'parallel' limit. Connectors of all types work at
+    the same time, each from its own worker thread (as each connector runs its own
+    event loop, see BaseConnector._run_coroutine), so that slow remotes of one type do
+    not hold up the remotes of the other types. Failures from all connectors are
+    raised together as a single ConnectorException.
+
+    Services are restarted by a single rolling restart over the remotes of all types
+    (see BaseConnector.restart), so that 'restart_window' limits restarts across the
+    whole cluster, and a remote that fails to get ready halts the restart on all of
+    them.
+    """
+
+    def __init__(
+        self,
+        connectors: Dict[str, BaseConnector],
+        options: Optional[ConnectorOptions] = None,
+    ) -> None:
+        super().__init__(
+            remotes=[
+                remote
+                for connector in connectors.values()
+                for remote in connector.remotes
+            ],
+            options=options,
+        )
+        # Connector of each connector type, e.g. "lxd" or "ssh"
+        self.connectors = connectors
+        for connector in connectors.values():
+            # Blocks of output from different connectors do not interleave
+            connector._output_lock = self._output_lock
+
+    def initialize(self) -> None:
+        self._on_reachable_connectors(lambda connector: connector.initialize())
+
+    def teardown(self) -> None:
+        for connector in self.connectors.values():
+            connector.teardown()
+
+    def check_remote(self, remote_dst: str) -> None:
+        self._on_reachable_connectors(
+            lambda connector: connector.check_remote(remote_dst)
+        )
+
+    def _transfer(
+        self, targets: Set[Target]
+    ) -> Tuple[List[str], Optional[ConnectorException]]:
+        return self._on_connectors_some(lambda connector: connector._transfer(targets))
+
+    def _apply_staged(
+        self, targets: Set[Target], remotes: List[str]
+    ) -> Tuple[List[str], Optional[ConnectorException]]:
+        def apply(
+            connector: BaseConnector,
+        ) -> Tuple[List[str], Optional[ConnectorException]]:
+            own = [remote for remote in remotes if remote in connector.remotes]
+            if not own:
+                return [], None
+            return connector._apply_staged(targets, own)
+
+        return self._on_connectors_some(apply)
+
+    def remote_checksums(
+        self, targets: Set[Target]
+    ) -> Dict[str, Dict[Target, Optional[str]]]:
+        checksums: Dict[str, Dict[Target, Optional[str]]] = {}
+        self._on_connectors(
+            lambda connector: checksums.update(connector.remote_checksums(targets))
+        )
+        return checksums
+
+    def sync(self, pending: Dict[str, Set[Target]]) -> None:
+        pending = {
+            remote: self.upload_targets(targets) for remote, targets in pending.items()
+        }
+
+        def sync(connector: BaseConnector) -> None:
+            own = {
+                remote: targets
+                for remote, targets in pending.items()
+                if remote in connector.remotes
+            }
+            if own:
+                connector.sync(own)
+
+        self._on_connectors(sync)
+
+    def pre_exec(self, pending: Dict[str, Set[Target]]) -> None:
+        def run(connector: BaseConnector) -> None:
+            connector.pre_exec(
+                {
+                    remote: targets
+                    for remote, targets in pending.items()
+                    if remote in connector.remotes
+                }
+            )
+
+        self._on_connectors(run)
+
+    def collect_timings(self) -> List[Timing]:
+        timings = super().collect_timings()
+        for connector in self.connectors.values():
+            timings.extend(connector.collect_timings())
+        return timings
+
+    # Operations on a single remote are run by the remote's connector, each in a
+    # worker thread, as the connector may run its own event loop there.
+
+    async def _transfer_target_async(self, remote: str, target: Target) -> None:
+        await asyncio.to_thread(self._connector(remote)._transfer_target, remote, target)
+
+    async def _transfer_archive_async(
+        self, remote: str, archive: Path, targets: Set[Target]
+    ) -> None:
+        await asyncio.to_thread(
+            self._connector(remote)._transfer_archive, remote, archive, targets
+        )
+
+    async def _restart_services_async(self, remote: str, services: List[str]) -> None:
+        await asyncio.to_thread(
+            self._connector(remote)._restart_services, remote, services
+        )
+
+    async def _remote_checksums_async(
+        self, remote: str, targets: Set[Target]
+    ) -> Dict[Target, Optional[str]]:
+        return await asyncio.to_thread(
+            self._connector(remote)._remote_checksums, remote, targets
+        )
+
+    async def _run_script_async(self, remote: str, script: str) -> None:
+        await asyncio.to_thread(self._connector(remote)._run_script, remote, script)
+
+    async def _forward_target_async(
+        self, source: str, remote: str, target: Target
+    ) -> None:
+        await asyncio.to_thread(
+            self._connector(remote)._forward_target, source, remote, target
+        )
+
+    def _connector(self, remote: str) -> BaseConnector:
+        for connector in self.connectors.values():
+            if remote in connector.remotes:
+                return connector
+        raise ConnectorException(f"[{remote}] Unknown remote")
+
+    def _on_connectors(self, action: Callable[[BaseConnector], None]) -> None:
+        """Execute 'action' with connector of each type, all of them at once."""
+        self._run_on_remotes(
+            lambda name: asyncio.to_thread(action, self.connectors[name]),
+            parallel=len(self.connectors),
+            remotes=list(self.connectors),
+        )
+
+    def _on_connectors_some(
+        self,
+        action: Callable[
+            [BaseConnector], Tuple[List[str], Optional[ConnectorException]]
+        ],
+    ) -> Tuple[List[str], Optional[ConnectorException]]:
+        """Execute 'action' (returning remotes where it succeeded and the failures on
+        the others) with connector of each type, all of them at once, and merge the
+        results of all types."""
+        results: Dict[str, Tuple[List[str], Optional[ConnectorException]]] = {}
+
+        def run(name: str) -> None:
+            results[name] = action(self.connectors[name])
+
+        self._run_on_remotes(
+            lambda name: asyncio.to_thread(run, name),
+            parallel=len(self.connectors),
+            remotes=list(self.connectors),
+        )
+        succeeded: List[str] = []
+        errors: List[str] = []
+        for name in self.connectors:
+            remotes, error = results[name]
+            succeeded.extend(remotes)
+            if error is not None:
+                errors.append(str(error))
+        if errors:
+            return succeeded, ConnectorException(os.linesep.join(errors))
+        return succeeded, None
+
+    def _on_reachable_connectors(self, action: Callable[[BaseConnector], None]) -> None:
+        """Execute 'action' (connecting to or checking remotes) with connector of each
+        type, all of them at once.
+
+        Connector that fails has no reachable remote left, so with 'skip_unreachable'
+        its connector type is left out, as long as there is any reachable remote.
+        """
+        succeeded, error = self._run_on_some(
+            lambda name: asyncio.to_thread(action, self.connectors[name]),
+            list(self.connectors),
+            parallel=len(self.connectors),
+        )
+        if error is not None and self.options.skip_unreachable:
+            self.connectors = {
+                name: connector
+                for name, connector in self.connectors.items()
+                if name in succeeded
+            }
+        self._update_remotes()
+        self._keep_reachable(self.remotes, error)
+
+    def _update_remotes(self) -> None:
+        self.remotes = [
+            remote
+            for connector in self.connectors.values()
+            for remote in connector.remotes
+        ]
@@ -0,0 +1,63 @@
+import shlex
+import subprocess
+from contextlib import contextmanager
+from pathlib import Path
+from typing import IO, Iterator, List, Optional
+
+from microovn_rebuilder.remote.base import ConnectorException
+from microovn_rebuilder.target import Target
+
+# Supported compression codecs. Each of them is expected to be available as a command
+# line tool with the same name, locally and on the remote hosts.
+CODECS = ("gzip", "xz", "zstd")
+
+
+def compress_command(codec: str, level: Optional[int], path: Path) -> List[str]:
+    command = [codec, "-c"]
+    if level is not None:
+        command.append(f"-{level}")
+    command.append(str(path))
+    return command
+
+
+def decompress_command(codec: str, target: Target, mode: int) -> str:
+    """Shell command that decompresses stdin into target's staging file and renames
+    it over the target's remote path."""
+    tmp = shlex.quote(str(target.staging_path))
+    dst = shlex.quote(str(target.remote_path))
+    return f"{codec} -d -c > {tmp} && chmod {mode & 0o7777:o} {tmp} && mv -f {tmp} {dst}"
+
+
+@contextmanager
+def compressed_stream(
+    path: Path, codec: str, level: Optional[int] = None
+) -> Iterator[IO[bytes]]:
+    """Compress local file on the fly, yielding pipe with the compressed data."""
+    process = subprocess.Popen(
+        compress_command(codec, level, path),
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+    )
+    assert process.stdout is not None and process.stderr is not None
+    try:
+        yield process.stdout
+    finally:
+        process.stdout.close()
+        return_code = process.wait()
+        error = process.stderr.read().decode("utf-8")
+        process.stderr.close()
+    if return_code != 0:
+        raise ConnectorException(f"[local] Failed to compress {path}: {error}")
+
+
+@contextmanager
+def upload_stream(
+    path: Path, codec: Optional[str], level: Optional[int] = None
+) -> Iterator[IO[bytes]]:
+    """Open local file for upload, compressing it on the fly if 'codec' is set."""
+    if codec is None:
+        with open(path, "rb") as f:
+            yield f
+    else:
+        with compressed_stream(path, codec, level) as stream:
+            yield stream
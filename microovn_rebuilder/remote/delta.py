@@ -0,0 +1,186 @@
+"""Delta transfer of files, based on the rsync algorithm.
+
+The remote host computes a weak (rolling) and a strong checksum of every block of the
+file it already has (SIGNATURE_SCRIPT). The local side then rolls the weak checksum
+over the new file, byte by byte, looking for blocks that the remote host already has.
+The resulting delta consists of references to remote blocks and of literal data, and
+it is turned back into the new file on the remote host by PATCH_SCRIPT.
+
+Both remote scripts are executed with 'python3' on the remote host.
+"""
+
+import hashlib
+import itertools
+import struct
+from typing import Dict, List, Optional, Tuple
+
+BLOCK_SIZE = 16 * 1024
+
+# Number of blocks of the new file after which compute_delta checks how much of it
+# matched so far, see compute_delta
+PROBE_BLOCKS = 16
+
+_MOD = 1 << 16
+
+OP_COPY = b"C"
+OP_LITERAL = b"L"
+OP_END = b"E"
+
+_COPY = struct.Struct(">QI")
+_LITERAL = struct.Struct(">I")
+
+SIGNATURE_SCRIPT = """
+import hashlib, itertools, os, sys
+path, block_size = sys.argv[1], int(sys.argv[2])
+if not os.path.isfile(path):
+    sys.exit(0)
+with open(path, "rb") as f:
+    while block := f.read(block_size):
+        a = sum(block) % 65536
+        b = sum(itertools.accumulate(block)) % 65536
+        strong = hashlib.blake2b(block, digest_size=16).hexdigest()
+        print(a | (b << 16), strong)
+"""
+
+PATCH_SCRIPT = """
+import hashlib, os, struct, sys
+path, tmp_path, block_size = sys.argv[1], sys.argv[2], int(sys.argv[3])
+mode, digest = int(sys.argv[4], 8), sys.argv[5]
+stdin = sys.stdin.buffer
+new_hash = hashlib.sha256()
+with open(path, "rb") as old, open(tmp_path, "wb") as new:
+    while (op := stdin.read(1)) != b"E":
+        if op == b"C":
+            index, count = struct.unpack(">QI", stdin.read(12))
+            old.seek(index * block_size)
+            data = old.read(count * block_size)
+        elif op == b"L":
+            (length,) = struct.unpack(">I", stdin.read(4))
+            data = stdin.read(length)
+        else:
+            sys.exit("Malformed delta stream")
+        new_hash.update(data)
+        new.write(data)
+if new_hash.hexdigest() != digest:
+    os.unlink(tmp_path)
+    sys.exit("Checksum mismatch after applying delta")
+os.chmod(tmp_path, mode)
+os.replace(tmp_path, path)
+"""
+
+
+def weak_checksum(block: bytes) -> int:
+    a = sum(block) % _MOD
+    b = sum(itertools.accumulate(block)) % _MOD
+    return a | (b << 16)
+
+
+def strong_checksum(block: bytes) -> str:
+    return hashlib.blake2b(block, digest_size=16).hexdigest()
+
+
+def parse_signature(output: bytes) -> List[Tuple[int, str]]:
+    signature = []
+    for line in output.decode("utf-8").splitlines():
+        weak, strong = line.split()
+        signature.append((int(weak), strong))
+    return signature
+
+
+class _DeltaWriter:
+    def __init__(self) -> None:
+        self.stream = bytearray()
+        self.literal_size = 0
+        self._copy_start = -1
+        self._copy_count = 0
+
+    def copy(self, index: int) -> None:
+        if self._copy_count and index == self._copy_start + self._copy_count:
+            self._copy_count += 1
+            return
+        self._flush_copy()
+        self._copy_start, self._copy_count = index, 1
+
+    def literal(self, data: bytes) -> None:
+        if not data:
+            return
+        self._flush_copy()
+        self.stream += OP_LITERAL + _LITERAL.pack(len(data)) + data
+        self.literal_size += len(data)
+
+    def finish(self) -> bytes:
+        self._flush_copy()
+        self.stream += OP_END
+        return bytes(self.stream)
+
+    def _flush_copy(self) -> None:
+        if self._copy_count:
+            self.stream += OP_COPY + _COPY.pack(self._copy_start, self._copy_count)
+        self._copy_count = 0
+
+
+def compute_delta(
+    data: bytes,
+    signature: List[Tuple[int, str]],
+    block_size: int = BLOCK_SIZE,
+    max_literal: Optional[int] = None,
+) -> Optional[bytes]:
+    """Compute delta that turns remote file with 'signature' into 'data'.
+
+    Returns None if the delta would contain more than 'max_literal' bytes of literal
+    data, in which case uploading the whole file is cheaper than rolling checksums
+    over the rest of it. Rebuilt binaries tend to either match the remote file
+    throughout or barely at all, so the match rate of the first PROBE_BLOCKS blocks
+    is taken as the rate of the whole file: if it already exceeds the share of
+    literal data that 'max_literal' allows, the rest of the file is not scanned.
+    """
+    if max_literal is None:
+        max_literal = len(data)
+
+    # Only full blocks can be matched by the rolling window, the last block of the
+    # remote file is likely shorter.
+    table: Dict[int, Dict[str, int]] = {}
+    for index, (weak, strong) in enumerate(signature):
+        table.setdefault(weak, {}).setdefault(strong, index)
+
+    writer = _DeltaWriter()
+    size = len(data)
+    literal_start = pos = 0
+    a = b = 0
+    recompute = True
+    probe_end = PROBE_BLOCKS * block_size
+    while pos + block_size <= size:
+        if pos >= probe_end:
+            if (writer.literal_size + pos - literal_start) * size > max_literal * pos:
+                return None
+            # Probe only once
+            probe_end = size
+        if recompute:
+            checksum = weak_checksum(data[pos : pos + block_size])
+            a, b = checksum % _MOD, checksum >> 16
+            recompute = False
+
+        candidates = table.get(a | (b << 16))
+        if candidates:
+            match = candidates.get(strong_checksum(data[pos : pos + block_size]))
+            if match is not None:
+                writer.literal(data[literal_start:pos])
+                writer.copy(match)
+                pos += block_size
+                literal_start = pos
+                recompute = True
+                continue
+
+        if pos + block_size == size:
+            break
+        out_byte, in_byte = data[pos], data[pos + block_size]
+        a = (a - out_byte + in_byte) % _MOD
+        b = (b - block_size * out_byte + a) % _MOD
+        pos += 1
+        if writer.literal_size + pos - literal_start > max_literal:
+            return None
+
+    writer.literal(data[literal_start:])
+    if writer.literal_size > max_literal:
+        return None
+    return writer.finish()
@@ -0,0 +1,38 @@
+import shlex
+from typing import Dict, List
+
+from microovn_rebuilder.target import Target
+
+# Options of 'ssh' client that forwards files between remote hosts. Remote hosts must
+# be able to log in to each other without any user interaction.
+SSH_OPTIONS: List[str] = [
+    "-o",
+    "BatchMode=yes",
+    "-o",
+    "StrictHostKeyChecking=accept-new",
+]
+
+
+def receive_command(target: Target, mode: int) -> str:
+    """Shell command that writes stdin into target's staging file and renames it over
+    the target's remote path."""
+    tmp = shlex.quote(str(target.staging_path))
+    dst = shlex.quote(str(target.remote_path))
+    return f"cat > {tmp} && chmod {mode & 0o7777:o} {tmp} && mv -f {tmp} {dst}"
+
+
+def ssh_forward_command(target: Target, destination: str, mode: int) -> str:
+    """Shell command that sends target's remote file to the 'destination' host over
+    SSH, replacing the file there."""
+    ssh = shlex.join(["ssh", *SSH_OPTIONS, destination, receive_command(target, mode)])
+    return f"{ssh} < {shlex.quote(str(target.remote_path))}"
+
+
+def forward_round(holders: List[str], pending: List[str]) -> Dict[str, str]:
+    """Pair remotes that do not have the files yet with remotes that forward the
+    files to them, at most one remote per holder.
+
+    Number of remotes with the files doubles with each round, so files reach all
+    remotes in a number of rounds that grows with logarithm of the number of remotes.
+    """
+    return dict(zip(pending, holders))
@@ -0,0 +1,61 @@
+import shlex
+from typing import Iterable, List, Optional
+
+from microovn_rebuilder.target import Target
+
+
+def _distinct(commands: Iterable[Optional[str]]) -> List[str]:
+    distinct: List[str] = []
+    for command in commands:
+        if command and command not in distinct:
+            distinct.append(command)
+    return distinct
+
+
+def _script(commands: List[str], timeout: float, kind: str) -> Optional[str]:
+    """Shell script that runs commands one after another, each in its own shell that
+    is killed if it does not finish within 'timeout' seconds. The script stops at
+    the first command that fails or times out."""
+    lines = []
+    for command in commands:
+        quoted = shlex.quote(command)
+        lines.append(
+            f"timeout {timeout:g} sh -c {quoted} || {{ rc=$?; "
+            f"printf '{kind} failed (exit code %s): %s\\n' $rc {quoted} >&2; "
+            "exit $rc; }"
+        )
+    if not lines:
+        return None
+    return "\n".join(lines)
+
+
+def pre_exec_hooks(targets: Iterable[Target]) -> List[str]:
+    """Return distinct pre_exec hooks of targets, ordered by their remote paths."""
+    return _distinct(
+        target.pre_exec for target in sorted(targets, key=lambda t: str(t.remote_path))
+    )
+
+
+def pre_exec_command(targets: Iterable[Target], timeout: float) -> Optional[str]:
+    """Shell script that runs pre_exec hooks of all targets, one after another.
+
+    Each hook runs in its own shell that is killed if it does not finish within
+    'timeout' seconds. The script stops at the first hook that fails or times out.
+    Returns None if no target has a pre_exec hook.
+    """
+    return _script(pre_exec_hooks(targets), timeout, "pre_exec hook")
+
+
+def readiness_probes(targets: Iterable[Target]) -> List[str]:
+    """Return distinct readiness probes of services of the targets."""
+    return _distinct(
+        target.ready_check
+        for target in sorted(targets, key=lambda t: str(t.remote_path))
+        if target.service
+    )
+
+
+def readiness_command(probes: List[str], timeout: float) -> Optional[str]:
+    """Shell script that succeeds only if all readiness probes succeed, each within
+    'timeout' seconds. Returns None if there are no probes."""
+    return _script(probes, timeout, "Readiness probe")
@@ -1,14 +1,30 @@
+import asyncio
 import os
 import subprocess
+import time
 from pathlib import Path
 from subprocess import CompletedProcess
-from typing import Union
+from typing import IO, Any, Dict, List, Optional, Sequence, Set, Tuple, Union
 
+from microovn_rebuilder.remote.aio import AsyncConnector
+from microovn_rebuilder.remote.archive import extract_command
 from microovn_rebuilder.remote.base import BaseConnector, ConnectorException
+from microovn_rebuilder.remote.checksum import checksum_command, parse_checksums
+from microovn_rebuilder.remote.compression import (
+    compressed_stream,
+    decompress_command,
+    upload_stream,
+)
+from microovn_rebuilder.remote.fanout import receive_command
 from microovn_rebuilder.target import Target
 
 
 class LXDConnector(BaseConnector):
+    """Connector for LXD instances that runs 'lxc' commands.
+
+    Remote operations run their commands through _command, which this connector runs
+    as blocking subprocesses and AsyncLXDConnector as asyncio subprocesses.
+    """
 
     def initialize(self) -> None:
         # LXDConnector does not require any special initialization
@@ -18,45 +34,204 @@ class LXDConnector(BaseConnector):
         # LXDConnector does not require any special teardown
         pass  # pragma: no cover
 
-    def update(self, target: Target) -> None:
-        for remote in self.remotes:
-            print(f"{os.linesep}[{remote}] Removing remote file {target.remote_path}")
-            result = self._run_command(
-                "lxc", "file", "delete", f"{remote}{target.remote_path}"
-            )
-            self._check_cmd_result(result, f"[{remote}] Failed to remove remote file")
+    async def _transfer_target_async(self, remote: str, target: Target) -> None:
+        codec = self._compression(remote)
+        if codec:
+            await self._upload_compressed(remote, target, codec)
+        else:
+            await self._upload(remote, target)
+
+    async def _upload(self, remote: str, target: Target) -> None:
+        self._print(
+            f"{os.linesep}[{remote}] Uploading file {target.local_path} to "
+            f"{target.remote_path}"
+        )
+        start = time.monotonic()
+        result = await self._command(
+            "lxc", "file", "push", target.local_path, f"{remote}{target.staging_path}"
+        )
+        self._check_cmd_result(result, f"[{remote}] Failed to upload file")
+        self._record_throughput(
+            remote, os.path.getsize(target.local_path), time.monotonic() - start
+        )
 
-            print(
-                f"[{remote}] Uploading file {target.local_path} to {target.remote_path}"
+        result = await self._command(
+            "lxc",
+            "exec",
+            remote,
+            "--",
+            "mv",
+            "-f",
+            target.staging_path,
+            target.remote_path,
+        )
+        self._check_cmd_result(result, f"[{remote}] Failed to replace remote file")
+
+    async def _upload_compressed(self, remote: str, target: Target, codec: str) -> None:
+        self._print(
+            f"{os.linesep}[{remote}] Uploading file {target.local_path} to "
+            f"{target.remote_path} ({codec} compressed)"
+        )
+        mode = os.stat(target.local_path).st_mode
+        command = decompress_command(codec, target, mode)
+        with compressed_stream(
+            target.local_path, codec, self.options.compression_level
+        ) as stream:
+            result = await self._command(
+                "lxc", "exec", remote, "--", "sh", "-c", command, stdin=stream
             )
-            result = self._run_command(
-                "lxc", "file", "push", target.local_path, f"{remote}{target.remote_path}"
+        self._check_cmd_result(result, f"[{remote}] Failed to upload file")
+
+    async def _transfer_archive_async(
+        self, remote: str, archive: Path, targets: Set[Target]
+    ) -> None:
+        self._print(
+            f"{os.linesep}[{remote}] Uploading {len(targets)} file(s) in a single archive"
+        )
+        codec = self._compression(remote)
+        with upload_stream(archive, codec, self.options.compression_level) as stream:
+            result = await self._command(
+                "lxc",
+                "exec",
+                remote,
+                "--",
+                "sh",
+                "-c",
+                extract_command(targets, codec),
+                stdin=stream,
             )
-            self._check_cmd_result(result, f"[{remote}] Failed to upload file")
+        self._check_cmd_result(result, f"[{remote}] Failed to upload archive")
 
-            if target.service:
-                print(f"[{remote}] Restarting {target.service}")
-                result = self._run_command(
-                    "lxc", "exec", remote, "snap", "restart", target.service
-                )
-                self._check_cmd_result(result, f"[{remote}] Failed to restart service")
+    async def _restart_services_async(self, remote: str, services: List[str]) -> None:
+        self._print(f"[{remote}] Restarting {', '.join(services)}")
+        result = await self._command("lxc", "exec", remote, "snap", "restart", *services)
+        self._check_cmd_result(result, f"[{remote}] Failed to restart service")
+
+    async def _remote_checksums_async(
+        self, remote: str, targets: Set[Target]
+    ) -> Dict[Target, Optional[str]]:
+        result = await self._command(
+            "lxc", "exec", remote, "--", "sh", "-c", checksum_command(targets)
+        )
+        self._check_cmd_result(result, f"[{remote}] Failed to compute checksums")
+        return parse_checksums(result.stdout, targets)
+
+    async def _run_script_async(self, remote: str, script: str) -> None:
+        result = await self._command("lxc", "exec", remote, "--", "sh", "-c", script)
+        self._check_cmd_result(result, f"[{remote}] Failed to run script")
+
+    async def _forward_target_async(
+        self, source: str, remote: str, target: Target
+    ) -> None:
+        """Pipe the file pulled from the 'source' instance into the 'remote'."""
+        mode = os.stat(target.local_path).st_mode
+        pulled, result = await self._piped_command(
+            ("lxc", "file", "pull", f"{source}{target.remote_path}", "-"),
+            ("lxc", "exec", remote, "--", "sh", "-c", receive_command(target, mode)),
+        )
+        self._check_cmd_result(pulled, f"[{remote}] Failed to pull file from {source}")
+        self._check_cmd_result(result, f"[{remote}] Failed to forward file")
 
     def check_remote(self, remote_dst: str) -> None:
-        for remote in self.remotes:
-            result = self._run_command(
-                "lxc", "exec", remote, "--", "test", "-d", remote_dst
+        self._run_on_reachable(lambda remote: self._check_remote(remote, remote_dst))
+
+    async def _check_remote(self, remote: str, remote_dst: str) -> None:
+        timeout = self.options.connect_timeout
+        try:
+            result = await self._command(
+                "lxc", "exec", remote, "--", "test", "-d", remote_dst, timeout=timeout
             )
-            self._check_cmd_result(
-                result,
-                f"[{remote}] Remote directory '{remote_dst}' does not exist on LXC instance {remote}",
+        except (subprocess.TimeoutExpired, TimeoutError) as exc:
+            raise ConnectorException(
+                f"[{remote}] LXC instance {remote} did not respond within {timeout:g}s"
+            ) from exc
+        self._check_cmd_result(
+            result,
+            f"[{remote}] Remote directory '{remote_dst}' does not exist on LXC instance {remote}",
+        )
+
+    async def _command(self, *args: Union[str, Path], **kwargs: Any) -> CompletedProcess:
+        """Run command, see _run_command. It blocks the thread that works on the
+        remote, as each remote is worked on from its own thread."""
+        return self._run_command(*args, **kwargs)
+
+    async def _piped_command(
+        self, source_args: Sequence[Union[str, Path]], args: Sequence[Union[str, Path]]
+    ) -> Tuple[CompletedProcess, CompletedProcess]:
+        """Run command 'args' with standard output of the 'source_args' command as
+        its input. Return results of both commands."""
+        source = subprocess.Popen(
+            source_args, stdout=subprocess.PIPE, stderr=subprocess.PIPE
+        )
+        assert source.stdout is not None and source.stderr is not None
+        try:
+            result = self._run_command(*args, stdin=source.stdout)
+        finally:
+            source.stdout.close()
+            sourced = CompletedProcess(
+                source.args, source.wait(), b"", source.stderr.read()
             )
+            source.stderr.close()
+        return sourced, result
 
     @staticmethod
-    def _run_command(*args: Union[str, Path]) -> CompletedProcess:
-        return subprocess.run(args, capture_output=True)
+    def _run_command(
+        *args: Union[str, Path],
+        stdin: Optional[IO[bytes]] = None,
+        timeout: Optional[float] = None,
+    ) -> CompletedProcess:
+        return subprocess.run(args, stdin=stdin, capture_output=True, timeout=timeout)
 
     @staticmethod
     def _check_cmd_result(result: CompletedProcess, err_msg: str) -> None:
         if result.returncode != 0:
             additional_err = f"{result.stderr.decode("utf-8")}" or ""
             raise ConnectorException(f"{err_msg}: {additional_err}".rstrip())
+
+
+class AsyncLXDConnector(AsyncConnector, LXDConnector):
+    """LXD connector for the asyncio engine, running 'lxc' as asyncio subprocesses."""
+
+    async def _command(self, *args: Union[str, Path], **kwargs: Any) -> CompletedProcess:
+        return await self._run_command_async(*args, **kwargs)
+
+    async def _piped_command(
+        self, source_args: Sequence[Union[str, Path]], args: Sequence[Union[str, Path]]
+    ) -> Tuple[CompletedProcess, CompletedProcess]:
+        read_fd, write_fd = os.pipe()
+        with os.fdopen(read_fd, "rb") as stdin:
+            try:
+                source = await asyncio.create_subprocess_exec(
+                    *source_args, stdout=write_fd, stderr=asyncio.subprocess.PIPE
+                )
+            finally:
+                os.close(write_fd)
+            try:
+                result = await self._run_command_async(*args, stdin=stdin)
+                _, source_error = await source.communicate()
+            except asyncio.CancelledError:
+                source.kill()
+                await source.wait()
+                raise
+        sourced = CompletedProcess(source_args, await source.wait(), b"", source_error)
+        return sourced, result
+
+    @staticmethod
+    async def _run_command_async(
+        *args: Union[str, Path],
+        stdin: Optional[IO[bytes]] = None,
+        timeout: Optional[float] = None,
+    ) -> CompletedProcess:
+        process = await asyncio.create_subprocess_exec(
+            *args,
+            stdin=stdin,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+        )
+        try:
+            stdout, stderr = await asyncio.wait_for(process.communicate(), timeout)
+        except (asyncio.CancelledError, TimeoutError):
+            process.kill()
+            await process.wait()
+            raise
+        return CompletedProcess(args, await process.wait(), stdout, stderr)
@@ -0,0 +1,385 @@
+import http.client
+import io
+import json
+import math
+import os
+import shlex
+import socket
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import IO, Any, Dict, List, Optional, Set, Tuple
+from urllib.parse import quote, urlencode
+
+from microovn_rebuilder.remote.archive import extract_command
+from microovn_rebuilder.remote.base import (
+    BaseConnector,
+    ConnectorException,
+    ConnectorOptions,
+)
+from microovn_rebuilder.remote.checksum import checksum_command, parse_checksums
+from microovn_rebuilder.remote.compression import (
+    compressed_stream,
+    decompress_command,
+    upload_stream,
+)
+from microovn_rebuilder.target import Target
+
+SNAP_SOCKET_PATH = "/var/snap/lxd/common/lxd/unix.socket"
+
+# Size of chunks in which request bodies are sent to the LXD daemon
+COPY_BUFSIZE = 1024 * 1024
+
+# Path prefix on the instance where data for commands that read stdin are uploaded, as
+# the exec API accepts stdin only over websockets. Each command gets its own file, so
+# that concurrent uploads to the same instance do not overwrite each other's input.
+INPUT_PATH = "/tmp/microovn-rebuilder.input"
+
+
+def default_socket_path() -> str:
+    lxd_dir = os.environ.get("LXD_DIR")
+    if lxd_dir:
+        return os.path.join(lxd_dir, "unix.socket")
+    return SNAP_SOCKET_PATH
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, socket_path: str) -> None:
+        super().__init__("lxd", blocksize=COPY_BUFSIZE)
+        self.socket_path = socket_path
+
+    def connect(self) -> None:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(self.socket_path)
+        except OSError:
+            sock.close()
+            raise
+        self.sock = sock
+
+
+class LXDClient:
+    """Minimal client of the LXD REST API.
+
+    Connections to the LXD daemon are kept open and reused by subsequent requests.
+    """
+
+    def __init__(self, socket_path: str) -> None:
+        self.socket_path = socket_path
+        self._idle: List[UnixHTTPConnection] = []
+        self._lock = threading.Lock()
+
+    def get(self, path: str) -> Any:
+        return self._json("GET", path)
+
+    def push(
+        self, instance: str, path: Path, body: IO[bytes], mode: int, size: Optional[int]
+    ) -> None:
+        """Write 'body' to the file at 'path' in the instance, replacing it."""
+        headers = {
+            "Content-Type": "application/octet-stream",
+            "X-LXD-type": "file",
+            "X-LXD-mode": f"{mode & 0o7777:04o}",
+            "X-LXD-uid": "0",
+            "X-LXD-gid": "0",
+            "X-LXD-write": "overwrite",
+        }
+        if size is not None:
+            headers["Content-Length"] = str(size)
+        query = urlencode({"path": str(path)})
+        self._json("POST", f"{self._instance(instance)}/files?{query}", body, headers)
+
+    def pull(self, instance: str, path: Path) -> bytes:
+        """Return content of the file at 'path' in the instance."""
+        query = urlencode({"path": str(path)})
+        status, data = self._request_raw(
+            "GET", f"{self._instance(instance)}/files?{query}"
+        )
+        if status >= 400:
+            try:
+                error = json.loads(data).get("error")
+            except ValueError:
+                error = None
+            raise ConnectorException(error or f"HTTP {status}")
+        return data
+
+    def exec(
+        self,
+        instance: str,
+        command: List[str],
+        stdout: bool = False,
+        timeout: Optional[float] = None,
+    ) -> Tuple[int, bytes, str]:
+        """Execute command in the instance and return its exit code, stdout and
+        stderr. Stdout is fetched only if requested, otherwise it's empty. Command
+        that does not finish within 'timeout' seconds is treated as failed."""
+        request = {
+            "command": command,
+            "environment": {},
+            "interactive": False,
+            "wait-for-websocket": False,
+            "record-output": True,
+        }
+        response = self._request(
+            "POST",
+            f"{self._instance(instance)}/exec",
+            json.dumps(request).encode(),
+            {"Content-Type": "application/json"},
+        )
+        wait = f"{response['operation']}/wait"
+        if timeout is not None:
+            wait += f"?timeout={math.ceil(timeout)}"
+        operation = self._json("GET", wait)
+        if operation.get("status") == "Running":
+            raise ConnectorException(f"Command did not finish within {timeout:g}s")
+        if operation.get("status") != "Success":
+            raise ConnectorException(operation.get("err") or "Command failed")
+
+        metadata = operation.get("metadata") or {}
+        logs = metadata.get("output") or {}
+        output = b""
+        if stdout and "1" in logs:
+            output = self._request_raw("GET", logs["1"])[1]
+        stderr = ""
+        if metadata["return"] != 0 and "2" in logs:
+            stderr = self._request_raw("GET", logs["2"])[1].decode("utf-8")
+        for log in logs.values():
+            self._request_raw("DELETE", log)
+        return metadata["return"], output, stderr
+
+    def close(self) -> None:
+        with self._lock:
+            for connection in self._idle:
+                connection.close()
+            self._idle.clear()
+
+    @staticmethod
+    def _instance(instance: str) -> str:
+        return f"/1.0/instances/{quote(instance, safe='')}"
+
+    def _json(
+        self,
+        method: str,
+        path: str,
+        body: Any = None,
+        headers: Optional[Dict[str, str]] = None,
+    ) -> Any:
+        return self._request(method, path, body, headers)["metadata"]
+
+    def _request(
+        self,
+        method: str,
+        path: str,
+        body: Any = None,
+        headers: Optional[Dict[str, str]] = None,
+    ) -> Dict[str, Any]:
+        status, data = self._request_raw(method, path, body, headers)
+        try:
+            response: Dict[str, Any] = json.loads(data)
+        except ValueError as exc:
+            raise ConnectorException(
+                f"Invalid response from LXD ({method} {path}): {exc}"
+            ) from exc
+        if status >= 400 or response.get("type") == "error":
+            raise ConnectorException(response.get("error") or f"HTTP {status}")
+        return response
+
+    def _request_raw(
+        self,
+        method: str,
+        path: str,
+        body: Any = None,
+        headers: Optional[Dict[str, str]] = None,
+    ) -> Tuple[int, bytes]:
+        connection = self._acquire()
+        try:
+            connection.request(method, path, body=body, headers=headers or {})
+            response = connection.getresponse()
+            data = response.read()
+        except (OSError, http.client.HTTPException) as exc:
+            connection.close()
+            raise ConnectorException(
+                f"Failed to communicate with LXD at {self.socket_path}: {exc}"
+            ) from exc
+
+        with self._lock:
+            self._idle.append(connection)
+        return response.status, data
+
+    def _acquire(self) -> UnixHTTPConnection:
+        with self._lock:
+            if self._idle:
+                return self._idle.pop()
+        return UnixHTTPConnection(self.socket_path)
+
+
+class LXDAPIConnector(BaseConnector):
+    """LXD connector that talks to the LXD daemon directly over its unix socket,
+    instead of running 'lxc' client for each operation."""
+
+    def __init__(
+        self,
+        remotes: List[str],
+        options: Optional[ConnectorOptions] = None,
+        socket_path: Optional[str] = None,
+    ) -> None:
+        super().__init__(remotes=remotes, options=options)
+        self.client = LXDClient(socket_path or default_socket_path())
+
+    def initialize(self) -> None:
+        try:
+            self.client.get("/1.0")
+        except ConnectorException as exc:
+            raise ConnectorException(f"Failed to connect to LXD: {exc}") from exc
+
+    def teardown(self) -> None:
+        self.client.close()
+
+    def check_remote(self, remote_dst: str) -> None:
+        def check(remote: str) -> None:
+            self._run(
+                remote,
+                ["test", "-d", remote_dst],
+                f"Remote directory '{remote_dst}' does not exist on LXC instance {remote}",
+                timeout=self.options.connect_timeout,
+            )
+
+        self._run_on_reachable(check)
+
+    def _transfer_target(self, remote: str, target: Target) -> None:
+        codec = self._compression(remote)
+        if codec:
+            self._upload_compressed(remote, target, codec)
+        else:
+            self._upload(remote, target)
+
+    def _upload(self, remote: str, target: Target) -> None:
+        self._print(
+            f"{os.linesep}[{remote}] Uploading file {target.local_path} to "
+            f"{target.remote_path}"
+        )
+        local_stat = os.stat(target.local_path)
+        start = time.monotonic()
+        with open(target.local_path, "rb") as f:
+            self._push(
+                remote, target.staging_path, f, local_stat.st_mode, local_stat.st_size
+            )
+        self._record_throughput(remote, local_stat.st_size, time.monotonic() - start)
+
+        self._run(
+            remote,
+            ["mv", "-f", str(target.staging_path), str(target.remote_path)],
+            "Failed to replace remote file",
+        )
+
+    def _upload_compressed(self, remote: str, target: Target, codec: str) -> None:
+        self._print(
+            f"{os.linesep}[{remote}] Uploading file {target.local_path} to "
+            f"{target.remote_path} ({codec} compressed)"
+        )
+        mode = os.stat(target.local_path).st_mode
+        with compressed_stream(
+            target.local_path, codec, self.options.compression_level
+        ) as stream:
+            self._run_with_input(
+                remote,
+                decompress_command(codec, target, mode),
+                stream,
+                "Failed to upload file",
+            )
+
+    def _transfer_archive(
+        self, remote: str, archive: Path, targets: Set[Target]
+    ) -> None:
+        self._print(
+            f"{os.linesep}[{remote}] Uploading {len(targets)} file(s) in a single archive"
+        )
+        codec = self._compression(remote)
+        with upload_stream(archive, codec, self.options.compression_level) as stream:
+            self._run_with_input(
+                remote,
+                extract_command(targets, codec),
+                stream,
+                "Failed to upload archive",
+            )
+
+    def _restart_services(self, remote: str, services: List[str]) -> None:
+        self._print(f"[{remote}] Restarting {', '.join(services)}")
+        self._run(remote, ["snap", "restart", *services], "Failed to restart service")
+
+    def _remote_checksums(
+        self, remote: str, targets: Set[Target]
+    ) -> Dict[Target, Optional[str]]:
+        output = self._run(
+            remote,
+            ["sh", "-c", checksum_command(targets)],
+            "Failed to compute checksums",
+            stdout=True,
+        )
+        return parse_checksums(output, targets)
+
+    def _run_script(self, remote: str, script: str) -> None:
+        self._run(remote, ["sh", "-c", script], "Failed to run script")
+
+    def _forward_target(self, source: str, remote: str, target: Target) -> None:
+        """Copy the file from the 'source' instance to the 'remote' through the LXD
+        daemon."""
+        try:
+            data = self.client.pull(source, target.remote_path)
+        except ConnectorException as exc:
+            raise ConnectorException(
+                f"[{remote}] Failed to pull file from {source}: {exc}"
+            ) from exc
+        mode = os.stat(target.local_path).st_mode
+        self._push(remote, target.staging_path, io.BytesIO(data), mode, len(data))
+        self._run(
+            remote,
+            ["mv", "-f", str(target.staging_path), str(target.remote_path)],
+            "Failed to replace remote file",
+        )
+
+    def _push(
+        self,
+        remote: str,
+        path: Path,
+        body: IO[bytes],
+        mode: int,
+        size: Optional[int] = None,
+    ) -> None:
+        try:
+            self.client.push(remote, path, body, mode, size)
+        except ConnectorException as exc:
+            raise ConnectorException(f"[{remote}] Failed to upload file: {exc}") from exc
+
+    def _run_with_input(
+        self, remote: str, command: str, stdin: IO[bytes], err_msg: str
+    ) -> None:
+        """Run shell command in the instance with 'stdin' as its standard input.
+
+        Input is uploaded to a temporary file unique to this command first, which is
+        removed afterward.
+        """
+        input_path = f"{INPUT_PATH}.{uuid.uuid4().hex}"
+        self._push(remote, Path(input_path), stdin, 0o600)
+        tmp = shlex.quote(input_path)
+        script = f"({command}) < {tmp}; rc=$?; rm -f {tmp}; exit $rc"
+        self._run(remote, ["sh", "-c", script], err_msg)
+
+    def _run(
+        self,
+        remote: str,
+        command: List[str],
+        err_msg: str,
+        stdout: bool = False,
+        timeout: Optional[float] = None,
+    ) -> bytes:
+        try:
+            return_code, output, stderr = self.client.exec(
+                remote, command, stdout, timeout
+            )
+        except ConnectorException as exc:
+            raise ConnectorException(f"[{remote}] {err_msg}: {exc}") from exc
+        if return_code != 0:
+            raise ConnectorException(f"[{remote}] {err_msg}: {stderr}".rstrip())
+        return output
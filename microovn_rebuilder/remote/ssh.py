@@ -1,77 +1,354 @@
+import asyncio
+import hashlib
+import io
 import os
-from typing import Dict, List
+import shlex
+import stat
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import IO, Dict, Iterator, List, Optional, Set, Tuple
 
-from paramiko import SSHClient, SSHException
+from paramiko import SFTPClient, SSHClient, SSHException
 
-from microovn_rebuilder.remote.base import BaseConnector, ConnectorException
+from microovn_rebuilder.remote.archive import extract_command
+from microovn_rebuilder.remote.base import (
+    BaseConnector,
+    ConnectorException,
+    ConnectorOptions,
+)
+from microovn_rebuilder.remote.checksum import checksum_command, parse_checksums
+from microovn_rebuilder.remote.compression import (
+    compressed_stream,
+    decompress_command,
+    upload_stream,
+)
+from microovn_rebuilder.remote.delta import (
+    BLOCK_SIZE,
+    PATCH_SCRIPT,
+    SIGNATURE_SCRIPT,
+    compute_delta,
+    parse_signature,
+)
+from microovn_rebuilder.remote.fanout import ssh_forward_command
 from microovn_rebuilder.target import Target
 
+COPY_BUFSIZE = 1024 * 1024
+
+
+class SFTPPool:
+    """SFTP sessions opened over a single SSH connection, kept open between uploads.
+
+    Each session runs in its own channel of the connection's transport, so multiple
+    sessions can be used for concurrent uploads.
+    """
+
+    def __init__(self, ssh: SSHClient) -> None:
+        self.ssh = ssh
+        self._idle: List[SFTPClient] = []
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def session(self) -> Iterator[SFTPClient]:
+        """Yield idle SFTP session, opening a new one if there is none.
+
+        Session is returned to the pool afterward, unless its use failed, in which
+        case it is closed and a new one is opened next time.
+        """
+        sftp = self._acquire()
+        try:
+            yield sftp
+        except BaseException:
+            sftp.close()
+            raise
+        with self._lock:
+            self._idle.append(sftp)
+
+    def close(self) -> None:
+        with self._lock:
+            for sftp in self._idle:
+                sftp.close()
+            self._idle.clear()
+
+    def _acquire(self) -> SFTPClient:
+        with self._lock:
+            while self._idle:
+                sftp = self._idle.pop()
+                channel = sftp.get_channel()
+                if channel is not None and not channel.closed:
+                    return sftp
+                sftp.close()
+        return self.ssh.open_sftp()
+
+
+# Delta of a local file against a remote file, see DeltaCache.delta
+Delta = Tuple[Optional[bytes], int, str]
+
+
+class DeltaCache:
+    """Deltas of local files of targets, computed once for each distinct remote
+    signature.
+
+    Remotes usually have identical copies of a file, so the delta computed against the
+    first of them is reused for the others, instead of rolling checksums over the file
+    again for each remote. Only deltas of the current local file of each target are
+    kept, so the cache does not grow with builds, even though stripped targets upload
+    a different local file after each build.
+    """
+
+    def __init__(self) -> None:
+        # Version (local path, modification time and size) of the local file of each
+        # target and its deltas, keyed by signature of the remote file
+        self._files: Dict[
+            Path,
+            Tuple[Tuple[Path, int, int], Dict[Tuple[Tuple[int, str], ...], Delta]],
+        ] = {}
+        self._locks: Dict[Path, threading.Lock] = {}
+        self._lock = threading.Lock()
+
+    def delta(self, target: Target, signature: List[Tuple[int, str]]) -> Delta:
+        """Return delta that turns remote file with 'signature' into local file of
+        'target' (None if they differ too much, see compute_delta), with size and
+        SHA-256 checksum of the local file.
+
+        Remotes that need the delta at the same time wait for the first of them to
+        compute it.
+        """
+        path = target.local_path
+        local_stat = os.stat(path)
+        version = (path, local_stat.st_mtime_ns, local_stat.st_size)
+        with self._lock:
+            lock = self._locks.setdefault(target.remote_path, threading.Lock())
+        with lock:
+            cached_version, deltas = self._files.get(target.remote_path, (None, {}))
+            if cached_version != version:
+                deltas = {}
+                self._files[target.remote_path] = (version, deltas)
+            key = tuple(signature)
+            if key not in deltas:
+                with open(path, "rb") as f:
+                    data = f.read()
+                deltas[key] = (
+                    compute_delta(data, signature, max_literal=len(data) // 2),
+                    len(data),
+                    hashlib.sha256(data).hexdigest(),
+                )
+            return deltas[key]
+
 
 class SSHConnector(BaseConnector):
-    def __init__(self, remotes: List[str]) -> None:
-        super().__init__(remotes=remotes)
+    def __init__(
+        self, remotes: List[str], options: Optional[ConnectorOptions] = None
+    ) -> None:
+        super().__init__(remotes=remotes, options=options)
 
         self.connections: Dict[str, SSHClient] = {}
+        self.sftp_pools: Dict[str, SFTPPool] = {}
+        self.delta_cache = DeltaCache()
 
     def initialize(self) -> None:
-        for remote in self.remotes:
-            username, found, host = remote.partition("@")
-            try:
-                ssh = SSHClient()
-                ssh.load_system_host_keys()
-                if found:
-                    ssh.connect(hostname=host, username=username)
+        """Connect to all remotes at once."""
+        self._run_on_reachable(self._connect)
+
+    def _connect(self, remote: str) -> None:
+        username, _, host = remote.rpartition("@")
+        timeout = self.options.connect_timeout
+        try:
+            ssh = SSHClient()
+            ssh.load_system_host_keys()
+            ssh.connect(
+                hostname=host,
+                username=username or None,
+                timeout=timeout,
+                banner_timeout=timeout,
+                auth_timeout=timeout,
+            )
+        except (SSHException, OSError) as exc:
+            raise ConnectorException(f"[{remote}] Failed to connect: {exc}") from exc
+        self.connections[remote] = ssh
+        self.sftp_pools[remote] = SFTPPool(ssh)
+
+    async def _transfer_target_async(self, remote: str, target: Target) -> None:
+        if self.options.channels > 1:
+            # paramiko blocks, so concurrent uploads to the remote need own threads
+            await asyncio.to_thread(self._transfer_target, remote, target)
+        else:
+            self._transfer_target(remote, target)
+
+    def _transfer_target(self, remote: str, target: Target) -> None:
+        ssh = self.connections[remote]
+        try:
+            local_stat = os.stat(str(target.local_path))
+            uploaded = self.options.delta and self._upload_delta(
+                ssh, remote, target, local_stat.st_mode
+            )
+            if not uploaded:
+                codec = self._compression(remote)
+                if codec:
+                    self._upload_compressed(ssh, remote, target, codec, local_stat)
                 else:
-                    ssh.connect(hostname=remote)
-                self.connections[remote] = ssh
-            except SSHException as exc:
-                raise ConnectorException(
-                    f"Failed to connect to {remote}: {exc}"
-                ) from exc
-
-    def update(self, target: Target) -> None:
-        for remote, ssh in self.connections.items():
-            try:
-                with ssh.open_sftp() as sftp:
-                    local_stat = os.stat(str(target.local_path))
-                    print(
-                        f"{os.linesep}[{remote}] Removing remote file {target.remote_path}"
-                    )
-                    sftp.remove(str(target.remote_path))
-
-                    print(
-                        f"[{remote}] Uploading file {target.local_path} to {target.remote_path}"
-                    )
-                    sftp.put(target.local_path, str(target.remote_path))
-                    sftp.chmod(str(target.remote_path), local_stat.st_mode)
-                if target.service:
-                    print(f"[{remote}] Restarting {target.service}")
-                    self._run_command(ssh, remote, f"snap restart {target.service}")
-            except SSHException as exc:
-                raise ConnectorException(
-                    f"[{remote}] Failed to upload file: {exc}"
-                ) from exc
+                    self._upload(remote, target, local_stat)
+        except (SSHException, OSError) as exc:
+            raise ConnectorException(f"[{remote}] Failed to upload file: {exc}") from exc
+
+    def _upload(self, remote: str, target: Target, local_stat: os.stat_result) -> None:
+        with self.sftp_pools[remote].session() as sftp:
+            self._print(
+                f"{os.linesep}[{remote}] Uploading file {target.local_path} to "
+                f"{target.remote_path}"
+            )
+            start = time.monotonic()
+            sftp.put(target.local_path, str(target.staging_path))
+            self._record_throughput(remote, local_stat.st_size, time.monotonic() - start)
+            sftp.chmod(str(target.staging_path), local_stat.st_mode)
+            sftp.posix_rename(str(target.staging_path), str(target.remote_path))
+
+    def _upload_compressed(
+        self,
+        ssh: SSHClient,
+        remote: str,
+        target: Target,
+        codec: str,
+        local_stat: os.stat_result,
+    ) -> None:
+        self._print(
+            f"{os.linesep}[{remote}] Uploading file {target.local_path} to "
+            f"{target.remote_path} ({codec} compressed)"
+        )
+        command = decompress_command(codec, target, local_stat.st_mode)
+        with compressed_stream(
+            target.local_path, codec, self.options.compression_level
+        ) as stream:
+            self._run_command(ssh, remote, command, stdin=stream)
+
+    def _upload_delta(
+        self, ssh: SSHClient, remote: str, target: Target, mode: int
+    ) -> bool:
+        """Upload only blocks of the target that differ from the file on the remote.
+
+        Returns False if the delta transfer is not possible, and the whole file
+        has to be uploaded instead.
+        """
+        remote_path = str(target.remote_path)
+        try:
+            output = self._run_command(
+                ssh,
+                remote,
+                shlex.join(
+                    ["python3", "-c", SIGNATURE_SCRIPT, remote_path, str(BLOCK_SIZE)]
+                ),
+            )
+        except ConnectorException as exc:
+            self._print(f"[{remote}] Failed to compute remote checksums: {exc}")
+            return False
+
+        signature = parse_signature(output)
+        if not signature:
+            self._print(f"{os.linesep}[{remote}] Remote file {remote_path} is missing")
+            return False
+
+        delta, size, digest = self.delta_cache.delta(target, signature)
+        if delta is None:
+            self._print(
+                f"{os.linesep}[{remote}] Remote file {remote_path} differs too much"
+            )
+            return False
+
+        self._print(
+            f"{os.linesep}[{remote}] Uploading delta of {target.local_path} to "
+            f"{remote_path} ({len(delta)}/{size} bytes)"
+        )
+        patch_command = [
+            "python3",
+            "-c",
+            PATCH_SCRIPT,
+            remote_path,
+            str(target.staging_path),
+            str(BLOCK_SIZE),
+            f"{stat.S_IMODE(mode):o}",
+            digest,
+        ]
+        start = time.monotonic()
+        self._run_command(
+            ssh, remote, shlex.join(patch_command), stdin=io.BytesIO(delta)
+        )
+        self._record_throughput(remote, len(delta), time.monotonic() - start)
+        return True
+
+    def _transfer_archive(
+        self, remote: str, archive: Path, targets: Set[Target]
+    ) -> None:
+        ssh = self.connections[remote]
+        self._print(
+            f"{os.linesep}[{remote}] Uploading {len(targets)} file(s) in a single archive"
+        )
+        codec = self._compression(remote)
+        with upload_stream(archive, codec, self.options.compression_level) as stream:
+            self._run_command(ssh, remote, extract_command(targets, codec), stdin=stream)
+
+    def _restart_services(self, remote: str, services: List[str]) -> None:
+        self._print(f"[{remote}] Restarting {', '.join(services)}")
+        self._run_command(
+            self.connections[remote], remote, shlex.join(["snap", "restart", *services])
+        )
+
+    def _remote_checksums(
+        self, remote: str, targets: Set[Target]
+    ) -> Dict[Target, Optional[str]]:
+        output = self._run_command(
+            self.connections[remote], remote, checksum_command(targets)
+        )
+        return parse_checksums(output, targets)
+
+    def _run_script(self, remote: str, script: str) -> None:
+        self._run_command(self.connections[remote], remote, script)
+
+    def _forward_target(self, source: str, remote: str, target: Target) -> None:
+        """Make the 'source' host send the file to the 'remote' over SSH."""
+        mode = os.stat(target.local_path).st_mode
+        command = ssh_forward_command(target, remote, mode)
+        try:
+            self._run_command(self.connections[source], source, command)
+        except ConnectorException as exc:
+            raise ConnectorException(
+                f"[{remote}] Failed to forward file from {source}: {exc}"
+            ) from exc
 
     def check_remote(self, remote_dst: str) -> None:
-        for remote, ssh in self.connections.items():
-            self._run_command(ssh, remote, f"test -d {remote_dst}")
+        command = f"timeout {self.options.connect_timeout:g} test -d {remote_dst}"
+
+        def check(remote: str) -> None:
+            self._run_command(self.connections[remote], remote, command)
+
+        self._run_on_reachable(check)
 
     @staticmethod
-    def _run_command(ssh: SSHClient, remote: str, command: str) -> None:
+    def _run_command(
+        ssh: SSHClient, remote: str, command: str, stdin: Optional[IO[bytes]] = None
+    ) -> bytes:
         try:
-            _, stdout, stderr = ssh.exec_command(command)
+            ssh_stdin, stdout, stderr = ssh.exec_command(command)
+            if stdin is not None:
+                while chunk := stdin.read(COPY_BUFSIZE):
+                    ssh_stdin.write(chunk)
+                ssh_stdin.channel.shutdown_write()
             ret_code = stdout.channel.recv_exit_status()
             if ret_code != 0:
                 error = stderr.read().decode("utf-8")
                 raise ConnectorException(
                     f"[{remote}] Failed to execute command: {error}]"
                 )
+            return stdout.read()
         except SSHException as exc:
             raise ConnectorException(
                 f"[{remote}] Failed to execute command: {exc}"
             ) from exc
 
     def teardown(self) -> None:
+        for pool in self.sftp_pools.values():
+            pool.close()
+        self.sftp_pools.clear()
         for host, ssh in self.connections.items():
             ssh.close()
         self.connections.clear()
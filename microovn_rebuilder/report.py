@@ -0,0 +1,166 @@
+import dataclasses
+import json
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import (
+    Any,
+    ContextManager,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+)
+
+LOCAL = "local"
+
+
+@dataclasses.dataclass(frozen=True)
+class Timing:
+    phase: str
+    seconds: float
+    # Remote host the phase ran on, None for phases that ran locally
+    remote: Optional[str] = None
+    # Remote path of the target the phase worked on, if any
+    target: Optional[str] = None
+    # Size (in bytes) of the uploaded data
+    size: Optional[int] = None
+
+    @property
+    def throughput(self) -> Optional[float]:
+        """Upload throughput in bytes per second."""
+        if self.size is None or self.seconds <= 0:
+            return None
+        return self.size / self.seconds
+
+    def to_json(self) -> Dict[str, Any]:
+        data = {
+            key: value
+            for key, value in dataclasses.asdict(self).items()
+            if value is not None
+        }
+        if self.throughput is not None:
+            data["throughput"] = self.throughput
+        return data
+
+
+@contextmanager
+def measure(timings: List[Timing], phase: str, **labels: Any) -> Iterator[None]:
+    """Time the body of the 'with' statement and append the result to 'timings'."""
+    start = time.monotonic()
+    try:
+        yield
+    finally:
+        timings.append(Timing(phase, time.monotonic() - start, **labels))
+
+
+def _format_size(size: float) -> str:
+    return f"{size / 1000 / 1000:.1f} MB"
+
+
+class TransferProgress:
+    """Progress of uploads from the local host during a single transfer.
+
+    Time left to complete the transfer is estimated from the throughput of the
+    uploads finished so far.
+    """
+
+    def __init__(self, total: int) -> None:
+        # Size (in bytes) of all uploads of the transfer
+        self.total = total
+        self.done = 0
+        self._started = time.monotonic()
+        self._lock = threading.Lock()
+
+    def advance(self, size: int) -> str:
+        """Record finished upload of 'size' bytes and return line describing the
+        progress of the transfer."""
+        with self._lock:
+            self.done += size
+            done = self.done
+        elapsed = time.monotonic() - self._started
+        line = f"[{LOCAL}] Uploaded {_format_size(done)} of {_format_size(self.total)}"
+        if self.total > 0:
+            line += f" ({min(done * 100 // self.total, 100)}%)"
+        if 0 < done < self.total and elapsed > 0:
+            left = (self.total - done) * elapsed / done
+            line += f", about {left:.0f}s left"
+        return line
+
+
+class DeployReport:
+    """Timings of the phases of rebuild and deploy cycles.
+
+    At the end of each cycle a summary table is printed, and if 'path' is set, the
+    cycle is appended to it as a single JSON line.
+    """
+
+    def __init__(self, path: Optional[Path] = None) -> None:
+        self.path = path
+        self.cycle = 0
+        self.timings: List[Timing] = []
+        # Record of the last finished cycle, as written to 'path'
+        self.last: Optional[Dict[str, Any]] = None
+        self._started = 0.0
+        self._start_time = 0.0
+
+    def start_cycle(self) -> None:
+        self.cycle += 1
+        self.timings = []
+        self._started = time.monotonic()
+        self._start_time = time.time()
+
+    def timed(self, phase: str) -> ContextManager[None]:
+        """Context manager that times local phase of the cycle."""
+        return measure(self.timings, phase)
+
+    def add(self, timings: Iterable[Timing]) -> None:
+        self.timings.extend(timings)
+
+    def finish_cycle(self, status: str) -> None:
+        duration = time.monotonic() - self._started
+        print(f"[local] Cycle {self.cycle} ({status}) took {duration:.2f}s")
+        for line in self.summary():
+            print(line)
+        self.last = {
+            "cycle": self.cycle,
+            "start": self._start_time,
+            "status": status,
+            "duration": duration,
+            "phases": [timing.to_json() for timing in self.timings],
+        }
+        if self.path is not None:
+            self._write(self.last)
+
+    def summary(self) -> List[str]:
+        """Return table with timings aggregated by phase and remote."""
+        rows: Dict[Tuple[str, str], List[Timing]] = {}
+        for timing in self.timings:
+            rows.setdefault((timing.phase, timing.remote or LOCAL), []).append(timing)
+        if not rows:
+            return []
+
+        lines = [
+            f"  {'phase':<10}{'remote':<20}{'count':>6}{'time':>10}"
+            f"{'size':>12}{'throughput':>14}"
+        ]
+        for (phase, remote), timings in rows.items():
+            seconds = sum(timing.seconds for timing in timings)
+            line = f"  {phase:<10}{remote:<20}{len(timings):>6}{seconds:>9.2f}s"
+            sizes = [timing.size for timing in timings if timing.size is not None]
+            if sizes:
+                size = sum(sizes)
+                line += f"{_format_size(size):>12}"
+                if seconds > 0:
+                    line += f"{_format_size(size / seconds) + '/s':>14}"
+            lines.append(line)
+        return lines
+
+    def _write(self, record: Dict[str, Any]) -> None:
+        assert self.path is not None
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.path, "a") as f:
+            f.write(json.dumps(record) + "\n")
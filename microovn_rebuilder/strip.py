@@ -0,0 +1,145 @@
+import dataclasses
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+from pathlib import Path
+from typing import Iterable, List, Optional, Set
+
+from microovn_rebuilder.index import ContentIndex
+from microovn_rebuilder.remote.base import ConnectorException
+from microovn_rebuilder.target import Target
+
+OBJCOPY = "objcopy"
+
+# Number of stripped files kept in the cache, the least recently stripped ones are
+# removed first.
+MAX_ENTRIES = 64
+
+
+def default_strip_cache_path() -> Path:
+    cache_dir = os.environ.get("XDG_CACHE_HOME") or Path.home() / ".cache"
+    return Path(cache_dir, "microovn-rebuilder", "stripped")
+
+
+def strip_commands(path: Path, name: str) -> List[List[str]]:
+    """Commands that split debug info of local file into '<name>.debug' and write
+    stripped copy, linked to the debug file, into '<name>'."""
+    debug_name = f"{name}.debug"
+    return [
+        [OBJCOPY, "--only-keep-debug", str(path), debug_name],
+        [
+            OBJCOPY,
+            "--strip-debug",
+            f"--add-gnu-debuglink={debug_name}",
+            str(path),
+            name,
+        ],
+    ]
+
+
+class StripCache:
+    """Content-addressed store of stripped copies of target files.
+
+    Local file of a target with 'strip' enabled is stripped only once per its content.
+    The stripped copy and the '.debug' file with its debug info are stored under the
+    SHA-256 digest of the original file, so rebuilds that do not change the file
+    reuse them.
+    """
+
+    def __init__(self, path: Path, index: Optional[ContentIndex] = None) -> None:
+        self.path = path
+        self.index = index or ContentIndex()
+        self._lock = threading.Lock()
+
+    def stripped(self, target: Target) -> Target:
+        """Return target that uploads stripped copy of the target's local file.
+
+        Targets without 'strip' enabled and targets whose local file does not exist
+        are returned unchanged.
+        """
+        if not target.strip:
+            return target
+        entry = self._entry(target)
+        if entry is None:
+            return target
+        return dataclasses.replace(
+            target,
+            local_rel_path=target.remote_path.name,
+            local_base_path=str(entry),
+            strip=False,
+        )
+
+    def debug_targets(self, targets: Iterable[Target]) -> Set[Target]:
+        """Return targets that upload debug info of the stripped targets.
+
+        Debug file is uploaded next to the remote file, as '<remote_path>.debug', where
+        debuggers look for it.
+        """
+        debug_targets = set()
+        for target in targets:
+            if not target.strip:
+                continue
+            entry = self._entry(target)
+            if entry is None:
+                continue
+            debug_targets.add(
+                Target(
+                    local_rel_path=f"{target.remote_path.name}.debug",
+                    remote_rel_path=f"{target.remote_rel_path}.debug",
+                    local_base_path=str(entry),
+                    remote_base_path=target.remote_base_path,
+                )
+            )
+        return debug_targets
+
+    def _entry(self, target: Target) -> Optional[Path]:
+        """Return cache directory with stripped copy of the target's local file,
+        stripping the file if it is not cached yet."""
+        with self._lock:
+            digest = self.index.digest(target.local_path)
+            if digest is None:
+                return None
+            name = target.remote_path.name
+            entry = self.path / digest / name
+            if entry.exists():
+                return entry
+
+            self.path.mkdir(parents=True, exist_ok=True)
+            tmp_dir = Path(tempfile.mkdtemp(dir=self.path, prefix=".tmp-"))
+            try:
+                self._strip(target.local_path, tmp_dir, name)
+                entry.parent.mkdir(exist_ok=True)
+                try:
+                    os.rename(tmp_dir, entry)
+                except OSError:
+                    # Other process stored the same file in the meantime
+                    pass
+            finally:
+                shutil.rmtree(tmp_dir, ignore_errors=True)
+            self._prune()
+            return entry
+
+    @staticmethod
+    def _strip(path: Path, out_dir: Path, name: str) -> None:
+        for command in strip_commands(path, name):
+            try:
+                result = subprocess.run(command, cwd=out_dir, capture_output=True)
+            except OSError as exc:
+                raise ConnectorException(
+                    f"[local] Failed to strip {path}: {exc}"
+                ) from exc
+            if result.returncode != 0:
+                error = result.stderr.decode("utf-8").strip()
+                raise ConnectorException(f"[local] Failed to strip {path}: {error}")
+        shutil.copymode(path, out_dir / name)
+
+    def _prune(self) -> None:
+        entries = sorted(
+            (entry for entry in self.path.iterdir() if not entry.name.startswith(".")),
+            key=lambda entry: entry.stat().st_mtime_ns,
+            reverse=True,
+        )
+        for entry in entries[MAX_ENTRIES:]:
+            shutil.rmtree(entry, ignore_errors=True)
@@ -1,6 +1,7 @@
 import dataclasses
+import os
 from pathlib import Path
-from typing import List, Optional, Set
+from typing import List, Optional, Set, Tuple
 
 import yaml
 
@@ -15,6 +16,10 @@ class Target:
 
     service: Optional[str] = None
     pre_exec: Optional[str] = None
+    # Shell command that succeeds once the service is ready again after restart
+    ready_check: Optional[str] = None
+    # Upload copy of the local file stripped of debug info (see strip.StripCache)
+    strip: bool = False
 
     @property
     def local_path(self) -> Path:
@@ -24,6 +29,73 @@ class Target:
     def remote_path(self) -> Path:
         return Path(self.remote_base_path, self.remote_rel_path)
 
+    @property
+    def staging_path(self) -> Path:
+        """Temporary remote path that the target is uploaded to, before it is
+        atomically renamed to 'remote_path'."""
+        return Path(f"{self.remote_path}.tmp")
+
+    def staged(self) -> "Target":
+        """Return target that uploads the local file to the staging path of this
+        target, leaving its remote file and service untouched (see
+        BaseConnector.stage)."""
+        return dataclasses.replace(
+            self,
+            remote_rel_path=f"{self.remote_rel_path}.tmp",
+            service=None,
+            pre_exec=None,
+            ready_check=None,
+        )
+
+
+# Characters that make 'local_path' of a target a glob pattern
+WILDCARDS = "*?["
+
+
+def is_pattern(local_path: str) -> bool:
+    """Check if 'local_path' of a target is a glob pattern or a directory."""
+    return local_path.endswith("/") or any(char in local_path for char in WILDCARDS)
+
+
+@dataclasses.dataclass(eq=True, frozen=True)
+class TargetPattern:
+    """Target whose 'local_path' is a glob pattern or a directory (with trailing
+    '/'), which expands to a target for each matching file in the build tree.
+
+    Glob pattern matches files in a single directory, which are uploaded into
+    'remote_path' directory under their own names. Directory matches all files in
+    it and its subdirectories, which keep their relative paths in 'remote_path'.
+    Other options of the 'template' apply to all expanded targets.
+    """
+
+    template: Target
+
+    @property
+    def recursive(self) -> bool:
+        return self.template.local_rel_path.endswith("/")
+
+    @property
+    def local_dir(self) -> Path:
+        """Local directory that the pattern expands against."""
+        return Path(
+            self.template.local_base_path,
+            os.path.dirname(self.template.local_rel_path),
+        )
+
+    @property
+    def name_pattern(self) -> str:
+        return os.path.basename(self.template.local_rel_path)
+
+    def target(self, rel_path: str) -> Target:
+        """Return target for the file at 'rel_path', relative to 'local_dir'."""
+        return dataclasses.replace(
+            self.template,
+            local_rel_path=os.path.join(
+                os.path.dirname(self.template.local_rel_path), rel_path
+            ),
+            remote_rel_path=os.path.join(self.template.remote_rel_path, rel_path),
+        )
+
 
 class ConfigException(Exception):
     pass
@@ -31,8 +103,11 @@ class ConfigException(Exception):
 
 def parse_config(
     cfg_path: str, local_base_path: str, remote_base_path: str
-) -> Set[Target]:
+) -> Tuple[Set[Target], List[TargetPattern]]:
+    """Return targets of the config file and patterns of its glob and directory
+    targets, which expand to more targets (see ContentIndex.expand)."""
     targets = set()
+    patterns = []
     try:
         with open(cfg_path, "r") as f:
             yaml_config = yaml.safe_load(f)
@@ -50,22 +125,31 @@ def parse_config(
         )
     try:
         for target in cfg_targets:
-            targets.add(
-                Target(
-                    local_rel_path=target["local_path"],
-                    remote_rel_path=target["remote_path"],
-                    local_base_path=local_base_path,
-                    remote_base_path=remote_base_path,
-                    service=target.get("service", None),
-                    pre_exec=target.get("pre_exec", None),
-                )
+            parsed = Target(
+                local_rel_path=target["local_path"],
+                remote_rel_path=target["remote_path"],
+                local_base_path=local_base_path,
+                remote_base_path=remote_base_path,
+                service=target.get("service", None),
+                pre_exec=target.get("pre_exec", None),
+                ready_check=target.get("ready_check", None),
+                strip=bool(target.get("strip", False)),
             )
+            if not is_pattern(parsed.local_rel_path):
+                targets.add(parsed)
+                continue
+            if any(char in os.path.dirname(parsed.local_rel_path) for char in WILDCARDS):
+                raise ConfigException(
+                    f"Target '{parsed.local_rel_path}' in config file '{cfg_path}' "
+                    f"can have wildcards only in its file name"
+                )
+            patterns.append(TargetPattern(parsed))
     except KeyError as exc:
         raise ConfigException(
             f"One of the 'targets' in config file '{cfg_path}' is missing key: {exc.args[0]}"
         ) from exc
 
-    if not targets:
+    if not targets and not patterns:
         raise ConfigException(f"No targets found in config file: {cfg_path}")
 
-    return targets
+    return targets, patterns
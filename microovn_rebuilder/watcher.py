@@ -0,0 +1,192 @@
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import subprocess
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+# inotify event flags (see inotify(7))
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+
+_EVENT = struct.Struct("iIII")
+
+# Only changes to files with these suffixes trigger rebuild. This filters out build
+# artifacts, editor swap files and other noise.
+SOURCE_SUFFIXES = (".c", ".h", ".xml", ".ovsschema", ".am", ".ac", ".py")
+
+# How often (in seconds) does the watcher thread check whether it should stop
+_POLL_INTERVAL = 0.5
+
+
+class WatcherException(Exception):
+    pass
+
+
+class Inotify:
+    """Minimal wrapper around Linux inotify API."""
+
+    def __init__(self) -> None:
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+            self._add_watch = libc.inotify_add_watch
+            self.fd = libc.inotify_init1(os.O_CLOEXEC)
+        except (OSError, AttributeError) as exc:
+            raise WatcherException(f"inotify is not available: {exc}") from exc
+        if self.fd < 0:
+            raise WatcherException(
+                f"Failed to initialize inotify: {os.strerror(ctypes.get_errno())}"
+            )
+
+    def add_watch(self, path: Path, mask: int) -> int:
+        wd = self._add_watch(self.fd, os.fsencode(path), mask)
+        if wd < 0:
+            raise WatcherException(
+                f"Failed to watch {path}: {os.strerror(ctypes.get_errno())}"
+            )
+        return int(wd)
+
+    def read(self, timeout: Optional[float]) -> List[Tuple[int, int, str]]:
+        """Return list of (watch descriptor, mask, name) events.
+
+        Blocks for at most 'timeout' seconds (indefinitely if None) waiting for the
+        events.
+        """
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return []
+
+        data = os.read(self.fd, 64 * 1024)
+        events = []
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = _EVENT.unpack_from(data, offset)
+            offset += _EVENT.size
+            name = data[offset : offset + length].rstrip(b"\0")
+            offset += length
+            events.append((wd, mask, os.fsdecode(name)))
+        return events
+
+    def close(self) -> None:
+        os.close(self.fd)
+
+
+class SourceWatcher:
+    """Watch source tree for changes of source files.
+
+    Changes are collected by a background thread started with 'start'. 'changed' event
+    is set whenever new changes arrive, so it can be used to cancel running builds.
+    """
+
+    def __init__(self, root: str, suffixes: Iterable[str] = SOURCE_SUFFIXES) -> None:
+        self.root = Path(root).absolute()
+        self.suffixes = tuple(suffixes)
+        self.changed = threading.Event()
+
+        self._inotify = Inotify()
+        self._dirs: Dict[int, Path] = {}
+        self._pending: Set[Path] = set()
+        self._last_change = 0.0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+        self._watch_tree(self.root)
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self._inotify.close()
+
+    def wait(self, debounce: float) -> Set[Path]:
+        """Block until source files change and return paths of changed files.
+
+        Returns only after no new changes arrived for 'debounce' seconds, so that
+        bursts of saves from an editor are coalesced.
+        """
+        self.changed.wait()
+        while True:
+            with self._lock:
+                quiet_for = time.monotonic() - self._last_change
+                if quiet_for >= debounce:
+                    changes, self._pending = self._pending, set()
+                    self.changed.clear()
+                    return changes
+            time.sleep(debounce - quiet_for)
+
+    def read_changes(self, timeout: Optional[float]) -> Set[Path]:
+        changes = set()
+        for wd, mask, name in self._inotify.read(timeout):
+            directory = self._dirs.get(wd)
+            if directory is None:
+                continue
+            if mask & IN_IGNORED:
+                del self._dirs[wd]
+                continue
+
+            path = directory / name
+            if name.startswith("."):
+                continue
+            if mask & IN_ISDIR:
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    self._watch_tree(path)
+                continue
+            if path.suffix in self.suffixes:
+                changes.add(path)
+
+        return self._not_ignored(changes)
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            changes = self.read_changes(_POLL_INTERVAL)
+            if changes:
+                with self._lock:
+                    self._pending |= changes
+                    self._last_change = time.monotonic()
+                    self.changed.set()
+
+    def _watch_tree(self, root: Path) -> None:
+        for dir_path, dir_names, _ in os.walk(root):
+            # Skip hidden directories like '.git', '.deps' or '.libs'
+            dir_names[:] = [name for name in dir_names if not name.startswith(".")]
+            try:
+                wd = self._inotify.add_watch(Path(dir_path), WATCH_MASK)
+            except WatcherException:
+                # Directory may have been removed in the meantime
+                continue
+            self._dirs[wd] = Path(dir_path)
+
+    def _not_ignored(self, paths: Set[Path]) -> Set[Path]:
+        """Filter out files ignored by git, i.e. files generated by the build."""
+        if not paths:
+            return paths
+        try:
+            result = subprocess.run(
+                ["git", "-C", str(self.root), "check-ignore", "--stdin"],
+                input=os.linesep.join(str(path) for path in paths).encode(),
+                capture_output=True,
+            )
+        except OSError:
+            return paths
+        # Return code 1 means that no path is ignored, anything else but 0 means that
+        # git can't tell (e.g. the source tree is not a git repository).
+        if result.returncode != 0:
+            return paths
+        ignored = {Path(line) for line in result.stdout.decode().splitlines()}
+        return paths - ignored
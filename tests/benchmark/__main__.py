@@ -0,0 +1,230 @@
+"""Measure deploy latency against local stand-in remotes.
+
+SSHConnector uploads to an in-process SFTP server and LXDConnector runs a fake
+'lxc' client, so that deploys to many remotes can be measured on a single
+machine, without any VMs or containers.
+
+Usage: python -m tests.benchmark --remotes 1,4,16 --targets 1,8 --sizes 1,10
+"""
+
+import argparse
+import itertools
+import json
+import os
+import shutil
+import stat
+import sys
+import tempfile
+import time
+import tracemalloc
+from contextlib import redirect_stdout
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import List, Set, Tuple
+
+from paramiko import AutoAddPolicy, SSHClient
+
+from microovn_rebuilder.remote import BaseConnector, ConnectorOptions
+from microovn_rebuilder.remote.aio import ThreadedConnector
+from microovn_rebuilder.remote.lxd import AsyncLXDConnector, LXDConnector
+from microovn_rebuilder.remote.ssh import SFTPPool, SSHConnector
+from microovn_rebuilder.target import Target
+from tests.benchmark import lxc_shim
+from tests.benchmark.sftp_server import PASSWORD, SFTPServerThread
+
+REMOTE_BASE_PATH = "/squashfs-root/"
+MB = 1000 * 1000
+
+
+@dataclass(frozen=True)
+class Result:
+    connector: str
+    engine: str
+    remotes: int
+    targets: int
+    size_mb: int
+    wall: float
+    throughput: float
+    peak_memory: int
+
+
+def _int_list(value: str) -> List[int]:
+    return [int(item) for item in value.split(",")]
+
+
+def parse_args(argv: List[str]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        prog="python -m tests.benchmark", description=__doc__.splitlines()[0]
+    )
+    parser.add_argument("--connector", choices=("ssh", "lxd"), default="ssh")
+    parser.add_argument(
+        "--remotes", type=_int_list, default=[1, 4, 16, 64], help="Numbers of remotes"
+    )
+    parser.add_argument(
+        "--targets", type=_int_list, default=[1, 8], help="Numbers of targets"
+    )
+    parser.add_argument(
+        "--sizes", type=_int_list, default=[1, 10, 100], help="Target sizes in MB"
+    )
+    parser.add_argument(
+        "--max-total",
+        type=int,
+        default=2000,
+        help="Skip combinations that upload more than this many MB in total",
+    )
+    parser.add_argument("-p", "--parallel", type=int, default=8)
+    parser.add_argument("--channels", type=int, default=1)
+    parser.add_argument(
+        "--async",
+        dest="use_async",
+        action="store_true",
+        help="Use the asyncio connector engine",
+    )
+    parser.add_argument(
+        "--json", type=Path, help="Append results to this file as JSON lines"
+    )
+    return parser.parse_args(argv)
+
+
+def make_targets(local_dir: Path, count: int, size_mb: int) -> Set[Target]:
+    targets = set()
+    for i in range(count):
+        name = f"bin/target-{i}"
+        local_path = local_dir / name
+        local_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(local_path, "wb") as f:
+            for _ in range(size_mb):
+                f.write(os.urandom(MB))
+        local_path.chmod(0o755)
+        targets.add(
+            Target(
+                local_rel_path=name,
+                remote_rel_path=name,
+                local_base_path=str(local_dir),
+                remote_base_path=REMOTE_BASE_PATH,
+                service="benchmark",
+            )
+        )
+    return targets
+
+
+def prepare_remotes(remotes_dir: Path, remotes: List[str]) -> None:
+    shutil.rmtree(remotes_dir, ignore_errors=True)
+    for remote in remotes:
+        (remotes_dir / remote / REMOTE_BASE_PATH.strip("/") / "bin").mkdir(parents=True)
+
+
+def ssh_connector(
+    server: SFTPServerThread, remotes: List[str], options: ConnectorOptions
+) -> SSHConnector:
+    # SSHConnector.initialize() connects to the default SSH port using system host
+    # keys, so connections to the local server are set up here instead.
+    connector = SSHConnector(remotes, options)
+    for remote in remotes:
+        ssh = SSHClient()
+        ssh.set_missing_host_key_policy(AutoAddPolicy())
+        ssh.connect(
+            "127.0.0.1",
+            port=server.port,
+            username=remote,
+            password=PASSWORD,
+            look_for_keys=False,
+            allow_agent=False,
+        )
+        connector.connections[remote] = ssh
+        connector.sftp_pools[remote] = SFTPPool(ssh)
+    return connector
+
+
+def install_lxc_shim(bin_dir: Path, remotes_dir: Path) -> None:
+    bin_dir.mkdir(parents=True, exist_ok=True)
+    lxc = bin_dir / "lxc"
+    lxc.write_text(f'#!/bin/sh\nexec "{sys.executable}" "{lxc_shim.__file__}" "$@"\n')
+    lxc.chmod(lxc.stat().st_mode | stat.S_IEXEC)
+    os.environ["PATH"] = f"{bin_dir}{os.pathsep}{os.environ['PATH']}"
+    os.environ[lxc_shim.ROOT_ENV] = str(remotes_dir)
+
+
+def run(connector: BaseConnector, targets: Set[Target]) -> Tuple[float, int]:
+    """Deploy targets to all remotes, returning wall time and peak memory."""
+    tracemalloc.start()
+    start = time.monotonic()
+    with open(os.devnull, "w") as devnull, redirect_stdout(devnull):
+        connector.update_many(targets)
+    wall = time.monotonic() - start
+    peak_memory = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return wall, peak_memory
+
+
+def main(argv: List[str]) -> None:
+    args = parse_args(argv)
+    options = ConnectorOptions(parallel=args.parallel, channels=args.channels)
+
+    with tempfile.TemporaryDirectory(prefix="microovn-rebuilder-bench-") as tmp:
+        work_dir = Path(tmp)
+        remotes_dir = work_dir / "remotes"
+        server = None
+        if args.connector == "ssh":
+            server = SFTPServerThread(remotes_dir)
+            server.start()
+        else:
+            install_lxc_shim(work_dir / "bin", remotes_dir)
+
+        print(
+            f"{'connector':<10}{'engine':<8}{'remotes':>8}{'targets':>8}{'size':>8}"
+            f"{'wall':>10}{'throughput':>14}{'peak mem':>12}"
+        )
+        try:
+            for remote_count, target_count, size_mb in itertools.product(
+                args.remotes, args.targets, args.sizes
+            ):
+                if remote_count * target_count * size_mb > args.max_total:
+                    continue
+                local_dir = work_dir / "local"
+                shutil.rmtree(local_dir, ignore_errors=True)
+                targets = make_targets(local_dir, target_count, size_mb)
+                remotes = [f"remote-{i}" for i in range(remote_count)]
+                prepare_remotes(remotes_dir, remotes)
+
+                connector: BaseConnector
+                if server is not None:
+                    connector = ssh_connector(server, remotes, options)
+                    if args.use_async:
+                        connector = ThreadedConnector(connector)
+                elif args.use_async:
+                    connector = AsyncLXDConnector(remotes, options)
+                else:
+                    connector = LXDConnector(remotes, options)
+                try:
+                    wall, peak_memory = run(connector, targets)
+                finally:
+                    connector.teardown()
+
+                result = Result(
+                    connector=args.connector,
+                    engine="async" if args.use_async else "threads",
+                    remotes=remote_count,
+                    targets=target_count,
+                    size_mb=size_mb,
+                    wall=wall,
+                    throughput=remote_count * target_count * size_mb / wall,
+                    peak_memory=peak_memory,
+                )
+                print(
+                    f"{result.connector:<10}{result.engine:<8}"
+                    f"{result.remotes:>8}{result.targets:>8}"
+                    f"{result.size_mb:>6}MB{result.wall:>9.2f}s"
+                    f"{result.throughput:>9.1f} MB/s"
+                    f"{result.peak_memory / MB:>9.1f} MB"
+                )
+                if args.json is not None:
+                    with open(args.json, "a") as f:
+                        f.write(json.dumps(asdict(result)) + "\n")
+        finally:
+            if server is not None:
+                server.stop()
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
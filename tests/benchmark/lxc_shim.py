@@ -0,0 +1,52 @@
+"""Stand-in for the 'lxc' command line client used by benchmarks.
+
+Containers are emulated by directories under $BENCH_LXC_ROOT, one per container
+name. Only the subcommands that LXDConnector runs for plain uploads are
+supported.
+"""
+
+import os
+import shutil
+import sys
+from pathlib import Path
+from typing import List
+
+ROOT_ENV = "BENCH_LXC_ROOT"
+
+
+def _resolve(container: str, path: str) -> Path:
+    return Path(os.environ[ROOT_ENV]) / container / path.lstrip("/")
+
+
+def _file_push(src: str, dst: str) -> int:
+    container, _, path = dst.partition("/")
+    shutil.copyfile(src, _resolve(container, path))
+    shutil.copymode(src, _resolve(container, path))
+    return 0
+
+
+def _exec(container: str, argv: List[str]) -> int:
+    if argv[:1] == ["--"]:
+        argv = argv[1:]
+    if argv[:2] == ["snap", "restart"]:
+        return 0
+    if argv[:2] == ["test", "-d"]:
+        return 0 if _resolve(container, argv[2]).is_dir() else 1
+    if argv[:2] == ["mv", "-f"]:
+        os.replace(_resolve(container, argv[2]), _resolve(container, argv[3]))
+        return 0
+    print(f"unsupported command: {' '.join(argv)}", file=sys.stderr)
+    return 127
+
+
+def main(argv: List[str]) -> int:
+    if argv[:2] == ["file", "push"]:
+        return _file_push(argv[2], argv[3])
+    if argv[:1] == ["exec"]:
+        return _exec(argv[1], argv[2:])
+    print(f"unsupported command: lxc {' '.join(argv)}", file=sys.stderr)
+    return 127
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,171 @@
+"""In-process SSH/SFTP server that stands in for remote hosts in benchmarks.
+
+Each user name is a separate "remote host" with its own root directory, so that
+multiple remotes can share one server without overwriting each other's files.
+Remote paths are resolved relative to the user's root directory.
+"""
+
+import logging
+import os
+import shlex
+import socket
+import threading
+from pathlib import Path
+from typing import Any, List, Optional
+
+import paramiko
+from paramiko import (
+    AUTH_SUCCESSFUL,
+    OPEN_SUCCEEDED,
+    SFTP_OK,
+    RSAKey,
+    ServerInterface,
+    SFTPAttributes,
+    SFTPHandle,
+    SFTPServer,
+    SFTPServerInterface,
+)
+
+PASSWORD = "benchmark"
+
+# Server transports log connection resets when clients disconnect, which is expected
+LOG_CHANNEL = "microovn_rebuilder.benchmark.server"
+logging.getLogger(LOG_CHANNEL).setLevel(logging.CRITICAL)
+
+
+def _resolve(root: Path, path: str) -> Path:
+    return root / path.lstrip("/")
+
+
+class _Server(ServerInterface):
+    def __init__(self, base_dir: Path) -> None:
+        self.base_dir = base_dir
+        self.root = base_dir
+
+    def get_allowed_auths(self, username: str) -> str:
+        return "password"
+
+    def check_auth_password(self, username: str, password: str) -> int:
+        self.root = self.base_dir / username
+        return AUTH_SUCCESSFUL
+
+    def check_channel_request(self, kind: str, chanid: int) -> int:
+        return OPEN_SUCCEEDED
+
+    def check_channel_exec_request(self, channel: Any, command: bytes) -> bool:
+        threading.Thread(
+            target=self._exec, args=(channel, command.decode()), daemon=True
+        ).start()
+        return True
+
+    def _exec(self, channel: paramiko.Channel, command: str) -> None:
+        """Emulate the few commands that connectors run outside of SFTP."""
+        argv = shlex.split(command)
+        if argv[:2] == ["snap", "restart"]:
+            return_code = 0
+        elif argv[:2] == ["test", "-d"]:
+            return_code = 0 if _resolve(self.root, argv[2]).is_dir() else 1
+        else:
+            channel.sendall_stderr(f"unsupported command: {command}".encode())
+            return_code = 127
+        # Channel is not closed here, as that could happen before the server replies
+        # to the exec request. Client closes it once it reads the output.
+        channel.send_exit_status(return_code)
+        channel.shutdown_write()
+
+
+class _Handle(SFTPHandle):
+    def stat(self) -> Any:
+        return SFTPAttributes.from_stat(os.fstat(self.readfile.fileno()))
+
+
+class _RootedSFTPServer(SFTPServerInterface):
+    def __init__(self, server: _Server, *args: Any, **kwargs: Any) -> None:
+        super().__init__(server, *args, **kwargs)
+        self.root = server.root
+
+    def open(self, path: str, flags: int, attr: SFTPAttributes) -> Any:
+        local_path = _resolve(self.root, path)
+        mode = attr.st_mode if attr.st_mode is not None else 0o644
+        try:
+            fd = os.open(local_path, flags, mode)
+        except OSError as exc:
+            return SFTPServer.convert_errno(exc.errno)
+        if flags & (os.O_WRONLY | os.O_RDWR):
+            fmode = "r+b" if flags & os.O_RDWR else "wb"
+        else:
+            fmode = "rb"
+        handle = _Handle(flags)
+        handle.filename = str(local_path)
+        handle.readfile = handle.writefile = os.fdopen(fd, fmode)
+        return handle
+
+    def stat(self, path: str) -> Any:
+        try:
+            return SFTPAttributes.from_stat(os.stat(_resolve(self.root, path)))
+        except OSError as exc:
+            return SFTPServer.convert_errno(exc.errno)
+
+    lstat = stat
+
+    def chattr(self, path: str, attr: SFTPAttributes) -> int:
+        try:
+            if attr.st_mode is not None:
+                os.chmod(_resolve(self.root, path), attr.st_mode)
+        except OSError as exc:
+            return int(SFTPServer.convert_errno(exc.errno))
+        return SFTP_OK
+
+    def remove(self, path: str) -> int:
+        try:
+            os.remove(_resolve(self.root, path))
+        except OSError as exc:
+            return int(SFTPServer.convert_errno(exc.errno))
+        return SFTP_OK
+
+    def posix_rename(self, oldpath: str, newpath: str) -> int:
+        try:
+            os.replace(_resolve(self.root, oldpath), _resolve(self.root, newpath))
+        except OSError as exc:
+            return int(SFTPServer.convert_errno(exc.errno))
+        return SFTP_OK
+
+    rename = posix_rename
+
+
+class SFTPServerThread:
+    """SSH server listening on a random local port, serving each connection in
+    its own thread."""
+
+    def __init__(self, base_dir: Path) -> None:
+        self.base_dir = base_dir
+        self.host_key = RSAKey.generate(2048)
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._socket.bind(("127.0.0.1", 0))
+        self._socket.listen(128)
+        self.port = self._socket.getsockname()[1]
+        self._transports: List[paramiko.Transport] = []
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self._serve, daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._socket.close()
+        for transport in self._transports:
+            transport.close()
+
+    def _serve(self) -> None:
+        while True:
+            try:
+                client, _ = self._socket.accept()
+            except OSError:
+                return
+            transport = paramiko.Transport(client)
+            transport.set_log_channel(LOG_CHANNEL)
+            transport.add_server_key(self.host_key)
+            transport.set_subsystem_handler("sftp", SFTPServer, _RootedSFTPServer)
+            transport.start_server(server=_Server(self.base_dir))
+            self._transports.append(transport)
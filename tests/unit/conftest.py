@@ -27,7 +27,8 @@ def remote_deployment_path() -> str:
 def default_targets(
     config_file: str, local_ovn_path: str, remote_deployment_path: str
 ) -> Set[Target]:
-    return parse_config(config_file, local_ovn_path, remote_deployment_path)
+    targets, _ = parse_config(config_file, local_ovn_path, remote_deployment_path)
+    return targets
 
 
 @pytest.fixture(scope="session")
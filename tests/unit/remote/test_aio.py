@@ -0,0 +1,163 @@
+import asyncio
+import concurrent.futures
+import threading
+from unittest.mock import call
+
+import pytest
+
+from microovn_rebuilder.remote import ConnectorOptions, aio, base, lxd
+from microovn_rebuilder.target import Target
+
+
+@pytest.fixture()
+def make_connector():
+    connectors = []
+
+    def make(remotes=("vm1", "vm2", "vm3"), **options) -> lxd.AsyncLXDConnector:
+        connector = lxd.AsyncLXDConnector(list(remotes), ConnectorOptions(**options))
+        connectors.append(connector)
+        return connector
+
+    yield make
+    for connector in connectors:
+        connector.teardown()
+
+
+def test_blocking_operations(mocker, make_connector, default_targets, tmp_path):
+    connector = make_connector()
+    target = next(iter(default_targets))
+    mock_transfer = mocker.patch.object(connector, "_transfer_target_async")
+    mock_archive = mocker.patch.object(connector, "_transfer_archive_async")
+    mock_restart = mocker.patch.object(connector, "_restart_services_async")
+    mock_checksums = mocker.patch.object(
+        connector, "_remote_checksums_async", return_value={target: "abcd"}
+    )
+    mock_run_script = mocker.patch.object(connector, "_run_script_async")
+    mock_forward = mocker.patch.object(connector, "_forward_target_async")
+
+    connector._transfer_target("vm1", target)
+    connector._run_script("vm1", "true")
+    connector._forward_target("vm1", "vm2", target)
+    connector._transfer_archive("vm1", tmp_path, {target})
+    connector._restart_services("vm1", ["svc"])
+
+    assert connector._remote_checksums("vm1", {target}) == {target: "abcd"}
+    mock_transfer.assert_awaited_once_with("vm1", target)
+    mock_archive.assert_awaited_once_with("vm1", tmp_path, {target})
+    mock_restart.assert_awaited_once_with("vm1", ["svc"])
+    mock_checksums.assert_awaited_once_with("vm1", {target})
+    mock_run_script.assert_awaited_once_with("vm1", "true")
+    mock_forward.assert_awaited_once_with("vm1", "vm2", target)
+
+
+def test_interrupt_cancels_tasks(mocker, make_connector):
+    connector = make_connector(parallel=3)
+    connector.initialize()
+    started = threading.Semaphore(0)
+    cancelled = []
+
+    async def restart(remote: str, services) -> None:
+        started.release()
+        try:
+            await asyncio.Event().wait()
+        except asyncio.CancelledError:
+            cancelled.append(remote)
+            raise
+
+    mocker.patch.object(connector, "_restart_services_async", side_effect=restart)
+
+    def interrupt(future, timeout=None):
+        # Simulate Ctrl-C once all remotes are being worked on
+        for _ in connector.remotes:
+            started.acquire()
+        mocker.stopall()
+        raise KeyboardInterrupt()
+
+    mocker.patch.object(concurrent.futures.Future, "result", interrupt)
+
+    with pytest.raises(KeyboardInterrupt):
+        connector.restart(["svc"])
+
+    assert sorted(cancelled) == connector.remotes
+
+
+def test_teardown(make_connector):
+    connector = make_connector()
+    connector.teardown()
+
+    connector.initialize()
+    thread = connector._loop_thread
+    assert thread is not None and thread.is_alive()
+
+    connector.teardown()
+    assert not thread.is_alive()
+    assert connector._loop is None
+
+
+def test_threaded_connector(mocker, default_targets, tmp_path):
+    wrapped = lxd.LXDConnector(["vm1", "vm2"], ConnectorOptions(parallel=2))
+    connector = aio.ThreadedConnector(wrapped)
+    target = next(t for t in default_targets if t.service)
+    mock_print = mocker.patch("builtins.print")
+    mock_initialize = mocker.patch.object(wrapped, "initialize")
+    mock_teardown = mocker.patch.object(wrapped, "teardown")
+    mock_check_remote = mocker.patch.object(wrapped, "check_remote")
+    threads = set()
+
+    def transfer(remote: str, target: Target) -> None:
+        threads.add(threading.current_thread())
+        wrapped._print(f"[{remote}] uploading")
+
+    mocker.patch.object(wrapped, "_transfer_target", side_effect=transfer)
+    mock_archive = mocker.patch.object(wrapped, "_transfer_archive")
+    mock_run_script = mocker.patch.object(wrapped, "_run_script")
+    mock_forward = mocker.patch.object(wrapped, "_forward_target")
+    mock_restart = mocker.patch.object(wrapped, "_restart_services")
+    mock_checksums = mocker.patch.object(
+        wrapped, "_remote_checksums", return_value={target: None}
+    )
+
+    connector.initialize()
+    connector.check_remote("/root")
+    connector.update_many({target})
+    connector._transfer_archive("vm1", tmp_path, {target})
+    connector._run_script("vm2", "true")
+    connector._forward_target("vm1", "vm2", target)
+    assert connector.remote_checksums({target}) == {
+        "vm1": {target: None},
+        "vm2": {target: None},
+    }
+    connector.teardown()
+
+    assert connector.options is wrapped.options
+    mock_initialize.assert_called_once()
+    mock_teardown.assert_called_once()
+    mock_check_remote.assert_called_once_with("/root")
+    assert threading.main_thread() not in threads
+    mock_print.assert_has_calls(
+        [call("[vm1] uploading"), call("[vm2] uploading")], any_order=True
+    )
+    mock_archive.assert_called_once_with("vm1", tmp_path, {target})
+    mock_run_script.assert_called_once_with("vm2", "true")
+    mock_forward.assert_called_once_with("vm1", "vm2", target)
+    mock_restart.assert_has_calls(
+        [call(remote, [target.service]) for remote in connector.remotes],
+        any_order=True,
+    )
+    mock_checksums.assert_has_calls(
+        [call(remote, {target}) for remote in connector.remotes], any_order=True
+    )
+
+
+def test_threaded_connector_throughput():
+    options = ConnectorOptions(compression="gzip", compression_threshold=1.0)
+    wrapped = lxd.LXDConnector(["vm1", "vm2"], options)
+    connector = aio.ThreadedConnector(wrapped)
+
+    # Throughput of archives uploaded by the wrapper decides compression of the
+    # uploads made by the wrapped connector, and vice versa
+    connector._record_throughput("vm1", base.MIN_MEASURED_SIZE, 2.0)
+    wrapped._record_throughput("vm2", base.MIN_MEASURED_SIZE, 2.0)
+
+    assert wrapped._compression("vm1") == "gzip"
+    assert connector._compression("vm2") == "gzip"
@@ -0,0 +1,64 @@
+import subprocess
+import tarfile
+
+import pytest
+
+from microovn_rebuilder.remote.archive import extract_command, target_archive
+from microovn_rebuilder.target import Target
+
+
+def _targets(tmp_path, remote_base_path="/root/squashfs-root/"):
+    targets = set()
+    for name, mode in (("ovn-northd", 0o755), ("ovn-nbctl", 0o700)):
+        local_file = tmp_path / name
+        local_file.write_bytes(name.encode())
+        local_file.chmod(mode)
+        targets.add(
+            Target(
+                local_rel_path=name,
+                remote_rel_path=f"bin/{name}",
+                local_base_path=str(tmp_path),
+                remote_base_path=remote_base_path,
+            )
+        )
+    return targets
+
+
+def test_target_archive(tmp_path):
+    targets = _targets(tmp_path)
+
+    with target_archive(targets) as archive_path:
+        with tarfile.open(archive_path) as archive:
+            members = {member.name: member for member in archive.getmembers()}
+            for target in targets:
+                member = members[str(target.staging_path).lstrip("/")]
+                assert member.mode == target.local_path.stat().st_mode & 0o7777
+                assert (member.uid, member.gid) == (0, 0)
+                assert (member.uname, member.gname) == ("root", "root")
+                content = archive.extractfile(member)
+                assert content is not None
+                assert content.read() == target.local_path.read_bytes()
+
+    assert not archive_path.exists()
+
+
+@pytest.mark.parametrize("codec", [None, "gzip"])
+def test_extract_command(tmp_path, codec):
+    remote_dir = tmp_path / "remote"
+    (remote_dir / "bin").mkdir(parents=True)
+    (remote_dir / "bin" / "ovn-northd").write_bytes(b"old")
+    targets = _targets(tmp_path, str(remote_dir))
+    command = extract_command(targets, codec)
+
+    with target_archive(targets) as archive_path:
+        data = archive_path.read_bytes()
+    if codec:
+        data = subprocess.run(["gzip", "-c"], input=data, capture_output=True).stdout
+    subprocess.run(["sh", "-c", command], input=data, check=True)
+
+    if codec:
+        assert "--use-compress-program=gzip" in command
+    for target in targets:
+        assert target.remote_path.read_bytes() == target.local_path.read_bytes()
+        assert target.remote_path.stat().st_mode == target.local_path.stat().st_mode
+        assert not target.staging_path.exists()
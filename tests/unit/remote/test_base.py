@@ -0,0 +1,906 @@
+import asyncio
+import dataclasses
+import itertools
+import threading
+from typing import List
+from unittest.mock import AsyncMock, MagicMock, call
+
+import pytest
+
+from microovn_rebuilder.remote import (
+    ConnectorException,
+    ConnectorOptions,
+    UpdateException,
+    base,
+    lxd,
+)
+from microovn_rebuilder.remote.hooks import pre_exec_command, readiness_command
+from microovn_rebuilder.strip import StripCache
+from microovn_rebuilder.target import Target
+
+
+@pytest.fixture()
+def archive_path(tmp_path):
+    path = tmp_path / "targets.tar"
+    path.write_bytes(b"archive")
+    return path
+
+
+@pytest.fixture()
+def mock_target_archive(mocker, archive_path):
+    mock = mocker.patch.object(base, "target_archive")
+    mock.return_value.__enter__.return_value = archive_path
+    return mock
+
+
+@pytest.fixture(
+    params=[lxd.LXDConnector, lxd.AsyncLXDConnector], ids=["threads", "asyncio"]
+)
+def make_connector(request):
+    """Create LXD connectors running on each engine, torn down after the test."""
+    connectors = []
+
+    def make(remotes, options=None):
+        connector = request.param(remotes, options)
+        connectors.append(connector)
+        return connector
+
+    yield make
+    for connector in connectors:
+        connector.teardown()
+
+
+@pytest.mark.parametrize("parallel", [1, 4])
+def test_run_on_remotes(parallel):
+    connector = lxd.LXDConnector(
+        ["vm1", "vm2", "vm3"], ConnectorOptions(parallel=parallel)
+    )
+    action = MagicMock()
+
+    connector._run_on_remotes(action)
+
+    action.assert_has_calls(
+        [call(remote) for remote in connector.remotes], any_order=True
+    )
+    assert action.call_count == len(connector.remotes)
+
+
+@pytest.mark.parametrize("parallel", [1, 4])
+def test_run_on_remotes_collects_errors(parallel):
+    connector = lxd.LXDConnector(
+        ["vm1", "vm2", "vm3"], ConnectorOptions(parallel=parallel)
+    )
+
+    def fail_some(remote: str) -> None:
+        if remote != "vm2":
+            raise ConnectorException(f"[{remote}] failed")
+
+    action = MagicMock(side_effect=fail_some)
+
+    with pytest.raises(ConnectorException) as exc:
+        connector._run_on_remotes(action)
+
+    assert action.call_count == len(connector.remotes)
+    assert "[vm1] failed" in str(exc.value)
+    assert "[vm3] failed" in str(exc.value)
+    assert "vm2" not in str(exc.value)
+
+
+def test_run_on_remotes_parallel_output_grouped(mocker, make_connector):
+    connector = make_connector(["vm1", "vm2"], ConnectorOptions(parallel=2))
+    mock_print = mocker.patch("builtins.print")
+
+    async def action(remote: str) -> None:
+        connector._print(f"[{remote}] first")
+        # Let the other remote print in between, if it can
+        await asyncio.sleep(0)
+        connector._print(f"[{remote}] second")
+
+    connector._run_on_remotes(action)
+
+    printed = [c.args[0] for c in mock_print.call_args_list]
+    assert len(printed) == 4
+    for remote in connector.remotes:
+        first = printed.index(f"[{remote}] first")
+        assert printed[first + 1] == f"[{remote}] second"
+
+
+def test_run_on_reachable(mocker):
+    connector = lxd.LXDConnector(
+        ["vm1", "vm2", "vm3"], ConnectorOptions(parallel=1, skip_unreachable=True)
+    )
+    barrier = threading.Barrier(3, timeout=5)
+    mocker.patch("builtins.print")
+
+    def connect(remote: str) -> None:
+        # All remotes are checked at once, regardless of 'parallel'
+        barrier.wait()
+        if remote == "vm2":
+            raise ConnectorException(f"[{remote}] unreachable")
+
+    connector._run_on_reachable(connect)
+
+    assert connector.remotes == ["vm1", "vm3"]
+
+
+def test_run_on_reachable_none_reachable():
+    connector = lxd.LXDConnector(["vm1", "vm2"], ConnectorOptions(skip_unreachable=True))
+
+    def connect(remote: str) -> None:
+        raise ConnectorException(f"[{remote}] unreachable")
+
+    with pytest.raises(ConnectorException) as exc:
+        connector._run_on_reachable(connect)
+
+    assert str(exc.value).splitlines() == ["[vm1] unreachable", "[vm2] unreachable"]
+    assert connector.remotes == ["vm1", "vm2"]
+
+
+def test_print_unbuffered(mocker):
+    connector = lxd.LXDConnector(["vm1"])
+    mock_print = mocker.patch("builtins.print")
+
+    connector._print("foo")
+
+    mock_print.assert_called_once_with("foo")
+
+
+def test_parallel_minimum():
+    assert lxd.LXDConnector(["vm1"], ConnectorOptions(parallel=0)).parallel == 1
+
+
+def test_update_many(mocker, default_targets):
+    connector = lxd.LXDConnector(["vm1", "vm2"])
+    manager = MagicMock()
+    mocker.patch.object(connector, "pre_exec", manager.pre_exec)
+    mocker.patch.object(connector, "_transfer", manager.transfer)
+    mocker.patch.object(connector, "_restart_remotes", manager.restart)
+    manager.transfer.return_value = (connector.remotes, None)
+    manager.restart.return_value = (connector.remotes, None)
+
+    connector.update_many(default_targets)
+
+    # All transfers finish before services are restarted
+    services = connector._services(default_targets)
+    assert manager.mock_calls == [
+        call.pre_exec({remote: default_targets for remote in connector.remotes}),
+        call.transfer(default_targets),
+        call.restart({remote: (services, []) for remote in connector.remotes}),
+    ]
+
+
+def test_update_many_staged(mocker, default_targets):
+    connector = lxd.LXDConnector(["vm1", "vm2"])
+    manager = MagicMock()
+    result = (connector.remotes, None)
+    manager.attach_mock(mocker.patch.object(connector, "pre_exec"), "pre_exec")
+    manager.attach_mock(
+        mocker.patch.object(connector, "_transfer", return_value=result), "transfer"
+    )
+    manager.attach_mock(
+        mocker.patch.object(connector, "_apply_staged", return_value=result), "apply"
+    )
+    manager.attach_mock(
+        mocker.patch.object(connector, "_restart_remotes", return_value=result),
+        "restart",
+    )
+    staged = {t for t in default_targets if t.service}
+
+    connector.update_many(default_targets, staged)
+
+    # Hooks of all targets run once, staged files are moved into place only after
+    # all other uploads finish
+    services = connector._services(default_targets)
+    assert manager.mock_calls == [
+        call.pre_exec({remote: default_targets for remote in connector.remotes}),
+        call.transfer(default_targets - staged),
+        call.apply(staged, connector.remotes),
+        call.restart({remote: (services, []) for remote in connector.remotes}),
+    ]
+
+    manager.reset_mock()
+    connector.update_many(default_targets, default_targets)
+
+    assert [name for name, _, _ in manager.mock_calls] == [
+        "pre_exec",
+        "apply",
+        "restart",
+    ]
+
+
+def test_update_many_partial_failure(mocker, default_targets):
+    mocker.patch("builtins.print")
+    connector = lxd.LXDConnector(["vm1", "vm2", "vm3"])
+    staged = {t for t in default_targets if t.service}
+
+    def upload(remote: str, target: Target) -> None:
+        if remote == "vm2":
+            raise ConnectorException(f"[{remote}] Failed to upload")
+
+    def run_script(remote: str, script: str) -> None:
+        if remote == "vm3":
+            raise ConnectorException(f"[{remote}] Failed to replace")
+
+    mocker.patch.object(connector, "_transfer_target_async", side_effect=upload)
+    mocker.patch.object(connector, "_run_script_async", side_effect=run_script)
+    mock_restart = mocker.patch.object(connector, "_restart_services_async")
+
+    with pytest.raises(UpdateException) as exc:
+        connector.update_many(default_targets, staged)
+
+    # Remotes that failed at any step are left out of the following steps, the
+    # others are updated nevertheless
+    assert exc.value.updated == ["vm1"]
+    assert str(exc.value).splitlines() == [
+        "[vm2] Failed to upload",
+        "[vm3] Failed to replace",
+    ]
+    mock_restart.assert_called_once_with("vm1", connector._services(default_targets))
+
+
+def test_update_many_restart_failure(mocker, default_targets):
+    mocker.patch("builtins.print")
+    connector = lxd.LXDConnector(["vm1", "vm2"])
+    mocker.patch.object(connector, "_transfer_target_async")
+
+    def restart(remote: str, services: List[str]) -> None:
+        if remote == "vm1":
+            raise ConnectorException(f"[{remote}] Failed to restart")
+
+    mocker.patch.object(connector, "_restart_services_async", side_effect=restart)
+
+    with pytest.raises(UpdateException) as exc:
+        connector.update_many(default_targets)
+
+    assert exc.value.updated == ["vm2"]
+    assert str(exc.value) == "[vm1] Failed to restart"
+
+
+def test_update_many_shared_hook(mocker, tmp_path):
+    mocker.patch("builtins.print")
+    hook = "snap stop microovn.ovn-northd"
+    targets = {
+        Target(name, f"bin/{name}", str(tmp_path), pre_exec=hook)
+        for name in ("ovn-northd", "ovn-nbctl")
+    }
+    staged = {next(iter(targets))}
+    connector = lxd.LXDConnector(["vm1", "vm2"])
+    mocker.patch.object(connector, "_transfer_target_async")
+    mock_run_script = mocker.patch.object(connector, "_run_script_async")
+
+    connector.update_many(targets, staged)
+
+    # One hook invocation per remote, even though the targets take different paths
+    hook_runs = [
+        args[0] for args, _ in mock_run_script.call_args_list if hook in args[1]
+    ]
+    assert sorted(hook_runs) == ["vm1", "vm2"]
+
+
+def test_stage(mocker, default_targets):
+    connector = lxd.LXDConnector(["vm1", "vm2"])
+    mock_transfer = mocker.patch.object(connector, "transfer")
+
+    connector.stage(default_targets)
+
+    mock_transfer.assert_called_once_with({t.staged() for t in default_targets})
+
+
+def test_apply_staged(mocker, default_targets):
+    mocker.patch("builtins.print")
+    connector = lxd.LXDConnector(["vm1", "vm2"])
+    mock_pre_exec = mocker.patch.object(connector, "pre_exec")
+    mock_run_script = mocker.patch.object(connector, "_run_script_async")
+
+    connector.apply_staged(default_targets)
+
+    mock_pre_exec.assert_called_once_with(
+        {remote: default_targets for remote in connector.remotes}
+    )
+    command = base.rename_command(default_targets)
+    mock_run_script.assert_has_calls(
+        [call(remote, command) for remote in connector.remotes]
+    )
+
+    mock_run_script.side_effect = ConnectorException("[vm1] Failed to replace")
+    with pytest.raises(ConnectorException, match=r"\[vm1\] Failed to replace"):
+        connector.apply_staged(default_targets)
+
+
+@pytest.mark.parametrize("fanout", [None, 0, 2])
+def test_transfer(mocker, make_connector, default_targets, fanout):
+    connector = make_connector(["vm1", "vm2"], ConnectorOptions(fanout=fanout))
+    mock_transfer_target = mocker.patch.object(connector, "_transfer_target_async")
+    mock_transfer_archive = mocker.patch.object(connector, "_transfer_archive_async")
+
+    connector.transfer(default_targets)
+
+    mock_transfer_target.assert_has_calls(
+        [
+            call(remote, target)
+            for remote in connector.remotes
+            for target in default_targets
+        ],
+        any_order=True,
+    )
+    assert mock_transfer_target.call_count == 2 * len(default_targets)
+    mock_transfer_archive.assert_not_called()
+
+
+@pytest.fixture()
+def sized_targets(tmp_path):
+    """Targets with local files of different sizes, in the expected upload order."""
+    sizes = {"ovn-northd": 30, "ovn-controller": 10, "ovn-nbctl": 20}
+    for name, size in sizes.items():
+        (tmp_path / name).write_bytes(b"x" * size)
+    return [
+        Target("ovn-northd", "bin/ovn-northd", str(tmp_path), service="northd"),
+        Target("ovn-controller", "bin/ovn-controller", str(tmp_path), service="chassis"),
+        Target("ovn-nbctl", "bin/ovn-nbctl", str(tmp_path)),
+        Target("ovn-missing", "bin/ovn-missing", str(tmp_path)),
+    ]
+
+
+def test_transfer_order(mocker, make_connector, sized_targets):
+    connector = make_connector(["vm1"])
+    mock_transfer_target = mocker.patch.object(connector, "_transfer_target_async")
+    mocker.patch("builtins.print")
+
+    assert base.transfer_order(reversed(sized_targets)) == sized_targets
+
+    connector.transfer(set(sized_targets))
+
+    assert mock_transfer_target.call_args_list == [
+        call("vm1", target) for target in sized_targets
+    ]
+
+
+@pytest.mark.parametrize("bulk", [True, False])
+def test_transfer_progress(
+    mocker, make_connector, mock_target_archive, sized_targets, bulk
+):
+    connector = make_connector(["vm1", "vm2"], ConnectorOptions(bulk=bulk))
+    mocker.patch.object(connector, "_transfer_target_async")
+    mocker.patch.object(connector, "_transfer_archive_async")
+    mock_print = mocker.patch("builtins.print")
+
+    connector.transfer(set(sized_targets))
+
+    progress = [c.args[0] for c in mock_print.call_args_list if "Uploaded" in c.args[0]]
+    assert len(progress) == (2 if bulk else 8)
+    assert progress[-1] == "[local] Uploaded 0.0 MB of 0.0 MB (100%)"
+    assert connector._progress is not None
+    assert connector._progress.total == 120
+
+
+def test_sync_progress(mocker, sized_targets):
+    connector = lxd.LXDConnector(["vm1", "vm2"])
+    mocker.patch.object(connector, "_transfer_target_async")
+    mocker.patch.object(connector, "_restart_services_async")
+    mocker.patch("builtins.print")
+
+    connector.sync({"vm1": set(sized_targets), "vm2": {sized_targets[0]}})
+
+    assert connector._progress is not None
+    assert connector._progress.total == 90
+    assert connector._progress.done == 90
+
+
+def test_transfer_fanout_progress(mocker, sized_targets):
+    connector = lxd.LXDConnector(["vm1", "vm2", "vm3"], ConnectorOptions(fanout=1))
+    mocker.patch.object(connector, "_transfer_target_async")
+    mocker.patch.object(connector, "_forward_target_async")
+    mocker.patch("builtins.print")
+
+    connector.transfer(set(sized_targets))
+
+    # Only uploads from the local host to the seed remote count
+    assert connector._progress is not None
+    assert connector._progress.total == connector._progress.done == 60
+
+
+def test_transfer_stripped(mocker, make_connector, default_targets):
+    connector = make_connector(["vm1", "vm2"])
+    mock_transfer_target = mocker.patch.object(connector, "_transfer_target_async")
+    mocker.patch.object(connector, "_restart_services_async")
+    connector.strip_cache = MagicMock(spec=StripCache)
+    connector.strip_cache.stripped.side_effect = lambda target: dataclasses.replace(
+        target, local_base_path="/cache"
+    )
+    stripped = {
+        dataclasses.replace(target, local_base_path="/cache")
+        for target in default_targets
+    }
+
+    connector.transfer(default_targets)
+    connector.sync({"vm1": default_targets})
+
+    assert {c.args[1] for c in mock_transfer_target.call_args_list} == stripped
+    assert mock_transfer_target.call_count == 3 * len(default_targets)
+    assert connector.upload_targets(default_targets) == stripped
+
+
+@pytest.mark.parametrize("bulk", [True, False])
+def test_transfer_pre_exec(mocker, mock_target_archive, default_targets, bulk):
+    connector = lxd.LXDConnector(
+        ["vm1", "vm2"], ConnectorOptions(bulk=bulk, pre_exec_timeout=5)
+    )
+    manager = AsyncMock()
+    mocker.patch.object(connector, "_transfer_target_async", manager.transfer)
+    mocker.patch.object(connector, "_transfer_archive_async", manager.transfer)
+    mocker.patch.object(connector, "_run_script_async", manager.run_hooks)
+    mocker.patch("builtins.print")
+    hooked = Target("utilities/ovn-nbctl", "bin/ovn-nbctl", "/tmp", pre_exec="true")
+    targets = default_targets | {hooked}
+
+    connector.transfer(targets)
+
+    script = pre_exec_command(targets, 5)
+    manager.run_hooks.assert_has_calls(
+        [call(remote, script) for remote in connector.remotes], any_order=True
+    )
+    # Hooks run on all remotes before any file is uploaded
+    assert [c[0] for c in manager.mock_calls[:2]] == ["run_hooks", "run_hooks"]
+    assert {c[0] for c in manager.mock_calls[2:]} == {"transfer"}
+    assert {t.phase for t in connector.collect_timings()} >= {"pre_exec"}
+
+
+def test_sync_pre_exec(mocker, make_connector, default_targets):
+    connector = make_connector(["vm1", "vm2"], ConnectorOptions(parallel=1))
+    mocker.patch.object(connector, "_transfer_target_async")
+    mocker.patch.object(connector, "_restart_services_async")
+    mock_run_script = mocker.patch.object(connector, "_run_script_async")
+    mock_run_on_remotes = mocker.spy(connector, "_run_on_remotes")
+    mocker.patch("builtins.print")
+    hooked = Target("utilities/ovn-nbctl", "bin/ovn-nbctl", "/tmp", pre_exec="true")
+
+    connector.sync({"vm1": default_targets, "vm2": {hooked}})
+
+    mock_run_script.assert_called_once_with(
+        "vm2", pre_exec_command({hooked}, connector.options.pre_exec_timeout)
+    )
+    # Hooks run on all remotes at once
+    assert mock_run_on_remotes.call_args_list[0].kwargs == {"parallel": 2}
+
+
+def test_pre_exec_failure(mocker, default_targets):
+    connector = lxd.LXDConnector(["vm1", "vm2"])
+    mock_transfer_target = mocker.patch.object(connector, "_transfer_target_async")
+
+    def run_hooks(remote: str, script: str) -> None:
+        if remote == "vm2":
+            raise ConnectorException(f"[{remote}] failed")
+
+    mocker.patch.object(connector, "_run_script_async", side_effect=run_hooks)
+    mocker.patch("builtins.print")
+    hooked = Target("utilities/ovn-nbctl", "bin/ovn-nbctl", "/tmp", pre_exec="true")
+
+    with pytest.raises(ConnectorException, match=r"\[vm2\] failed"):
+        connector.transfer({hooked})
+
+    mock_transfer_target.assert_not_called()
+
+
+def test_transfer_bulk(
+    mocker, make_connector, archive_path, mock_target_archive, default_targets
+):
+    connector = make_connector(["vm1", "vm2"], ConnectorOptions(bulk=True))
+    mock_transfer_target = mocker.patch.object(connector, "_transfer_target_async")
+    mock_transfer_archive = mocker.patch.object(connector, "_transfer_archive_async")
+    mock_archive = mock_target_archive
+
+    connector.transfer(default_targets)
+
+    mock_archive.assert_called_once_with(default_targets)
+    mock_transfer_archive.assert_has_calls(
+        [call(remote, archive_path, default_targets) for remote in connector.remotes]
+    )
+    mock_transfer_target.assert_not_called()
+
+
+@pytest.mark.parametrize("bulk", [True, False])
+def test_transfer_fanout(
+    mocker, make_connector, mock_target_archive, default_targets, bulk
+):
+    remotes = ["vm1", "vm2", "vm3", "vm4", "vm5"]
+    connector = make_connector(remotes, ConnectorOptions(bulk=bulk, fanout=1))
+    mock_transfer_target = mocker.patch.object(connector, "_transfer_target_async")
+    mock_transfer_archive = mocker.patch.object(connector, "_transfer_archive_async")
+    mock_forward = mocker.patch.object(connector, "_forward_target_async")
+    mock_run_on_some = mocker.spy(connector, "_run_on_some")
+    mocker.patch("builtins.print")
+
+    connector.transfer(default_targets)
+
+    # Only the seed gets files from the local host
+    uploaded = mock_transfer_archive if bulk else mock_transfer_target
+    assert {c.args[0] for c in uploaded.call_args_list} == {"vm1"}
+    # Remotes with the files double in each round
+    rounds = [c.args[1] for c in mock_run_on_some.call_args_list]
+    assert rounds == [["vm1"], ["vm2"], ["vm3", "vm4"], ["vm5"]]
+    sources = {("vm1", "vm2"), ("vm1", "vm3"), ("vm2", "vm4"), ("vm1", "vm5")}
+    mock_forward.assert_has_calls(
+        [
+            call(source, remote, target)
+            for source, remote in sources
+            for target in default_targets
+        ],
+        any_order=True,
+    )
+    assert mock_forward.call_count == len(sources) * len(default_targets)
+    assert {t.phase for t in connector.collect_timings()} >= {"forward"}
+
+
+def test_transfer_fanout_failure(mocker, make_connector, default_targets):
+    connector = make_connector(["vm1", "vm2", "vm3", "vm4"], ConnectorOptions(fanout=2))
+
+    def fail_on(failing: str):
+        def action(*args) -> None:
+            if args[-2] == failing:
+                raise ConnectorException(f"[{failing}] failed")
+
+        return action
+
+    mocker.patch.object(connector, "_transfer_target_async", side_effect=fail_on("vm1"))
+    mock_forward = mocker.patch.object(
+        connector, "_forward_target_async", side_effect=fail_on("vm3")
+    )
+    mocker.patch("builtins.print")
+
+    with pytest.raises(ConnectorException) as exc:
+        connector.transfer(default_targets)
+
+    assert str(exc.value).splitlines() == ["[vm1] failed", "[vm3] failed"]
+    # Remote that failed to receive files is not used as a source
+    assert {c.args[:2] for c in mock_forward.call_args_list} == {
+        ("vm2", "vm3"),
+        ("vm2", "vm4"),
+    }
+
+
+def test_transfer_fanout_no_seed(mocker, default_targets):
+    connector = lxd.LXDConnector(["vm1", "vm2", "vm3"], ConnectorOptions(fanout=1))
+    mocker.patch.object(
+        connector,
+        "_transfer_target_async",
+        side_effect=ConnectorException("[vm1] failed"),
+    )
+    mock_forward = mocker.patch.object(connector, "_forward_target_async")
+    mocker.patch("builtins.print")
+
+    with pytest.raises(ConnectorException) as exc:
+        connector.transfer(default_targets)
+
+    assert str(exc.value).splitlines() == [
+        "[vm1] failed",
+        "[vm2] No remote to forward files from",
+        "[vm3] No remote to forward files from",
+    ]
+    mock_forward.assert_not_called()
+
+
+def test_transfer_errors_collected(mocker, make_connector, default_targets):
+    connector = make_connector(
+        ["vm1", "vm2", "vm3"], ConnectorOptions(parallel=3, channels=4)
+    )
+    failing = next(iter(default_targets))
+
+    def transfer(remote: str, target: Target) -> None:
+        if remote != "vm2" and target == failing:
+            raise ConnectorException(f"[{remote}] failed")
+
+    mock_transfer_target = mocker.patch.object(
+        connector, "_transfer_target_async", side_effect=transfer
+    )
+
+    with pytest.raises(ConnectorException) as exc:
+        connector.transfer(default_targets)
+
+    # Failure of one upload does not stop the others
+    uploaded = [c.args[0] for c in mock_transfer_target.call_args_list]
+    assert uploaded.count("vm2") == len(default_targets)
+    assert str(exc.value).splitlines() == ["[vm1] failed", "[vm3] failed"]
+
+
+@pytest.mark.parametrize("services", [["svc1", "svc2"], []])
+def test_restart(mocker, make_connector, services):
+    connector = make_connector(["vm1", "vm2"])
+    mock_restart = mocker.patch.object(connector, "_restart_services_async")
+
+    connector.restart(services)
+
+    if services:
+        mock_restart.assert_has_calls(
+            [call(remote, services) for remote in connector.remotes]
+        )
+    else:
+        mock_restart.assert_not_called()
+
+
+@pytest.mark.parametrize("window", [1, 2])
+def test_restart_rolling(mocker, make_connector, window):
+    connector = make_connector(
+        ["vm1", "vm2", "vm3"], ConnectorOptions(restart_window=window)
+    )
+    mocker.patch("builtins.print")
+    sleep = asyncio.sleep
+
+    async def no_delay(delay: float) -> None:
+        await sleep(0)
+
+    mock_sleep = mocker.patch.object(base.asyncio, "sleep", side_effect=no_delay)
+    lock = threading.Lock()
+    restarting = set()
+    concurrent = []
+    attempts = {}
+
+    async def restart(remote, services):
+        with lock:
+            restarting.add(remote)
+            concurrent.append(len(restarting))
+        # First remotes of the window restart together, on either engine
+        while len(concurrent) < window:
+            await sleep(0.001)
+
+    def probe(remote, script):
+        # Each remote gets ready on the third attempt
+        with lock:
+            attempts[remote] = attempts.get(remote, 0) + 1
+            if attempts[remote] < 3:
+                raise ConnectorException(f"[{remote}] not ready")
+            restarting.discard(remote)
+
+    mocker.patch.object(connector, "_restart_services_async", side_effect=restart)
+    mock_probe = mocker.patch.object(connector, "_run_script_async", side_effect=probe)
+
+    connector.restart(["microovn.ovn-northd"], ["ovn-appctl status"])
+
+    assert max(concurrent) == window
+    assert attempts == {"vm1": 3, "vm2": 3, "vm3": 3}
+    mock_probe.assert_called_with(
+        mocker.ANY, readiness_command(["ovn-appctl status"], 10)
+    )
+    # Delays between attempts grow
+    assert [c.args[0] for c in mock_sleep.call_args_list[:2]] == [0.5, 1.0]
+    assert {t.phase for t in connector.collect_timings()} == {"restart", "ready"}
+
+
+def test_restart_not_ready(mocker, make_connector):
+    connector = make_connector(["vm1", "vm2", "vm3"], ConnectorOptions(ready_timeout=3))
+    mocker.patch("builtins.print")
+    mocker.patch.object(base.asyncio, "sleep")
+    mocker.patch.object(base.time, "monotonic", side_effect=itertools.count())
+    mock_restart = mocker.patch.object(connector, "_restart_services_async")
+    mocker.patch.object(
+        connector, "_run_script_async", side_effect=ConnectorException("[vm1] not ready")
+    )
+
+    with pytest.raises(ConnectorException) as exc:
+        connector.restart(["microovn.ovn-northd"], ["ovn-appctl status"])
+
+    # Remaining remotes are not restarted
+    mock_restart.assert_called_once_with("vm1", ["microovn.ovn-northd"])
+    assert str(exc.value).splitlines() == [
+        "[vm1] Services not ready after 3s: [vm1] not ready",
+        "[vm2] Restart skipped after failure on another remote",
+        "[vm3] Restart skipped after failure on another remote",
+    ]
+
+
+def test_restart_failure_without_probes(mocker, make_connector):
+    connector = make_connector(["vm1", "vm2", "vm3"])
+    mock_restart = mocker.patch.object(
+        connector,
+        "_restart_services_async",
+        side_effect=ConnectorException("[vm1] failed"),
+    )
+
+    with pytest.raises(ConnectorException):
+        connector.restart(["microovn.ovn-northd"])
+
+    # Without readiness probes, all remotes are restarted
+    assert mock_restart.await_count == 3
+
+
+def test_sync_ready(mocker, make_connector):
+    connector = make_connector(["vm1", "vm2"])
+    mocker.patch("builtins.print")
+    mocker.patch.object(connector, "_transfer_target_async")
+    mocker.patch.object(connector, "_restart_services_async")
+    mock_run_script = mocker.patch.object(connector, "_run_script_async")
+    target = Target(
+        "northd/ovn-northd",
+        "bin/ovn-northd",
+        "/tmp",
+        service="northd",
+        ready_check="true",
+    )
+
+    connector.sync({"vm2": {target}})
+
+    mock_run_script.assert_called_once_with("vm2", readiness_command(["true"], 10))
+
+
+def test_sync_rolling_restart(mocker):
+    connector = lxd.LXDConnector(
+        ["vm1", "vm2", "vm3", "vm4"],
+        ConnectorOptions(parallel=4, restart_window=1, ready_timeout=0),
+    )
+    mocker.patch("builtins.print")
+    manager = AsyncMock()
+
+    def fail_on(failing: str):
+        def action(remote: str, *args) -> None:
+            if remote == failing:
+                raise ConnectorException(f"[{remote}] failed")
+
+        return action
+
+    manager.transfer.side_effect = fail_on("vm4")
+    manager.probe.side_effect = fail_on("vm2")
+    mocker.patch.object(connector, "_transfer_target_async", manager.transfer)
+    mocker.patch.object(connector, "_restart_services_async", manager.restart)
+    mocker.patch.object(connector, "_run_script_async", manager.probe)
+    target = Target(
+        "northd/ovn-northd",
+        "bin/ovn-northd",
+        "/tmp",
+        service="northd",
+        ready_check="true",
+    )
+
+    with pytest.raises(ConnectorException) as exc:
+        connector.sync({remote: {target} for remote in connector.remotes})
+
+    # All uploads finish before services restart within the restart window
+    assert [c[0] for c in manager.mock_calls] == ["transfer"] * 4 + [
+        "restart",
+        "probe",
+        "restart",
+        "probe",
+    ]
+    assert str(exc.value).splitlines() == [
+        "[vm4] failed",
+        "[vm2] Services not ready after 0s: [vm2] failed",
+        "[vm3] Restart skipped after failure on another remote",
+    ]
+
+
+def test_remote_checksums(mocker, make_connector, default_targets):
+    connector = make_connector(["vm1", "vm2"], ConnectorOptions(parallel=2))
+    checksums = {target: None for target in default_targets}
+    mock_checksums = mocker.patch.object(
+        connector, "_remote_checksums_async", return_value=checksums
+    )
+
+    result = connector.remote_checksums(default_targets)
+
+    assert result == {"vm1": checksums, "vm2": checksums}
+    mock_checksums.assert_has_calls(
+        [call(remote, default_targets) for remote in connector.remotes],
+        any_order=True,
+    )
+    assert {t.phase for t in connector.collect_timings()} == {"checksum"}
+
+
+@pytest.mark.parametrize("bulk", [True, False])
+def test_sync(
+    mocker, make_connector, archive_path, mock_target_archive, default_targets, bulk
+):
+    connector = make_connector(["vm1", "vm2", "vm3"], ConnectorOptions(bulk=bulk))
+    mock_transfer_target = mocker.patch.object(connector, "_transfer_target_async")
+    mock_transfer_archive = mocker.patch.object(connector, "_transfer_archive_async")
+    mock_restart = mocker.patch.object(connector, "_restart_services_async")
+    mock_archive = mock_target_archive
+    with_service = next(t for t in default_targets if t.service)
+    without_service = Target("utilities/ovn-nbctl", "bin/ovn-nbctl", "/tmp", "/tmp")
+
+    connector.sync({"vm1": {with_service}, "vm2": {without_service}, "vm3": set()})
+
+    if bulk:
+        mock_transfer_archive.assert_has_calls(
+            [
+                call("vm1", archive_path, {with_service}),
+                call("vm2", archive_path, {without_service}),
+            ]
+        )
+        assert mock_transfer_archive.call_count == 2
+        mock_transfer_target.assert_not_called()
+    else:
+        mock_transfer_target.assert_has_calls(
+            [call("vm1", with_service), call("vm2", without_service)]
+        )
+        assert mock_transfer_target.call_count == 2
+        mock_transfer_archive.assert_not_called()
+    mock_restart.assert_called_once_with("vm1", [with_service.service])
+
+
+def test_collect_timings(mocker, tmp_path):
+    connector = lxd.LXDConnector(["vm1"], ConnectorOptions(parallel=2))
+    mocker.patch.object(connector, "_transfer_target_async")
+    mocker.patch.object(connector, "_restart_services_async")
+    mocker.patch("builtins.print")
+    (tmp_path / "ovn-northd").write_bytes(b"northd")
+    built = Target("ovn-northd", "bin/ovn-northd", str(tmp_path), service="northd")
+    missing = Target("ovn-nbctl", "bin/ovn-nbctl", str(tmp_path))
+
+    connector.update_many({built, missing})
+
+    timings = sorted(connector.collect_timings(), key=lambda t: str(t.target))
+    assert [(t.phase, t.remote, t.target, t.size) for t in timings] == [
+        ("upload", "vm1", str(missing.remote_path), None),
+        ("upload", "vm1", str(built.remote_path), 6),
+        ("restart", "vm1", None, None),
+    ]
+    assert connector.collect_timings() == []
+
+
+def test_services(default_targets):
+    services = lxd.LXDConnector._services(default_targets)
+
+    assert services == sorted(
+        {target.service for target in default_targets if target.service}
+    )
+
+
+@pytest.mark.parametrize("measured", [None, 1e6])
+def test_transfer_archive_throughput(mocker, default_targets, tmp_path, measured):
+    connector = lxd.LXDConnector(
+        ["vm1"],
+        ConnectorOptions(bulk=True, compression="gzip", compression_threshold=10.0),
+    )
+    if measured is not None:
+        # Uploads are compressed after throughput below the threshold was measured
+        connector.throughput["vm1"] = measured
+    mocker.patch.object(connector, "_transfer_archive_async")
+    mock_record = mocker.spy(connector, "_record_throughput")
+    archive_path = tmp_path / "targets.tar"
+    archive_path.write_bytes(b"x" * base.MIN_MEASURED_SIZE)
+    mocker.patch.object(base, "target_archive").return_value.__enter__.return_value = (
+        archive_path
+    )
+    mocker.patch("builtins.print")
+
+    connector.transfer(default_targets)
+
+    if measured is None:
+        mock_record.assert_called_once_with("vm1", base.MIN_MEASURED_SIZE, mocker.ANY)
+    else:
+        # Compressed uploads do not measure throughput of the link
+        mock_record.assert_not_called()
+
+
+@pytest.mark.parametrize(
+    "size, seconds, expected",
+    [
+        (base.MIN_MEASURED_SIZE, 2, base.MIN_MEASURED_SIZE / 2),
+        (base.MIN_MEASURED_SIZE - 1, 2, None),  # too small to measure
+        (base.MIN_MEASURED_SIZE, 0, None),
+    ],
+)
+def test_record_throughput(size, seconds, expected):
+    connector = lxd.LXDConnector(["vm1"])
+
+    connector._record_throughput("vm1", size, seconds)
+
+    assert connector.throughput.get("vm1") == expected
+
+
+@pytest.mark.parametrize(
+    "codec, threshold, measured, expected",
+    [
+        (None, None, None, None),
+        (None, 10, 1, None),
+        ("gzip", None, None, "gzip"),
+        ("gzip", 10, None, None),  # throughput not measured yet
+        ("gzip", 10, 20 * 1000 * 1000, None),  # fast link
+        ("gzip", 10, 5 * 1000 * 1000, "gzip"),  # slow link
+    ],
+)
+def test_compression(codec, threshold, measured, expected):
+    options = ConnectorOptions(compression=codec, compression_threshold=threshold)
+    connector = lxd.LXDConnector(["vm1"], options)
+    if measured is not None:
+        connector.throughput["vm1"] = measured
+
+    assert connector._compression("vm1") == expected
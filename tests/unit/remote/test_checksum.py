@@ -0,0 +1,55 @@
+import hashlib
+import subprocess
+
+from microovn_rebuilder.remote.checksum import checksum_command, parse_checksums
+from microovn_rebuilder.target import Target
+
+
+def _targets(tmp_path):
+    return {
+        Target(f"local/{name}", f"bin/{name}", str(tmp_path), str(tmp_path / "remote"))
+        for name in ("ovn-northd", "ovn-nbctl", "ovn-sbctl")
+    }
+
+
+def test_checksums(tmp_path):
+    targets = _targets(tmp_path)
+    (tmp_path / "remote" / "bin").mkdir(parents=True)
+    missing = None
+    for target in sorted(targets, key=lambda t: str(t.remote_path)):
+        if missing is None:
+            missing = target
+            continue
+        target.remote_path.write_bytes(str(target.remote_path).encode())
+
+    result = subprocess.run(
+        ["sh", "-c", checksum_command(targets)], capture_output=True, check=True
+    )
+
+    checksums = parse_checksums(result.stdout, targets)
+    assert checksums == {
+        target: (
+            None
+            if target is missing
+            else hashlib.sha256(target.remote_path.read_bytes()).hexdigest()
+        )
+        for target in targets
+    }
+
+
+def test_checksum_command_failure(tmp_path, monkeypatch):
+    monkeypatch.setenv("PATH", str(tmp_path))
+
+    result = subprocess.run(
+        ["/bin/sh", "-c", checksum_command(_targets(tmp_path))], capture_output=True
+    )
+
+    assert result.returncode != 0
+
+
+def test_parse_checksums_unknown_path(tmp_path):
+    targets = _targets(tmp_path)
+
+    output = b"0123  /unknown/path\n"
+
+    assert parse_checksums(output, targets) == dict.fromkeys(targets)
@@ -0,0 +1,365 @@
+import subprocess
+import threading
+from unittest.mock import MagicMock, call
+
+import pytest
+
+from microovn_rebuilder.remote import (
+    BaseConnector,
+    ConnectorException,
+    ConnectorOptions,
+    UpdateException,
+    lxd,
+)
+from microovn_rebuilder.remote.archive import rename_command
+from microovn_rebuilder.remote.composite import CompositeConnector
+from microovn_rebuilder.report import Timing
+from microovn_rebuilder.strip import StripCache
+from microovn_rebuilder.target import Target
+
+
+def make_mock_connector(remotes) -> MagicMock:
+    connector = MagicMock(spec=BaseConnector)
+    connector.remotes = list(remotes)
+    return connector
+
+
+@pytest.fixture()
+def mock_connectors():
+    return {
+        "lxd": make_mock_connector(["vm1", "vm2"]),
+        "ssh": make_mock_connector(["host1"]),
+    }
+
+
+def test_remotes(mock_connectors):
+    connector = CompositeConnector(mock_connectors)
+
+    assert connector.remotes == ["vm1", "vm2", "host1"]
+    for sub in mock_connectors.values():
+        assert sub._output_lock is connector._output_lock
+
+
+def test_initialize(mock_connectors):
+    connector = CompositeConnector(mock_connectors)
+    mock_connectors["lxd"].remotes = ["vm2"]
+
+    connector.initialize()
+    connector.check_remote("/root/squashfs-root")
+
+    for sub in mock_connectors.values():
+        sub.initialize.assert_called_once_with()
+        sub.check_remote.assert_called_once_with("/root/squashfs-root")
+    # Connectors may leave out unreachable remotes
+    assert connector.remotes == ["vm2", "host1"]
+
+
+@pytest.mark.parametrize("skip_unreachable", [True, False])
+def test_initialize_unreachable(mocker, mock_connectors, skip_unreachable):
+    mock_print = mocker.patch("builtins.print")
+    mock_connectors["ssh"].initialize.side_effect = ConnectorException(
+        "[host1] Failed to connect"
+    )
+    connector = CompositeConnector(
+        mock_connectors, ConnectorOptions(skip_unreachable=skip_unreachable)
+    )
+
+    if skip_unreachable:
+        connector.initialize()
+        assert list(connector.connectors) == ["lxd"]
+        assert connector.remotes == ["vm1", "vm2"]
+        mock_print.assert_any_call(
+            "Continuing without unreachable remote hosts:\n[host1] Failed to connect"
+        )
+    else:
+        with pytest.raises(ConnectorException, match=r"\[host1\] Failed to connect"):
+            connector.initialize()
+
+
+def test_initialize_none_reachable(mock_connectors):
+    for sub in mock_connectors.values():
+        sub.initialize.side_effect = ConnectorException("unreachable")
+    connector = CompositeConnector(
+        mock_connectors, ConnectorOptions(skip_unreachable=True)
+    )
+
+    with pytest.raises(ConnectorException, match="unreachable"):
+        connector.initialize()
+
+
+def test_transfer_and_restart(mock_connectors, default_targets):
+    connector = CompositeConnector(mock_connectors)
+    connector.strip_cache = MagicMock(spec=StripCache)
+    connector.strip_cache.stripped.side_effect = lambda target: target
+    for sub in mock_connectors.values():
+        sub._transfer.return_value = (sub.remotes, None)
+
+    connector.update_many(default_targets)
+
+    services = connector._services(default_targets)
+    for sub in mock_connectors.values():
+        sub._transfer.assert_called_once_with(default_targets)
+        sub.restart.assert_not_called()
+        for remote in sub.remotes:
+            sub._restart_services.assert_any_call(remote, services)
+    # Targets are stripped once, not by each connector
+    assert connector.strip_cache.stripped.call_count == len(default_targets)
+
+
+def test_apply_staged(mocker, default_targets):
+    mocker.patch("builtins.print")
+    connectors = {
+        "lxd": lxd.LXDConnector(["vm1", "vm2"]),
+        "ssh": lxd.LXDConnector(["host1"]),
+    }
+    mock_commands = {
+        name: mocker.patch.object(
+            sub,
+            "_run_command",
+            return_value=subprocess.CompletedProcess([], 0, b"", b""),
+        )
+        for name, sub in connectors.items()
+    }
+    connector = CompositeConnector(connectors)
+
+    connector.apply_staged(default_targets)
+
+    # Each connector moves the staged files into place on its own remotes
+    command = rename_command(default_targets)
+    for name, sub in connectors.items():
+        assert [args[2] for args, _ in mock_commands[name].call_args_list] == [
+            remote for remote in sub.remotes
+        ]
+        for args, _ in mock_commands[name].call_args_list:
+            assert args[-1] == command
+
+    # Connectors without any of the remotes are left alone
+    for mock_command in mock_commands.values():
+        mock_command.reset_mock()
+    assert connector._apply_staged(default_targets, ["vm2"]) == (["vm2"], None)
+    mock_commands["ssh"].assert_not_called()
+
+
+def make_restart_connector(mocker, options, restart):
+    connectors = {
+        "lxd": lxd.LXDConnector(["vm1", "vm2"], options),
+        "ssh": lxd.LXDConnector(["host1"], options),
+    }
+    for sub in connectors.values():
+        mocker.patch.object(sub, "_restart_services_async", side_effect=restart)
+    return CompositeConnector(connectors, options)
+
+
+def test_restart_window_across_types(mocker):
+    mocker.patch("builtins.print")
+    lock = threading.Lock()
+    restarting = []
+    overlapped = []
+
+    def restart(remote, services):
+        with lock:
+            restarting.append(remote)
+            overlapped.append(len(restarting) > 1)
+        threading.Event().wait(0.02)
+        with lock:
+            restarting.remove(remote)
+
+    connector = make_restart_connector(
+        mocker, ConnectorOptions(parallel=3, restart_window=1), restart
+    )
+
+    connector.restart(["microovn.ovn-northd"])
+
+    # Members of different connector types do not restart at the same time
+    assert overlapped == [False, False, False]
+
+
+def test_restart_halts_across_types(mocker):
+    mocker.patch("builtins.print")
+    restarted = []
+
+    def restart(remote, services):
+        restarted.append(remote)
+        if remote == "vm1":
+            raise ConnectorException(f"[{remote}] Failed to restart")
+
+    connector = make_restart_connector(
+        mocker, ConnectorOptions(restart_window=1), restart
+    )
+
+    with pytest.raises(ConnectorException) as exc:
+        connector.restart(["microovn.ovn-northd"], ["true"])
+
+    # Failure on a remote of one type halts the restart of the other type too
+    assert restarted == ["vm1"]
+    assert str(exc.value).splitlines() == [
+        "[vm1] Failed to restart",
+        "[vm2] Restart skipped after failure on another remote",
+        "[host1] Restart skipped after failure on another remote",
+    ]
+
+
+def test_sync_and_pre_exec(mock_connectors, default_targets):
+    connector = CompositeConnector(mock_connectors)
+    pending = {"vm2": default_targets, "host1": set()}
+
+    connector.sync({"vm2": default_targets})
+    connector.pre_exec(pending)
+
+    mock_connectors["lxd"].sync.assert_called_once_with({"vm2": default_targets})
+    mock_connectors["ssh"].sync.assert_not_called()
+    mock_connectors["lxd"].pre_exec.assert_called_once_with({"vm2": default_targets})
+    mock_connectors["ssh"].pre_exec.assert_called_once_with({"host1": set()})
+
+
+def test_remote_checksums_and_timings(mock_connectors, default_targets):
+    connector = CompositeConnector(mock_connectors)
+    mock_connectors["lxd"].remote_checksums.return_value = {"vm1": {}, "vm2": {}}
+    mock_connectors["ssh"].remote_checksums.return_value = {"host1": {}}
+    mock_connectors["lxd"].collect_timings.return_value = [Timing("upload", 1.0)]
+    mock_connectors["ssh"].collect_timings.return_value = [Timing("restart", 2.0)]
+
+    assert connector.remote_checksums(default_targets) == {
+        "vm1": {},
+        "vm2": {},
+        "host1": {},
+    }
+    assert connector.collect_timings() == [
+        Timing("upload", 1.0),
+        Timing("restart", 2.0),
+    ]
+
+
+def test_errors_collected(mocker, mock_connectors, default_targets):
+    mocker.patch("builtins.print")
+    connector = CompositeConnector(mock_connectors)
+    mock_connectors["lxd"]._transfer.return_value = (
+        ["vm2"],
+        ConnectorException("[vm1] failed"),
+    )
+    mock_connectors["ssh"]._transfer.return_value = (
+        [],
+        ConnectorException("[host1] failed"),
+    )
+
+    with pytest.raises(UpdateException) as exc:
+        connector.update_many(default_targets)
+
+    assert str(exc.value).splitlines() == ["[vm1] failed", "[host1] failed"]
+    # Remotes where the upload succeeded are updated nevertheless
+    assert exc.value.updated == ["vm2"]
+    mock_connectors["lxd"]._restart_services.assert_called_once_with(
+        "vm2", connector._services(default_targets)
+    )
+    mock_connectors["ssh"]._restart_services.assert_not_called()
+
+    with pytest.raises(ConnectorException) as exc:
+        connector.transfer(default_targets)
+
+    assert str(exc.value).splitlines() == ["[vm1] failed", "[host1] failed"]
+
+
+@pytest.mark.parametrize(
+    "method, args",
+    [
+        ("_transfer_target", ("target",)),
+        ("_transfer_archive", ("archive", {"target"})),
+        ("_restart_services", (["service"],)),
+        ("_remote_checksums", ({"target"},)),
+        ("_run_script", ("script",)),
+    ],
+)
+def test_remote_operations(mock_connectors, method, args):
+    connector = CompositeConnector(mock_connectors)
+
+    getattr(connector, method)("host1", *args)
+
+    getattr(mock_connectors["ssh"], method).assert_called_once_with("host1", *args)
+    getattr(mock_connectors["lxd"], method).assert_not_called()
+
+
+def test_forward_target(mock_connectors):
+    connector = CompositeConnector(mock_connectors)
+
+    connector._forward_target("vm1", "vm2", "target")
+
+    mock_connectors["lxd"]._forward_target.assert_called_once_with(
+        "vm1", "vm2", "target"
+    )
+    with pytest.raises(ConnectorException, match=r"\[vm3\] Unknown remote"):
+        connector._run_script("vm3", "script")
+
+
+def test_teardown(mock_connectors):
+    CompositeConnector(mock_connectors).teardown()
+
+    for sub in mock_connectors.values():
+        sub.teardown.assert_called_once_with()
+
+
+def test_connector_types_run_concurrently(mocker, tmp_path):
+    """Remotes of a slow connector type do not hold up the other type."""
+    mocker.patch("builtins.print")
+    fast = lxd.LXDConnector(["vm1", "vm2"], ConnectorOptions(parallel=2))
+    slow = lxd.LXDConnector(["host1"])
+    fast_done = threading.Event()
+
+    def fast_transfer(remote, target):
+        if remote == "vm2":
+            fast_done.set()
+
+    def slow_transfer(remote, target):
+        # Would time out if the slow connector held up the fast one
+        if not fast_done.wait(timeout=5):
+            raise ConnectorException(f"[{remote}] waited for the other connector")
+
+    mock_fast = mocker.patch.object(
+        fast, "_transfer_target_async", side_effect=fast_transfer
+    )
+    mocker.patch.object(slow, "_transfer_target_async", side_effect=slow_transfer)
+    connector = CompositeConnector({"ssh": slow, "lxd": fast})
+    target = Target("ovn-northd", "bin/ovn-northd", str(tmp_path))
+
+    connector.transfer({target})
+
+    mock_fast.assert_has_calls(
+        [call("vm1", target), call("vm2", target)], any_order=True
+    )
+
+
+def test_output_grouped_per_connector(mocker, tmp_path):
+    """Output of each connector is printed as a single block, even when it updates
+    its own remotes one after another."""
+    printed = {remote: threading.Event() for remote in ("vm1", "host1")}
+
+    def print_message(message):
+        for remote, event in printed.items():
+            if f"[{remote}]" in message:
+                event.set()
+
+    mock_print = mocker.patch("builtins.print", side_effect=print_message)
+    slow = lxd.AsyncLXDConnector(["vm1", "vm2"])
+    fast = lxd.LXDConnector(["host1"])
+
+    def transfer(remote, target):
+        slow._print(f"[{remote}] Uploading")
+        if remote == "host1":
+            # Output of vm1 would be printed here, if it was not grouped
+            printed["vm1"].wait(timeout=0.2)
+        elif remote == "vm2":
+            printed["host1"].wait(timeout=5)
+
+    for sub in (slow, fast):
+        mocker.patch.object(sub, "_transfer_target_async", side_effect=transfer)
+    connector = CompositeConnector({"lxd": slow, "ssh": fast})
+    target = Target("ovn-northd", "bin/ovn-northd", str(tmp_path))
+
+    try:
+        connector.transfer({target})
+    finally:
+        slow.teardown()
+
+    uploads = [
+        args[0] for args, _ in mock_print.call_args_list if "Uploading" in args[0]
+    ]
+    assert uploads == ["[host1] Uploading", "[vm1] Uploading", "[vm2] Uploading"]
@@ -0,0 +1,49 @@
+import gzip
+import subprocess
+from pathlib import Path
+
+import pytest
+
+from microovn_rebuilder.remote import ConnectorException, compression
+from microovn_rebuilder.target import Target
+
+
+@pytest.mark.parametrize(
+    "level, expected",
+    [(None, ["gzip", "-c", "/foo"]), (9, ["gzip", "-c", "-9", "/foo"])],
+)
+def test_compress_command(level, expected):
+    assert compression.compress_command("gzip", level, Path("/foo")) == expected
+
+
+def test_decompress_command(tmp_path):
+    target = Target("ovn-northd", "bin/ovn northd", "/foo", str(tmp_path))
+    destination = target.remote_path
+    destination.parent.mkdir()
+    destination.write_bytes(b"old")
+    command = compression.decompress_command("gzip", target, 0o100750)
+
+    subprocess.run(["sh", "-c", command], input=gzip.compress(b"new"), check=True)
+
+    assert destination.read_bytes() == b"new"
+    assert destination.stat().st_mode & 0o7777 == 0o750
+    assert not target.staging_path.exists()
+
+
+@pytest.mark.parametrize("codec", [None, "gzip"])
+def test_upload_stream(tmp_path, codec):
+    source = tmp_path / "ovn-northd"
+    source.write_bytes(b"northd" * 1000)
+
+    with compression.upload_stream(source, codec, 1) as stream:
+        data = stream.read()
+
+    if codec:
+        data = gzip.decompress(data)
+    assert data == source.read_bytes()
+
+
+def test_compressed_stream_failure(tmp_path):
+    with pytest.raises(ConnectorException):
+        with compression.compressed_stream(tmp_path / "missing", "gzip") as stream:
+            stream.read()
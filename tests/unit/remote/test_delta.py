@@ -0,0 +1,142 @@
+import hashlib
+import os
+import random
+import subprocess
+import sys
+
+import pytest
+
+from microovn_rebuilder.remote import delta
+
+BLOCK_SIZE = 64
+
+
+def _signature(path, block_size=BLOCK_SIZE):
+    result = subprocess.run(
+        [sys.executable, "-c", delta.SIGNATURE_SCRIPT, str(path), str(block_size)],
+        capture_output=True,
+        check=True,
+    )
+    return delta.parse_signature(result.stdout)
+
+
+def _patch(path, data, stream, block_size=BLOCK_SIZE):
+    return subprocess.run(
+        [
+            sys.executable,
+            "-c",
+            delta.PATCH_SCRIPT,
+            str(path),
+            f"{path}.delta",
+            str(block_size),
+            "750",
+            hashlib.sha256(data).hexdigest(),
+        ],
+        input=stream,
+        capture_output=True,
+    )
+
+
+def test_weak_checksum_rolls():
+    data = bytes(random.Random(1).randrange(256) for _ in range(BLOCK_SIZE + 1))
+    weak = delta.weak_checksum(data[:BLOCK_SIZE])
+    a, b = weak % 65536, weak >> 16
+    a = (a - data[0] + data[BLOCK_SIZE]) % 65536
+    b = (b - BLOCK_SIZE * data[0] + a) % 65536
+
+    assert a | (b << 16) == delta.weak_checksum(data[1:])
+
+
+def test_signature_missing_file(tmp_path):
+    assert _signature(tmp_path / "missing") == []
+
+
+@pytest.mark.parametrize(
+    "mutate",
+    [
+        lambda old: old,  # no change
+        lambda old: old[:100] + b"inserted" + old[100:],  # shifted content
+        lambda old: old[:1000] + os.urandom(300) + old[1300:],  # changed content
+        lambda old: old[: len(old) // 2],  # truncated
+        lambda old: old + os.urandom(1000),  # appended
+    ],
+)
+def test_delta_roundtrip(tmp_path, mutate):
+    old = os.urandom(BLOCK_SIZE * 50 + 10)
+    new = mutate(old)
+    remote_file = tmp_path / "ovn-northd"
+    remote_file.write_bytes(old)
+
+    stream = delta.compute_delta(new, _signature(remote_file), BLOCK_SIZE)
+    assert stream is not None
+    assert len(stream) < len(new)
+
+    result = _patch(remote_file, new, stream)
+
+    assert result.returncode == 0, result.stderr
+    assert remote_file.read_bytes() == new
+    assert remote_file.stat().st_mode & 0o777 == 0o750
+    assert not (tmp_path / "ovn-northd.delta").exists()
+
+
+def test_delta_copies_are_coalesced(tmp_path):
+    old = os.urandom(BLOCK_SIZE * 10)
+    remote_file = tmp_path / "ovn-northd"
+    remote_file.write_bytes(old)
+
+    stream = delta.compute_delta(old, _signature(remote_file), BLOCK_SIZE)
+
+    assert stream == delta.OP_COPY + delta._COPY.pack(0, 10) + delta.OP_END
+
+
+@pytest.mark.parametrize("size", [BLOCK_SIZE * 20, BLOCK_SIZE // 2])
+def test_delta_too_different(tmp_path, size):
+    remote_file = tmp_path / "ovn-northd"
+    remote_file.write_bytes(os.urandom(BLOCK_SIZE * 20))
+
+    new = os.urandom(size)
+    assert (
+        delta.compute_delta(new, _signature(remote_file), BLOCK_SIZE, size // 4) is None
+    )
+
+
+def test_delta_probe_aborts_early(tmp_path):
+    old = os.urandom(BLOCK_SIZE * 100)
+    remote_file = tmp_path / "ovn-northd"
+    remote_file.write_bytes(old)
+    new = os.urandom(BLOCK_SIZE * delta.PROBE_BLOCKS) + old
+    signature = _signature(remote_file)
+
+    # Whole file is mostly unchanged, but its first blocks did not match at all
+    assert delta.compute_delta(new, signature, BLOCK_SIZE) is not None
+    assert delta.compute_delta(new, signature, BLOCK_SIZE, len(new) // 2) is None
+
+
+def test_patch_checksum_mismatch(tmp_path):
+    old = os.urandom(BLOCK_SIZE * 4)
+    remote_file = tmp_path / "ovn-northd"
+    remote_file.write_bytes(old)
+    stream = delta.compute_delta(old, _signature(remote_file), BLOCK_SIZE)
+
+    result = _patch(remote_file, b"something else", stream)
+
+    assert result.returncode != 0
+    assert remote_file.read_bytes() == old
+    assert not (tmp_path / "ovn-northd.delta").exists()
+
+
+def test_patch_malformed_stream(tmp_path):
+    remote_file = tmp_path / "ovn-northd"
+    remote_file.write_bytes(b"foo")
+
+    result = _patch(remote_file, b"foo", b"X")
+
+    assert result.returncode != 0
+    assert remote_file.read_bytes() == b"foo"
+
+
+def test_literal_writer_skips_empty():
+    writer = delta._DeltaWriter()
+    writer.literal(b"")
+
+    assert writer.finish() == delta.OP_END
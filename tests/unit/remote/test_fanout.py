@@ -0,0 +1,48 @@
+import shlex
+import subprocess
+
+from microovn_rebuilder.remote.fanout import (
+    SSH_OPTIONS,
+    forward_round,
+    receive_command,
+    ssh_forward_command,
+)
+from microovn_rebuilder.target import Target
+
+
+def test_receive_command(tmp_path):
+    target = Target("local/ovn-northd", "bin/ovn-northd", "/tmp", str(tmp_path))
+    target.remote_path.parent.mkdir()
+    target.remote_path.write_bytes(b"old")
+
+    subprocess.run(
+        ["sh", "-c", receive_command(target, 0o100750)], input=b"new", check=True
+    )
+
+    assert target.remote_path.read_bytes() == b"new"
+    assert target.remote_path.stat().st_mode & 0o7777 == 0o750
+    assert not target.staging_path.exists()
+
+
+def test_ssh_forward_command():
+    target = Target("local/ovn-northd", "bin/ovn northd", "/tmp", "/root")
+
+    command = ssh_forward_command(target, "root@vm2", 0o100755)
+
+    ssh, redirect = command.split(" < ")
+    assert shlex.split(ssh) == [
+        "ssh",
+        *SSH_OPTIONS,
+        "root@vm2",
+        receive_command(target, 0o100755),
+    ]
+    assert shlex.split(redirect) == ["/root/bin/ovn northd"]
+
+
+def test_forward_round():
+    assert forward_round(["vm1"], ["vm2", "vm3"]) == {"vm2": "vm1"}
+    assert forward_round(["vm1", "vm2"], ["vm3"]) == {"vm3": "vm1"}
+    assert forward_round(["vm1", "vm2"], ["vm3", "vm4", "vm5"]) == {
+        "vm3": "vm1",
+        "vm4": "vm2",
+    }
@@ -0,0 +1,93 @@
+import subprocess
+
+from microovn_rebuilder.remote.hooks import (
+    pre_exec_command,
+    pre_exec_hooks,
+    readiness_command,
+    readiness_probes,
+)
+from microovn_rebuilder.target import Target
+
+
+def _target(name, pre_exec=None):
+    return Target(f"local/{name}", f"bin/{name}", "/tmp", "/tmp", pre_exec=pre_exec)
+
+
+def test_pre_exec_hooks():
+    targets = {
+        _target("ovn-sbctl", "echo sb"),
+        _target("ovn-nbctl", "echo nb"),
+        _target("ovn-northd", "echo nb"),
+        _target("ovn-trace"),
+    }
+
+    assert pre_exec_hooks(targets) == ["echo nb", "echo sb"]
+
+
+def test_pre_exec_command_no_hooks():
+    assert pre_exec_command({_target("ovn-trace")}, 10) is None
+
+
+def test_pre_exec_command(tmp_path):
+    log = tmp_path / "hooks.log"
+    targets = {
+        _target("a", f"echo 'first hook' >> {log}"),
+        _target("b", f"echo second >> {log}"),
+    }
+
+    script = pre_exec_command(targets, 10)
+    assert script is not None
+    subprocess.run(["sh", "-c", script], check=True)
+
+    assert log.read_text() == "first hook\nsecond\n"
+
+
+def test_pre_exec_command_failure(tmp_path):
+    log = tmp_path / "hooks.log"
+    targets = {
+        _target("a", "exit 3"),
+        _target("b", f"touch {log}"),
+    }
+
+    script = pre_exec_command(targets, 10)
+    assert script is not None
+    result = subprocess.run(["sh", "-c", script], capture_output=True, text=True)
+
+    assert result.returncode == 3
+    assert result.stderr == "pre_exec hook failed (exit code 3): exit 3\n"
+    assert not log.exists()
+
+
+def test_pre_exec_command_timeout():
+    script = pre_exec_command({_target("a", "sleep 10")}, 0.1)
+    assert script is not None
+
+    result = subprocess.run(["sh", "-c", script], capture_output=True, text=True)
+
+    # 'timeout' exits with 124 when the command times out
+    assert result.returncode == 124
+    assert "sleep 10" in result.stderr
+
+
+def test_readiness_probes():
+    targets = {
+        Target("a", "bin/a", "/tmp", service="northd", ready_check="ovn-appctl a"),
+        Target("b", "bin/b", "/tmp", service="northd", ready_check="ovn-appctl a"),
+        Target("c", "bin/c", "/tmp", service="chassis", ready_check="ovn-appctl c"),
+        # Probe of a target without a service is never run
+        Target("d", "bin/d", "/tmp", ready_check="ovn-appctl d"),
+        Target("e", "bin/e", "/tmp", service="chassis"),
+    }
+
+    assert readiness_probes(targets) == ["ovn-appctl a", "ovn-appctl c"]
+
+
+def test_readiness_command():
+    assert readiness_command([], 10) is None
+
+    script = readiness_command(["true", "exit 1"], 10)
+    assert script is not None
+    result = subprocess.run(["sh", "-c", script], capture_output=True, text=True)
+
+    assert result.returncode == 1
+    assert result.stderr == "Readiness probe failed (exit code 1): exit 1\n"
@@ -1,10 +1,20 @@
 import pytest
 
-from microovn_rebuilder.remote import _CONNECTORS, ConnectorException, create_connector
+from microovn_rebuilder.remote import (
+    _CONNECTORS,
+    AsyncConnector,
+    AsyncLXDConnector,
+    CompositeConnector,
+    ConnectorException,
+    ConnectorOptions,
+    SSHConnector,
+    ThreadedConnector,
+    create_connector,
+)
 
 
 @pytest.mark.parametrize(
-    "bad_spec", ["foo", "foo,bar", "lxd:vm1,ssh:vm2", "foo:vm1,foo:vm2"]
+    "bad_spec", ["foo", "foo,bar", "lxd:vm1,ssh:vm1", "foo:vm1,foo:vm2"]
 )
 def test_create_connector_invalid_spec(bad_spec):
     with pytest.raises(ConnectorException):
@@ -22,3 +32,57 @@ def test_create_connector(mocker, connector_type):
     assert isinstance(connector, expected_type)
     assert connector.remotes == expected_remotes
     mock_initialize.assert_called_once()
+
+
+def test_create_connector_options(mocker):
+    mocker.patch.object(_CONNECTORS["lxd"], "initialize")
+    options = ConnectorOptions(parallel=2, bulk=True)
+
+    connector = create_connector("lxd:vm1,lxd:vm2", options)
+
+    assert connector.options == options
+    assert connector.parallel == 2
+
+
+def test_create_async_connector(mocker):
+    mock_initialize = mocker.patch.object(AsyncConnector, "initialize")
+
+    connector = create_connector("lxd:vm1,lxd:vm2", use_async=True)
+
+    assert isinstance(connector, AsyncLXDConnector)
+    assert connector.remotes == ["vm1", "vm2"]
+    mock_initialize.assert_called_once()
+
+
+def test_create_async_connector_threaded(mocker):
+    mock_initialize = mocker.patch.object(ThreadedConnector, "initialize")
+    options = ConnectorOptions(parallel=2)
+
+    connector = create_connector("ssh:vm1,ssh:vm2", options, use_async=True)
+
+    assert isinstance(connector, ThreadedConnector)
+    assert isinstance(connector.connector, SSHConnector)
+    assert connector.remotes == ["vm1", "vm2"]
+    assert connector.options == options
+    mock_initialize.assert_called_once()
+
+
+@pytest.mark.parametrize("use_async", [True, False])
+def test_create_composite_connector(mocker, use_async):
+    mock_initialize = mocker.patch.object(CompositeConnector, "initialize")
+    options = ConnectorOptions(parallel=8, bulk=True)
+
+    connector = create_connector(
+        "lxd:vm1,ssh:vm2,lxd:vm3", options, use_async, type_parallel={"ssh": 2}
+    )
+
+    assert isinstance(connector, CompositeConnector)
+    assert connector.remotes == ["vm1", "vm3", "vm2"]
+    lxd, ssh = connector.connectors["lxd"], connector.connectors["ssh"]
+    assert lxd.remotes == ["vm1", "vm3"]
+    assert ssh.remotes == ["vm2"]
+    assert lxd.options == options
+    assert ssh.options == ConnectorOptions(parallel=2, bulk=True)
+    assert isinstance(lxd, AsyncLXDConnector) == use_async
+    assert isinstance(ssh, ThreadedConnector) == use_async
+    mock_initialize.assert_called_once()
@@ -1,55 +1,148 @@
+import asyncio
+import dataclasses
+import gzip
+import os
 import subprocess
+from pathlib import Path
 from unittest import mock
 from unittest.mock import MagicMock, call
 
 import pytest
 
-from microovn_rebuilder.remote import ConnectorException, lxd
+from microovn_rebuilder.remote import ConnectorException, ConnectorOptions, aio, lxd
+from microovn_rebuilder.remote.archive import extract_command
+from microovn_rebuilder.remote.checksum import checksum_command
+from microovn_rebuilder.remote.compression import decompress_command
+from microovn_rebuilder.remote.fanout import receive_command
+from microovn_rebuilder.target import Target
 
 
-def test_update(mocker, lxd_connector, default_targets):
+def test_transfer_target(mocker, lxd_connector, default_targets):
     for target in default_targets:
         mock_run_result = MagicMock(spec=subprocess.CompletedProcess)
         mock_run_cmd = mocker.patch.object(
             lxd_connector, "_run_command", return_value=mock_run_result
         )
         mock_check_cmd = mocker.patch.object(lxd_connector, "_check_cmd_result")
+        mocker.patch.object(lxd.os.path, "getsize", return_value=0)
 
-        expected_run_calls = []
-        expected_check_calls = []
         for remote in lxd_connector.remotes:
-            expected_run_calls.append(
-                call("lxc", "file", "delete", f"{remote}{target.remote_path}")
-            )
-            expected_check_calls.append(
-                call(mock_run_result, f"[{remote}] Failed to remove remote file")
-            )
+            lxd_connector._transfer_target(remote, target)
 
-            expected_run_calls.append(
-                call(
-                    "lxc",
-                    "file",
-                    "push",
-                    target.local_path,
-                    f"{remote}{target.remote_path}",
-                )
+            mock_run_cmd.assert_has_calls(
+                [
+                    call(
+                        "lxc",
+                        "file",
+                        "push",
+                        target.local_path,
+                        f"{remote}{target.staging_path}",
+                    ),
+                    call(
+                        "lxc",
+                        "exec",
+                        remote,
+                        "--",
+                        "mv",
+                        "-f",
+                        target.staging_path,
+                        target.remote_path,
+                    ),
+                ]
             )
-            expected_check_calls.append(
-                call(mock_run_result, f"[{remote}] Failed to upload file")
+            mock_check_cmd.assert_has_calls(
+                [
+                    call(mock_run_result, f"[{remote}] Failed to upload file"),
+                    call(mock_run_result, f"[{remote}] Failed to replace remote file"),
+                ]
             )
 
-            if target.service:
-                expected_run_calls.append(
-                    call("lxc", "exec", remote, "snap", "restart", target.service)
-                )
-                expected_check_calls.append(
-                    call(mock_run_result, f"[{remote}] Failed to restart service")
-                )
 
-        lxd_connector.update(target)
+def test_transfer_target_compressed(mocker, default_targets):
+    connector = lxd.LXDConnector(["vm1"], ConnectorOptions(compression="xz"))
+    target = next(t for t in default_targets if t.service)
+    mock_upload = mocker.patch.object(connector, "_upload")
+    mock_upload_compressed = mocker.patch.object(connector, "_upload_compressed")
+
+    connector._transfer_target("vm1", target)
+
+    mock_upload.assert_not_called()
+    mock_upload_compressed.assert_called_once_with("vm1", target, "xz")
+
+
+def test_restart_services(mocker, lxd_connector):
+    mock_run_result = MagicMock(spec=subprocess.CompletedProcess)
+    mock_run_cmd = mocker.patch.object(
+        lxd_connector, "_run_command", return_value=mock_run_result
+    )
+    mock_check_cmd = mocker.patch.object(lxd_connector, "_check_cmd_result")
+    mocker.patch("builtins.print")
+    services = ["microovn.chassis", "microovn.ovn-northd"]
+
+    lxd_connector._restart_services("vm1", services)
+
+    mock_run_cmd.assert_called_once_with(
+        "lxc", "exec", "vm1", "snap", "restart", *services
+    )
+    mock_check_cmd.assert_called_once_with(
+        mock_run_result, "[vm1] Failed to restart service"
+    )
+
+
+def test_upload_compressed(mocker, tmp_path):
+    connector = lxd.LXDConnector(
+        ["vm1"], ConnectorOptions(compression="xz", compression_level=3)
+    )
+    (tmp_path / "ovn-northd").write_bytes(b"northd")
+    target = Target("ovn-northd", "bin/ovn-northd", str(tmp_path))
+    mock_run_result = MagicMock(spec=subprocess.CompletedProcess)
+    mock_run_cmd = mocker.patch.object(
+        connector, "_run_command", return_value=mock_run_result
+    )
+    mock_check_cmd = mocker.patch.object(connector, "_check_cmd_result")
+    mock_stream = mocker.patch.object(lxd, "compressed_stream")
+    stream = mock_stream.return_value.__enter__.return_value
+    mocker.patch("builtins.print")
+
+    asyncio.run(connector._upload_compressed("vm1", target, "xz"))
 
-        mock_run_cmd.assert_has_calls(expected_run_calls)
-        mock_check_cmd.assert_has_calls(expected_check_calls)
+    mock_stream.assert_called_once_with(target.local_path, "xz", 3)
+    command = decompress_command("xz", target, target.local_path.stat().st_mode)
+    mock_run_cmd.assert_called_once_with(
+        "lxc", "exec", "vm1", "--", "sh", "-c", command, stdin=stream
+    )
+    mock_check_cmd.assert_called_once_with(
+        mock_run_result, "[vm1] Failed to upload file"
+    )
+
+
+def test_transfer_archive(mocker, lxd_connector, default_targets, tmp_path):
+    archive = tmp_path / "targets.tar"
+    archive.write_bytes(b"archive")
+    mock_run_result = MagicMock(spec=subprocess.CompletedProcess)
+    mock_run_cmd = mocker.patch.object(
+        lxd_connector, "_run_command", return_value=mock_run_result
+    )
+    mock_check_cmd = mocker.patch.object(lxd_connector, "_check_cmd_result")
+    mocker.patch("builtins.print")
+    remote = "vm1"
+
+    lxd_connector._transfer_archive(remote, archive, default_targets)
+
+    extract_call = mock_run_cmd.call_args
+    assert extract_call.args == (
+        "lxc",
+        "exec",
+        remote,
+        "--",
+        "sh",
+        "-c",
+        extract_command(default_targets),
+    )
+    assert extract_call.kwargs["stdin"].name == str(archive)
+    mock_check_cmd.assert_called_once_with(
+        mock_run_result, f"[{remote}] Failed to upload archive"
+    )
 
 
 def test_check_remote(mocker, lxd_connector, remote_deployment_path):
@@ -63,7 +156,16 @@ def test_check_remote(mocker, lxd_connector, remote_deployment_path):
     expected_check_calls = []
     for remote in lxd_connector.remotes:
         expected_run_calls.append(
-            call("lxc", "exec", remote, "--", "test", "-d", remote_deployment_path)
+            call(
+                "lxc",
+                "exec",
+                remote,
+                "--",
+                "test",
+                "-d",
+                remote_deployment_path,
+                timeout=10.0,
+            )
         )
         expected_check_calls.append(
             call(
@@ -74,8 +176,53 @@ def test_check_remote(mocker, lxd_connector, remote_deployment_path):
 
     lxd_connector.check_remote(remote_deployment_path)
 
-    mock_run_command.assert_has_calls(expected_run_calls)
-    mock_check_cmd_result.assert_has_calls(expected_check_calls)
+    mock_run_command.assert_has_calls(expected_run_calls, any_order=True)
+    mock_check_cmd_result.assert_has_calls(expected_check_calls, any_order=True)
+
+
+@pytest.mark.parametrize("returncode", [0, 1])
+def test_remote_checksums(mocker, default_targets, returncode):
+    connector = lxd.LXDConnector(["vm1"])
+    target = next(iter(default_targets))
+    mock_run_command = mocker.patch.object(
+        connector,
+        "_run_command",
+        return_value=subprocess.CompletedProcess(
+            [], returncode, f"abcd  {target.remote_path}\n".encode(), b"failed"
+        ),
+    )
+
+    if returncode:
+        with pytest.raises(ConnectorException, match="Failed to compute checksums"):
+            connector._remote_checksums("vm1", default_targets)
+    else:
+        checksums = connector._remote_checksums("vm1", default_targets)
+        assert checksums[target] == "abcd"
+        assert all(checksums[t] is None for t in default_targets - {target})
+
+    mock_run_command.assert_called_once_with(
+        "lxc", "exec", "vm1", "--", "sh", "-c", checksum_command(default_targets)
+    )
+
+
+@pytest.mark.parametrize("returncode", [0, 1])
+def test_run_script(mocker, returncode):
+    connector = lxd.LXDConnector(["vm1"])
+    mock_run_command = mocker.patch.object(
+        connector,
+        "_run_command",
+        return_value=subprocess.CompletedProcess([], returncode, b"", b"hook failed"),
+    )
+
+    if returncode:
+        with pytest.raises(ConnectorException, match="Failed to run script"):
+            connector._run_script("vm1", "true")
+    else:
+        connector._run_script("vm1", "true")
+
+    mock_run_command.assert_called_once_with(
+        "lxc", "exec", "vm1", "--", "sh", "-c", "true"
+    )
 
 
 def test_run_command(mocker, lxd_connector):
@@ -83,7 +230,9 @@ def test_run_command(mocker, lxd_connector):
     cmd = ["/bin/foo", "bar"]
     lxd_connector._run_command(*cmd)
 
-    mock_run.assert_called_once_with(tuple(cmd), capture_output=True)
+    mock_run.assert_called_once_with(
+        tuple(cmd), stdin=None, capture_output=True, timeout=None
+    )
 
 
 def test_check_cmd_result_no_error(lxd_connector):
@@ -102,3 +251,251 @@ def test_check_cmd_result_error(lxd_connector):
         lxd_connector._check_cmd_result(result, extra_msg)
 
     assert extra_msg in str(exc.value)
+
+
+def test_transfer_archive_compressed(mocker, default_targets, tmp_path):
+    connector = lxd.LXDConnector(["vm1"], ConnectorOptions(compression="zstd"))
+    mock_run_cmd = mocker.patch.object(connector, "_run_command")
+    mocker.patch.object(connector, "_check_cmd_result")
+    mock_stream = mocker.patch.object(lxd, "upload_stream")
+    stream = mock_stream.return_value.__enter__.return_value
+    mocker.patch("builtins.print")
+    archive = tmp_path / "targets.tar"
+
+    connector._transfer_archive("vm1", archive, default_targets)
+
+    mock_stream.assert_called_once_with(archive, "zstd", None)
+    mock_run_cmd.assert_called_once_with(
+        "lxc",
+        "exec",
+        "vm1",
+        "--",
+        "sh",
+        "-c",
+        extract_command(default_targets, "zstd"),
+        stdin=stream,
+    )
+
+
+@pytest.fixture()
+def fake_lxc(tmp_path, monkeypatch):
+    """Put fake 'lxc' command on PATH that logs its arguments. Stdin of shell
+    commands is saved to a separate file for each remote and pulled files contain
+    their source."""
+    log = tmp_path / "lxc.log"
+    script = tmp_path / "bin" / "lxc"
+    script.parent.mkdir()
+    script.write_text(
+        "#!/bin/sh\n"
+        f'echo "$@" >> {log}\n'
+        'if [ "$1 $2" = "file pull" ]; then echo "content of $3"; fi\n'
+        f'if [ "$5" = "-c" ]; then cat > {log}.$2; fi\n'
+        'case "$*" in *-fail*) echo "lxc failed" >&2; exit 1;; esac\n'
+        'case "$*" in *-slow*) exec sleep 5;; esac\n'
+        'case "$*" in *sha256sum*) echo "abcd  /root/squashfs-root/bin/ovn-northd";; esac\n'
+    )
+    script.chmod(0o755)
+    monkeypatch.setenv("PATH", f"{script.parent}:{lxd.os.environ['PATH']}")
+    return log
+
+
+@pytest.fixture()
+def async_target(tmp_path):
+    (tmp_path / "ovn-northd").write_bytes(b"northd")
+    return Target(
+        "ovn-northd", "bin/ovn-northd", str(tmp_path), "/root/squashfs-root", "northd"
+    )
+
+
+@pytest.mark.parametrize("bulk", [True, False])
+def test_async_update_many(mocker, fake_lxc, async_target, bulk):
+    mocker.patch("builtins.print")
+    connector = lxd.AsyncLXDConnector(
+        ["vm1", "vm2"], ConnectorOptions(parallel=2, bulk=bulk)
+    )
+    try:
+        connector.update_many({async_target})
+    finally:
+        connector.teardown()
+
+    log = fake_lxc.read_text().splitlines()
+    for remote in connector.remotes:
+        if bulk:
+            assert f"exec {remote} -- sh -c {extract_command({async_target})}" in log
+        else:
+            assert (
+                f"file push {async_target.local_path} "
+                f"{remote}{async_target.staging_path}"
+            ) in log
+            assert (
+                f"exec {remote} -- mv -f {async_target.staging_path} "
+                f"{async_target.remote_path}"
+            ) in log
+        assert f"exec {remote} snap restart northd" in log
+
+
+def test_async_upload_compressed(mocker, fake_lxc, async_target):
+    mocker.patch("builtins.print")
+    connector = lxd.AsyncLXDConnector(["vm1"], ConnectorOptions(compression="gzip"))
+    try:
+        connector.transfer({async_target})
+    finally:
+        connector.teardown()
+
+    command = decompress_command(
+        "gzip", async_target, async_target.local_path.stat().st_mode
+    )
+    assert fake_lxc.read_text() == f"exec vm1 -- sh -c {command}\n"
+    assert gzip.decompress(Path(f"{fake_lxc}.vm1").read_bytes()) == b"northd"
+
+
+def test_async_remote_checksums(fake_lxc, async_target):
+    connector = lxd.AsyncLXDConnector(["vm1"])
+    try:
+        checksums = connector.remote_checksums({async_target})
+    finally:
+        connector.teardown()
+
+    assert checksums == {"vm1": {async_target: "abcd"}}
+    assert (
+        f"exec vm1 -- sh -c {checksum_command({async_target})}" in fake_lxc.read_text()
+    )
+
+
+def test_async_pre_exec(mocker, fake_lxc, async_target):
+    mocker.patch("builtins.print")
+    target = dataclasses.replace(async_target, pre_exec="snap stop northd")
+    connector = lxd.AsyncLXDConnector(["vm1", "vm2-fail"])
+    try:
+        with pytest.raises(ConnectorException) as exc:
+            connector.transfer({target})
+    finally:
+        connector.teardown()
+
+    log = fake_lxc.read_text().splitlines()
+    for remote in connector.remotes:
+        assert f"exec {remote} -- sh -c timeout 60 sh -c 'snap stop northd'" in (
+            line.partition(" ||")[0] for line in log
+        )
+    # No file is uploaded when hooks fail on any remote
+    assert not any(line.startswith("file push") for line in log)
+    assert str(exc.value) == "[vm2-fail] Failed to run script: lxc failed"
+
+
+def test_async_check_remote(fake_lxc):
+    connector = lxd.AsyncLXDConnector(["vm1", "vm2-fail"])
+    try:
+        connector.check_remote("/root/squashfs-root")
+        pytest.fail("check_remote did not fail")  # pragma: no cover
+    except ConnectorException as exc:
+        assert str(exc) == (
+            "[vm2-fail] Remote directory '/root/squashfs-root' does not exist on LXC "
+            "instance vm2-fail: lxc failed"
+        )
+    finally:
+        connector.teardown()
+
+    assert "exec vm1 -- test -d /root/squashfs-root" in fake_lxc.read_text()
+
+
+@pytest.mark.parametrize("connector_class", [lxd.LXDConnector, lxd.AsyncLXDConnector])
+def test_forward_target(fake_lxc, async_target, connector_class):
+    connector = connector_class(["vm1", "vm2"])
+    try:
+        connector._forward_target("vm1", "vm2", async_target)
+    finally:
+        connector.teardown()
+
+    mode = async_target.local_path.stat().st_mode
+    # Both 'lxc' processes run at once, so they are logged in any order
+    assert sorted(fake_lxc.read_text().splitlines()) == [
+        f"exec vm2 -- sh -c {receive_command(async_target, mode)}",
+        f"file pull vm1{async_target.remote_path} -",
+    ]
+    assert Path(f"{fake_lxc}.vm2").read_text() == (
+        f"content of vm1{async_target.remote_path}\n"
+    )
+
+
+@pytest.mark.parametrize("connector_class", [lxd.LXDConnector, lxd.AsyncLXDConnector])
+@pytest.mark.parametrize(
+    "source, remote, error",
+    [
+        ("vm1-fail", "vm2", "[vm2] Failed to pull file from vm1-fail: lxc failed"),
+        ("vm1", "vm2-fail", "[vm2-fail] Failed to forward file: lxc failed"),
+    ],
+)
+def test_forward_target_failure(
+    fake_lxc, async_target, connector_class, source, remote, error
+):
+    connector = connector_class([source, remote])
+    try:
+        with pytest.raises(ConnectorException) as exc:
+            connector._forward_target(source, remote, async_target)
+    finally:
+        connector.teardown()
+
+    assert str(exc.value) == error
+
+
+def test_async_forward_target_cancelled(mocker, fake_lxc, async_target):
+    connector = lxd.AsyncLXDConnector(["vm1", "vm2"])
+    mocker.patch.object(
+        connector, "_run_command_async", side_effect=asyncio.CancelledError
+    )
+    mock_exec = mocker.spy(lxd.asyncio, "create_subprocess_exec")
+
+    with pytest.raises(asyncio.CancelledError):
+        asyncio.run(connector._forward_target_async("vm1", "vm2", async_target))
+
+    # Pulling process does not outlive the cancelled task
+    assert mock_exec.spy_return.returncode is not None
+
+
+@pytest.mark.parametrize(
+    "make_connector",
+    [
+        lxd.LXDConnector,
+        lxd.AsyncLXDConnector,
+        lambda *args: aio.ThreadedConnector(lxd.LXDConnector(*args)),
+    ],
+)
+def test_check_remote_unreachable(mocker, fake_lxc, make_connector):
+    mock_print = mocker.patch("builtins.print")
+    connector = make_connector(
+        ["vm1", "vm2-slow", "vm3-fail"],
+        ConnectorOptions(connect_timeout=0.1, skip_unreachable=True),
+    )
+    try:
+        connector.check_remote("/root/squashfs-root")
+    finally:
+        connector.teardown()
+
+    assert connector.remotes == ["vm1"]
+    mock_print.assert_called_once_with(
+        "Continuing without unreachable remote hosts:\n"
+        "[vm2-slow] LXC instance vm2-slow did not respond within 0.1s\n"
+        "[vm3-fail] Remote directory '/root/squashfs-root' does not exist on LXC "
+        "instance vm3-fail: lxc failed"
+    )
+
+
+def test_async_run_command_cancelled(tmp_path):
+    pid_file = tmp_path / "pid"
+
+    async def run() -> None:
+        task = asyncio.create_task(
+            lxd.AsyncLXDConnector._run_command_async(
+                "sh", "-c", f"echo $$ > {pid_file}; exec sleep 60"
+            )
+        )
+        while not pid_file.exists() or not pid_file.read_text():
+            await asyncio.sleep(0.01)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(run())
+
+    with pytest.raises(ProcessLookupError):
+        os.kill(int(pid_file.read_text()), 0)
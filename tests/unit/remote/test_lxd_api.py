@@ -0,0 +1,448 @@
+import dataclasses
+import gzip
+import io
+import json
+import socketserver
+import tarfile
+import threading
+from http.server import BaseHTTPRequestHandler
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+
+from microovn_rebuilder.remote import (
+    ConnectorException,
+    ConnectorOptions,
+    create_connector,
+    lxd_api,
+)
+from microovn_rebuilder.remote.checksum import checksum_command
+from microovn_rebuilder.remote.hooks import pre_exec_command
+from microovn_rebuilder.target import Target
+
+
+class FakeLXDServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, socket_path: str) -> None:
+        super().__init__(socket_path, FakeLXDHandler)
+        self.files: Dict[Tuple[str, str], Tuple[bytes, Dict[str, str]]] = {}
+        self.commands: List[Tuple[str, List[str]]] = []
+        self.deleted: List[str] = []
+        self.connections = 0
+        # Callable that returns exit code and stderr of executed command
+        self.exec_result: Callable[[str, List[str]], Tuple[int, bytes]] = (
+            lambda instance, command: (0, b"")
+        )
+        # Callable that returns stdout of executed command
+        self.exec_stdout: Callable[[str, List[str]], bytes] = (
+            lambda instance, command: b""
+        )
+        self.operation_status = "Success"
+        self._operations: Dict[str, Tuple[int, bytes, bytes]] = {}
+        self._logs: Dict[str, bytes] = {}
+
+    def exec(self, instance: str, command: List[str]) -> str:
+        self.commands.append((instance, command))
+        operation = f"op{len(self.commands)}"
+        self._operations[operation] = (
+            *self.exec_result(instance, command),
+            self.exec_stdout(instance, command),
+        )
+        return operation
+
+    def wait(self, operation: str) -> Dict:
+        return_code, stderr, stdout = self._operations[operation]
+        logs = {
+            "1": f"/1.0/instances/vm/logs/exec_{operation}.stdout",
+            "2": f"/1.0/instances/vm/logs/exec_{operation}.stderr",
+        }
+        self._logs[logs["1"]] = stdout
+        self._logs[logs["2"]] = stderr
+        return {
+            "status": self.operation_status,
+            "err": "operation failed" if self.operation_status != "Success" else "",
+            "metadata": {"return": return_code, "output": logs},
+        }
+
+
+class FakeLXDHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server: FakeLXDServer
+
+    def setup(self) -> None:
+        super().setup()
+        self.server.connections += 1
+
+    def log_message(self, format: str, *args) -> None:
+        pass
+
+    def do_GET(self) -> None:
+        url = urlparse(self.path)
+        path = url.path
+        if path == "/1.0":
+            self._sync({"api_version": "1.0"})
+        elif path.endswith("/files"):
+            key = (path.split("/")[3], parse_qs(url.query)["path"][0])
+            if key in self.server.files:
+                self._send(200, self.server.files[key][0])
+            else:
+                self._error(404, "not found")
+        elif path.startswith("/1.0/operations/") and path.endswith("/wait"):
+            self._sync(self.server.wait(path.split("/")[3]))
+        elif path in self.server._logs:
+            self._send(200, self.server._logs[path])
+        else:
+            self._error(404, "not found")
+
+    def do_POST(self) -> None:
+        url = urlparse(self.path)
+        parts = url.path.split("/")
+        body = self._body()
+        if parts[-1] == "files":
+            path = parse_qs(url.query)["path"][0]
+            self.server.files[(parts[3], path)] = (body, dict(self.headers))
+            self._sync({})
+        elif parts[-1] == "exec":
+            request = json.loads(body)
+            operation = self.server.exec(parts[3], request["command"])
+            self._send(
+                202,
+                json.dumps(
+                    {"type": "async", "operation": f"/1.0/operations/{operation}"}
+                ).encode(),
+            )
+        else:
+            self._error(404, "not found")
+
+    def do_DELETE(self) -> None:
+        self.server.deleted.append(self.path)
+        self._sync({})
+
+    def _body(self) -> bytes:
+        if self.headers.get("Transfer-Encoding") == "chunked":
+            data = b""
+            while size := int(self.rfile.readline().strip(), 16):
+                data += self.rfile.read(size)
+                self.rfile.readline()
+            self.rfile.readline()
+            return data
+        return self.rfile.read(int(self.headers.get("Content-Length", 0)))
+
+    def _sync(self, metadata: Dict) -> None:
+        response = {"type": "sync", "status_code": 200, "metadata": metadata}
+        self._send(200, json.dumps(response).encode())
+
+    def _error(self, code: int, error: str) -> None:
+        response = {"type": "error", "error_code": code, "error": error}
+        self._send(code, json.dumps(response).encode())
+
+    def _send(self, code: int, data: bytes) -> None:
+        self.send_response(code)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+@pytest.fixture()
+def lxd_server(tmp_path):
+    server = FakeLXDServer(str(tmp_path / "unix.socket"))
+    thread = threading.Thread(
+        target=server.serve_forever, kwargs={"poll_interval": 0.01}, daemon=True
+    )
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture()
+def make_connector(lxd_server):
+    connectors = []
+
+    def make(options: Optional[ConnectorOptions] = None) -> lxd_api.LXDAPIConnector:
+        connector = lxd_api.LXDAPIConnector(
+            ["vm1", "vm2"], options, socket_path=lxd_server.server_address
+        )
+        connector.initialize()
+        connectors.append(connector)
+        return connector
+
+    yield make
+    for connector in connectors:
+        connector.teardown()
+
+
+@pytest.fixture()
+def local_target(tmp_path) -> Target:
+    (tmp_path / "ovn-northd").write_bytes(b"northd" * 1000)
+    (tmp_path / "ovn-northd").chmod(0o750)
+    return Target(
+        local_rel_path="ovn-northd",
+        remote_rel_path="bin/ovn-northd",
+        local_base_path=str(tmp_path),
+        service="microovn.ovn-northd",
+    )
+
+
+@pytest.mark.parametrize(
+    "lxd_dir, expected",
+    [(None, lxd_api.SNAP_SOCKET_PATH), ("/var/lib/lxd", "/var/lib/lxd/unix.socket")],
+)
+def test_default_socket_path(monkeypatch, lxd_dir, expected):
+    monkeypatch.delenv("LXD_DIR", raising=False)
+    if lxd_dir:
+        monkeypatch.setenv("LXD_DIR", lxd_dir)
+
+    assert lxd_api.default_socket_path() == expected
+
+
+def test_create_connector(mocker):
+    mocker.patch.object(lxd_api.LXDAPIConnector, "initialize")
+
+    connector = create_connector("lxd-api:vm1,lxd-api:vm2")
+
+    assert isinstance(connector, lxd_api.LXDAPIConnector)
+    assert connector.remotes == ["vm1", "vm2"]
+
+
+def test_initialize_fail(tmp_path):
+    connector = lxd_api.LXDAPIConnector(["vm1"], socket_path=str(tmp_path / "missing"))
+
+    with pytest.raises(ConnectorException, match="Failed to connect to LXD"):
+        connector.initialize()
+
+
+def test_transfer_target(mocker, lxd_server, make_connector, local_target):
+    mocker.patch("builtins.print")
+    connector = make_connector()
+
+    connector.transfer({local_target})
+
+    for remote in connector.remotes:
+        body, headers = lxd_server.files[(remote, str(local_target.staging_path))]
+        assert body == local_target.local_path.read_bytes()
+        assert headers["X-LXD-mode"] == "0750"
+        assert headers["X-LXD-write"] == "overwrite"
+    assert lxd_server.commands == [
+        (
+            remote,
+            ["mv", "-f", str(local_target.staging_path), str(local_target.remote_path)],
+        )
+        for remote in connector.remotes
+    ]
+    # Logs of executed commands are cleaned up
+    assert len(lxd_server.deleted) == 2 * len(lxd_server.commands)
+    # All requests were sent over a single connection
+    assert lxd_server.connections == 1
+
+
+def input_files(lxd_server, remote):
+    """Input files of commands run in 'remote', by their path."""
+    return {
+        path: upload
+        for (instance, path), upload in lxd_server.files.items()
+        if instance == remote and path.startswith(f"{lxd_api.INPUT_PATH}.")
+    }
+
+
+def test_transfer_target_compressed(mocker, lxd_server, make_connector, local_target):
+    mocker.patch("builtins.print")
+    connector = make_connector(ConnectorOptions(compression="gzip"))
+
+    connector._transfer_target("vm1", local_target)
+
+    ((path, (body, headers)),) = input_files(lxd_server, "vm1").items()
+    assert gzip.decompress(body) == local_target.local_path.read_bytes()
+    assert headers["Transfer-Encoding"] == "chunked"
+    ((instance, command),) = lxd_server.commands
+    assert instance == "vm1"
+    assert command[:2] == ["sh", "-c"]
+    assert f"{local_target.remote_path}" in command[2]
+    assert command[2].endswith(f"rm -f {path}; exit $rc")
+
+
+def test_transfer_target_compressed_unique_input(
+    mocker, lxd_server, make_connector, local_target
+):
+    mocker.patch("builtins.print")
+    connector = make_connector(ConnectorOptions(compression="gzip"))
+
+    connector._transfer_target("vm1", local_target)
+    connector._transfer_target("vm1", local_target)
+
+    # Concurrent uploads to the same instance must not share their input file
+    assert len(input_files(lxd_server, "vm1")) == 2
+
+
+def test_transfer_archive(mocker, lxd_server, make_connector, local_target):
+    mocker.patch("builtins.print")
+    connector = make_connector(ConnectorOptions(bulk=True))
+
+    connector.transfer({local_target})
+
+    for remote in connector.remotes:
+        ((body, _),) = input_files(lxd_server, remote).values()
+        with tarfile.open(fileobj=io.BytesIO(body)) as archive:
+            assert archive.getnames() == [str(local_target.staging_path).lstrip("/")]
+    assert [instance for instance, _ in lxd_server.commands] == connector.remotes
+
+
+def test_restart_services(mocker, lxd_server, make_connector):
+    mocker.patch("builtins.print")
+    connector = make_connector()
+
+    connector.restart(["microovn.chassis", "microovn.ovn-northd"])
+
+    assert lxd_server.commands == [
+        (remote, ["snap", "restart", "microovn.chassis", "microovn.ovn-northd"])
+        for remote in connector.remotes
+    ]
+
+
+def test_command_failure(mocker, lxd_server, make_connector):
+    mocker.patch("builtins.print")
+    lxd_server.exec_result = lambda instance, command: (
+        (1, b"snap not found") if instance == "vm2" else (0, b"")
+    )
+    connector = make_connector()
+
+    with pytest.raises(ConnectorException) as exc:
+        connector.restart(["microovn.chassis"])
+
+    assert str(exc.value) == "[vm2] Failed to restart service: snap not found"
+
+
+def test_remote_checksums(lxd_server, make_connector, local_target):
+    lxd_server.exec_stdout = lambda instance, command: (
+        f"abcd  {local_target.remote_path}\n".encode() if instance == "vm1" else b""
+    )
+    connector = make_connector()
+
+    checksums = connector.remote_checksums({local_target})
+
+    assert checksums == {"vm1": {local_target: "abcd"}, "vm2": {local_target: None}}
+    assert lxd_server.commands == [
+        (remote, ["sh", "-c", checksum_command({local_target})])
+        for remote in connector.remotes
+    ]
+    # Logs of executed commands are cleaned up
+    assert len(lxd_server.deleted) == 4
+
+
+def test_run_script(mocker, lxd_server, make_connector, local_target):
+    mocker.patch("builtins.print")
+    lxd_server.exec_result = lambda instance, command: (
+        (1, b"hook failed") if instance == "vm2" else (0, b"")
+    )
+    connector = make_connector()
+    hooked = dataclasses.replace(local_target, pre_exec="true")
+
+    with pytest.raises(ConnectorException) as exc:
+        connector.pre_exec({remote: {hooked} for remote in connector.remotes})
+
+    assert str(exc.value) == "[vm2] Failed to run script: hook failed"
+    script = pre_exec_command({hooked}, connector.options.pre_exec_timeout)
+    assert sorted(lxd_server.commands) == [
+        (remote, ["sh", "-c", script]) for remote in connector.remotes
+    ]
+
+
+def test_forward_target(mocker, lxd_server, make_connector, local_target):
+    mocker.patch("builtins.print")
+    connector = make_connector(ConnectorOptions(fanout=1))
+    connector.client.push(
+        "vm1", local_target.remote_path, io.BytesIO(b"remote"), 0o644, 6
+    )
+
+    connector.transfer({local_target})
+
+    body, headers = lxd_server.files[("vm2", str(local_target.staging_path))]
+    assert body == b"remote"
+    assert headers["X-LXD-mode"] == "0750"
+    assert lxd_server.commands[-1] == (
+        "vm2",
+        ["mv", "-f", str(local_target.staging_path), str(local_target.remote_path)],
+    )
+
+
+def test_forward_target_failure(mocker, lxd_server, make_connector, local_target):
+    connector = make_connector()
+
+    with pytest.raises(ConnectorException) as exc:
+        connector._forward_target("vm1", "vm2", local_target)
+    assert str(exc.value) == "[vm2] Failed to pull file from vm1: not found"
+
+    mocker.patch.object(
+        connector.client, "_request_raw", return_value=(500, b"Internal error")
+    )
+    with pytest.raises(ConnectorException, match="HTTP 500"):
+        connector._forward_target("vm1", "vm2", local_target)
+
+
+def test_operation_failure(lxd_server, make_connector):
+    lxd_server.operation_status = "Failure"
+    connector = make_connector()
+
+    with pytest.raises(ConnectorException, match=r"\[vm1\].*operation failed"):
+        connector.check_remote("/root/squashfs-root")
+
+
+def test_check_remote(lxd_server, make_connector):
+    lxd_server.exec_result = lambda instance, command: (
+        (1, b"") if instance == "vm2" else (0, b"")
+    )
+    connector = make_connector()
+
+    with pytest.raises(ConnectorException, match="does not exist on LXC instance vm2"):
+        connector.check_remote("/root/squashfs-root")
+
+    assert sorted(lxd_server.commands) == [
+        (remote, ["test", "-d", "/root/squashfs-root"]) for remote in connector.remotes
+    ]
+
+
+def test_check_remote_timeout(lxd_server, make_connector):
+    lxd_server.operation_status = "Running"
+    connector = make_connector(ConnectorOptions(connect_timeout=2.5))
+
+    with pytest.raises(ConnectorException) as exc:
+        connector.check_remote("/root/squashfs-root")
+
+    assert str(exc.value).splitlines() == [
+        f"[{remote}] Remote directory '/root/squashfs-root' does not exist on LXC "
+        f"instance {remote}: Command did not finish within 2.5s"
+        for remote in connector.remotes
+    ]
+
+
+def test_api_error(mocker, lxd_server, make_connector):
+    connector = make_connector()
+
+    with pytest.raises(ConnectorException, match="not found"):
+        connector.client.get("/1.0/missing")
+
+    # Connection is still reusable after an API error
+    connector.client.get("/1.0")
+    assert lxd_server.connections == 1
+
+
+def test_invalid_response(mocker, lxd_server, make_connector):
+    connector = make_connector()
+    lxd_server._logs["/1.0/raw"] = b"not json"
+
+    with pytest.raises(ConnectorException, match="Invalid response"):
+        connector.client.get("/1.0/raw")
+
+
+def test_push_failure(lxd_server, make_connector, local_target):
+    connector = make_connector()
+    lxd_server.shutdown()
+    lxd_server.server_close()
+    connector.client.close()
+    Path(lxd_server.server_address).unlink()
+
+    with pytest.raises(ConnectorException, match=r"\[vm1\] Failed to upload file"):
+        connector._push("vm1", Path("/tmp/foo"), io.BytesIO(b"foo"), 0o644)
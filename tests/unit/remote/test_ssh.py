@@ -1,3 +1,9 @@
+import asyncio
+import dataclasses
+import hashlib
+import io
+import shlex
+import threading
 from os import stat_result
 from unittest.mock import MagicMock, call
 
@@ -7,29 +13,37 @@ from paramiko.client import SSHClient
 from paramiko.sftp_client import SFTPClient
 from paramiko.ssh_exception import SSHException
 
-from microovn_rebuilder.remote import ConnectorException, SSHConnector
+from microovn_rebuilder.remote import (
+    ConnectorException,
+    ConnectorOptions,
+    SSHConnector,
+    ssh,
+)
+from microovn_rebuilder.remote.archive import extract_command
+from microovn_rebuilder.remote.base import transfer_order
+from microovn_rebuilder.remote.checksum import checksum_command
+from microovn_rebuilder.remote.compression import decompress_command
+from microovn_rebuilder.remote.fanout import ssh_forward_command
 from microovn_rebuilder.target import Target
 from tests.unit.conftest import default_targets
 
 
 def test_initialize(mocker):
-    expected_remotes = {
-        "vm1": MagicMock(autospec=SSHClient),
-        "root@vm2": MagicMock(autospec=SSHClient),
-    }
-    mocker.patch(
-        "microovn_rebuilder.remote.ssh.SSHClient",
-        side_effect=list(expected_remotes.values()),
-    )
+    clients = [MagicMock(autospec=SSHClient), MagicMock(autospec=SSHClient)]
+    mocker.patch("microovn_rebuilder.remote.ssh.SSHClient", side_effect=clients)
 
-    connector = SSHConnector(list(expected_remotes.keys()))
+    connector = SSHConnector(["vm1", "root@vm2"])
     connector.initialize()
 
-    expected_remotes["vm1"].connect.assert_called_once_with(hostname="vm1")
-    expected_remotes["root@vm2"].connect.assert_called_once_with(
-        hostname="vm2", username="root"
+    # Remotes connect concurrently, so either of them may get the first client
+    timeouts = dict(timeout=10.0, banner_timeout=10.0, auth_timeout=10.0)
+    connector.connections["vm1"].connect.assert_called_once_with(
+        hostname="vm1", username=None, **timeouts
+    )
+    connector.connections["root@vm2"].connect.assert_called_once_with(
+        hostname="vm2", username="root", **timeouts
     )
-    assert connector.connections == expected_remotes
+    assert sorted(connector.connections.values(), key=id) == sorted(clients, key=id)
 
 
 def test_initialize_fail(mocker):
@@ -40,7 +54,44 @@ def test_initialize_fail(mocker):
         connector.initialize()
 
 
-def test_update_ssh_err(mocker, ssh_connector, default_targets):
+@pytest.mark.parametrize("skip_unreachable", [True, False])
+def test_initialize_unreachable(mocker, skip_unreachable):
+    clients = {}
+
+    def make_client():
+        # Remotes connect concurrently, so clients are keyed by the host they reach
+        client = MagicMock(autospec=SSHClient)
+
+        def connect(hostname, **kwargs):
+            clients[hostname] = client
+            if hostname == "vm2":
+                raise TimeoutError("timed out")
+
+        client.connect.side_effect = connect
+        return client
+
+    mocker.patch("microovn_rebuilder.remote.ssh.SSHClient", side_effect=make_client)
+    mock_print = mocker.patch("builtins.print")
+    connector = SSHConnector(
+        ["vm1", "vm2"], ConnectorOptions(skip_unreachable=skip_unreachable)
+    )
+
+    if skip_unreachable:
+        connector.initialize()
+        assert connector.remotes == ["vm1"]
+        assert connector.connections == {"vm1": clients["vm1"]}
+        mock_print.assert_called_once_with(
+            "Continuing without unreachable remote hosts:\n"
+            "[vm2] Failed to connect: timed out"
+        )
+    else:
+        with pytest.raises(ConnectorException) as exc:
+            connector.initialize()
+        assert str(exc.value) == "[vm2] Failed to connect: timed out"
+        assert connector.remotes == ["vm1", "vm2"]
+
+
+def test_transfer_target_ssh_err(mocker, ssh_connector, default_targets):
     target = list(default_targets)[0]
     mocker.patch("microovn_rebuilder.remote.ssh.os.stat")
 
@@ -48,43 +99,324 @@ def test_update_ssh_err(mocker, ssh_connector, default_targets):
         connection.open_sftp.side_effect = SSHException
 
     with pytest.raises(ConnectorException):
-        ssh_connector.update(target)
+        ssh_connector.transfer({target})
 
 
-def test_update(mocker, ssh_connector, default_targets):
+def test_transfer_target(mocker, ssh_connector, default_targets):
     for target in default_targets:
         file_stats = MagicMock(autospec=stat_result)
+        file_stats.st_size = 0
         mocker.patch("microovn_rebuilder.remote.ssh.os.stat", return_value=file_stats)
-
-        expected_run_commands = []
-        for remote, client in ssh_connector.connections.items():
-            if target.service:
-                expected_run_commands.append(
-                    call(client, remote, f"snap restart {target.service}")
-                )
         mock_run_command = mocker.patch.object(ssh_connector, "_run_command")
 
-        mock_sftp_ctx = []
         mock_sftps = []
         for connection in ssh_connector.connections.values():
             sftp = MagicMock(autospec=SFTPClient)
-            sftp_ctx = MagicMock(autospec=SFTPClient)
-            sftp_ctx.__enter__ = MagicMock(return_value=sftp)
-
-            connection.open_sftp.return_value = sftp_ctx
-            mock_sftp_ctx.append(sftp_ctx)
+            connection.open_sftp.return_value = sftp
             mock_sftps.append(sftp)
 
-        ssh_connector.update(target)
+        for remote in ssh_connector.remotes:
+            ssh_connector._transfer_target(remote, target)
 
         for sftp in mock_sftps:
-            sftp.remove.assert_called_once_with(str(target.remote_path))
-            sftp.put.assert_called_once_with(target.local_path, str(target.remote_path))
+            sftp.remove.assert_not_called()
+            sftp.put.assert_called_once_with(target.local_path, str(target.staging_path))
             sftp.chmod.assert_called_once_with(
-                str(target.remote_path), file_stats.st_mode
+                str(target.staging_path), file_stats.st_mode
+            )
+            sftp.posix_rename.assert_called_once_with(
+                str(target.staging_path), str(target.remote_path)
             )
 
-        mock_run_command.assert_has_calls(expected_run_commands)
+        mock_run_command.assert_not_called()
+
+
+def test_transfer_target_local_err(mocker, ssh_connector, default_targets):
+    target = list(default_targets)[0]
+    mocker.patch("microovn_rebuilder.remote.ssh.os.stat", side_effect=OSError)
+
+    with pytest.raises(ConnectorException):
+        ssh_connector._transfer_target("vm2", target)
+
+
+def test_transfer_targets_channels(mocker, ssh_connector, default_targets):
+    ssh_connector.options = ConnectorOptions(channels=3)
+    mock_print = mocker.patch("builtins.print")
+    failed = transfer_order(default_targets)[-1]
+    threads = set()
+
+    def transfer(remote, target):
+        threads.add(threading.current_thread())
+        ssh_connector._print(f"[{remote}] {target.local_rel_path}")
+        if target == failed:
+            raise ConnectorException(f"[{remote}] failed {target.local_rel_path}")
+
+    mocker.patch.object(ssh_connector, "_transfer_target", side_effect=transfer)
+
+    with pytest.raises(ConnectorException) as exc:
+        asyncio.run(ssh_connector._transfer_targets_async("vm2", default_targets))
+
+    assert str(exc.value) == f"[vm2] failed {failed.local_rel_path}"
+    mock_print.assert_has_calls(
+        [call(f"[vm2] {target.local_rel_path}") for target in default_targets],
+        any_order=True,
+    )
+    # paramiko blocks, so uploads run in worker threads
+    assert threading.main_thread() not in threads
+
+
+def test_transfer_targets_single_channel(mocker, ssh_connector, default_targets):
+    mock_transfer = mocker.patch.object(ssh_connector, "_transfer_target")
+
+    asyncio.run(ssh_connector._transfer_targets_async("vm2", default_targets))
+
+    assert mock_transfer.call_args_list == [
+        call("vm2", target) for target in transfer_order(default_targets)
+    ]
+
+
+def test_sftp_pool_reuse():
+    client = MagicMock(autospec=SSHClient)
+    sftp = client.open_sftp.return_value
+    sftp.get_channel.return_value.closed = False
+    pool = ssh.SFTPPool(client)
+
+    for _ in range(2):
+        with pool.session() as session:
+            assert session is sftp
+
+    client.open_sftp.assert_called_once()
+    sftp.close.assert_not_called()
+
+    pool.close()
+    sftp.close.assert_called_once()
+
+
+def test_sftp_pool_reopen_closed():
+    client = MagicMock(autospec=SSHClient)
+    closed, new = MagicMock(autospec=SFTPClient), MagicMock(autospec=SFTPClient)
+    closed.get_channel.return_value.closed = True
+    client.open_sftp.side_effect = [closed, new]
+    pool = ssh.SFTPPool(client)
+
+    with pool.session():
+        pass
+    with pool.session() as session:
+        assert session is new
+
+    closed.close.assert_called_once()
+
+
+def test_sftp_pool_failure():
+    client = MagicMock(autospec=SSHClient)
+    sftp = client.open_sftp.return_value
+    pool = ssh.SFTPPool(client)
+
+    with pytest.raises(SSHException):
+        with pool.session():
+            raise SSHException()
+
+    sftp.close.assert_called_once()
+    pool.close()
+    sftp.close.assert_called_once()
+
+
+def test_restart_services(mocker, ssh_connector):
+    mocker.patch("builtins.print")
+    mock_run_command = mocker.patch.object(ssh_connector, "_run_command")
+    remote, client = next(iter(ssh_connector.connections.items()))
+    services = ["microovn.chassis", "microovn.ovn-northd"]
+
+    ssh_connector._restart_services(remote, services)
+
+    mock_run_command.assert_called_once_with(
+        client, remote, shlex.join(["snap", "restart", *services])
+    )
+
+
+@pytest.fixture()
+def delta_target(tmp_path) -> Target:
+    (tmp_path / "ovn-northd").write_bytes(b"new content")
+    return Target(
+        local_rel_path="ovn-northd",
+        remote_rel_path="bin/ovn-northd",
+        local_base_path=str(tmp_path),
+        service="microovn.ovn-northd",
+    )
+
+
+def test_transfer_target_delta(mocker, ssh_connector, delta_target):
+    ssh_connector.options = ConnectorOptions(delta=True)
+    mocker.patch("builtins.print")
+    mock_upload_delta = mocker.patch.object(
+        ssh_connector, "_upload_delta", return_value=True
+    )
+    mock_run_command = mocker.patch.object(ssh_connector, "_run_command")
+    remote, client = next(iter(ssh_connector.connections.items()))
+
+    ssh_connector._transfer_target(remote, delta_target)
+
+    mock_upload_delta.assert_called_once_with(
+        client, remote, delta_target, delta_target.local_path.stat().st_mode
+    )
+    client.open_sftp.assert_not_called()
+    mock_run_command.assert_not_called()
+
+
+def test_transfer_target_delta_fallback(mocker, ssh_connector, delta_target):
+    ssh_connector.options = ConnectorOptions(delta=True)
+    mocker.patch("builtins.print")
+    mocker.patch.object(ssh_connector, "_upload_delta", return_value=False)
+    mocker.patch.object(ssh_connector, "_run_command")
+    remote, client = next(iter(ssh_connector.connections.items()))
+    sftp = client.open_sftp.return_value
+
+    ssh_connector._transfer_target(remote, delta_target)
+
+    sftp.put.assert_called_once_with(
+        delta_target.local_path, str(delta_target.staging_path)
+    )
+
+
+def test_upload_delta(mocker, ssh_connector, delta_target):
+    mocker.patch("builtins.print")
+    remote, client = next(iter(ssh_connector.connections.items()))
+    signature = [(1, "abcd")]
+    mock_run_command = mocker.patch.object(
+        ssh_connector, "_run_command", side_effect=[b"1 abcd\n", b""]
+    )
+    mock_compute = mocker.patch.object(ssh, "compute_delta", return_value=b"delta")
+    mock_record = mocker.spy(ssh_connector, "_record_throughput")
+    remote_path = str(delta_target.remote_path)
+
+    assert ssh_connector._upload_delta(client, remote, delta_target, 0o100755)
+
+    data = delta_target.local_path.read_bytes()
+    mock_compute.assert_called_once_with(data, signature, max_literal=len(data) // 2)
+    signature_call, patch_call = mock_run_command.call_args_list
+    assert signature_call == call(
+        client,
+        remote,
+        shlex.join(
+            ["python3", "-c", ssh.SIGNATURE_SCRIPT, remote_path, str(ssh.BLOCK_SIZE)]
+        ),
+    )
+    assert patch_call.args == (
+        client,
+        remote,
+        shlex.join(
+            [
+                "python3",
+                "-c",
+                ssh.PATCH_SCRIPT,
+                remote_path,
+                str(delta_target.staging_path),
+                str(ssh.BLOCK_SIZE),
+                "755",
+                hashlib.sha256(data).hexdigest(),
+            ]
+        ),
+    )
+    assert patch_call.kwargs["stdin"].read() == b"delta"
+    mock_record.assert_called_once_with(remote, len(b"delta"), mocker.ANY)
+
+
+@pytest.mark.parametrize(
+    "signature_result, delta_result",
+    [
+        (ConnectorException("python3: not found"), None),  # no python on remote
+        (b"", None),  # remote file missing
+        (b"1 abcd\n", None),  # files differ too much
+    ],
+)
+def test_upload_delta_not_possible(
+    mocker, ssh_connector, delta_target, signature_result, delta_result
+):
+    mocker.patch("builtins.print")
+    remote, client = next(iter(ssh_connector.connections.items()))
+    mock_run_command = mocker.patch.object(
+        ssh_connector, "_run_command", side_effect=[signature_result]
+    )
+    mocker.patch.object(ssh, "compute_delta", return_value=delta_result)
+
+    assert not ssh_connector._upload_delta(client, remote, delta_target, 0o100755)
+    mock_run_command.assert_called_once()
+
+
+def test_delta_cache(mocker, delta_target):
+    mock_compute = mocker.patch.object(ssh, "compute_delta", return_value=b"delta")
+    cache = ssh.DeltaCache()
+    data = delta_target.local_path.read_bytes()
+    expected = (b"delta", len(data), hashlib.sha256(data).hexdigest())
+
+    # Remotes with the same file share the delta
+    assert cache.delta(delta_target, [(1, "abcd")]) == expected
+    assert cache.delta(delta_target, [(1, "abcd")]) == expected
+    assert mock_compute.call_count == 1
+    cache.delta(delta_target, [(2, "ef01")])
+    assert mock_compute.call_count == 2
+
+    # Change of the local file invalidates its deltas
+    delta_target.local_path.write_bytes(data + b"changed")
+    new_data = delta_target.local_path.read_bytes()
+    assert cache.delta(delta_target, [(1, "abcd")]) == (
+        b"delta",
+        len(new_data),
+        hashlib.sha256(new_data).hexdigest(),
+    )
+    assert mock_compute.call_count == 3
+
+
+def test_delta_cache_new_local_path(mocker, delta_target, tmp_path):
+    mocker.patch.object(ssh, "compute_delta", return_value=b"delta")
+    cache = ssh.DeltaCache()
+    cache.delta(delta_target, [(1, "abcd")])
+    # Stripped copy of the next build has a different local path
+    stripped = tmp_path / "stripped"
+    stripped.mkdir()
+    (stripped / delta_target.local_rel_path).write_bytes(b"stripped")
+    rebuilt = dataclasses.replace(delta_target, local_base_path=str(stripped))
+
+    assert cache.delta(rebuilt, [(1, "abcd")])[1] == len(b"stripped")
+    # Deltas of the previous local file are dropped
+    assert list(cache._files) == [delta_target.remote_path]
+    assert cache._files[delta_target.remote_path][0][0] == rebuilt.local_path
+
+
+def test_transfer_target_compressed(mocker, ssh_connector, delta_target):
+    ssh_connector.options = ConnectorOptions(compression="gzip", compression_level=1)
+    mocker.patch("builtins.print")
+    mock_run_command = mocker.patch.object(ssh_connector, "_run_command")
+    mock_stream = mocker.patch.object(ssh, "compressed_stream")
+    stream = mock_stream.return_value.__enter__.return_value
+    remote, client = next(iter(ssh_connector.connections.items()))
+
+    ssh_connector._transfer_target(remote, delta_target)
+
+    local_stat = delta_target.local_path.stat()
+    mock_stream.assert_called_once_with(delta_target.local_path, "gzip", 1)
+    mock_run_command.assert_called_once_with(
+        client,
+        remote,
+        decompress_command("gzip", delta_target, local_stat.st_mode),
+        stdin=stream,
+    )
+    client.open_sftp.assert_not_called()
+
+
+def test_transfer_archive(mocker, ssh_connector, default_targets, tmp_path):
+    archive = tmp_path / "targets.tar"
+    archive.write_bytes(b"archive")
+    mock_run_command = mocker.patch.object(ssh_connector, "_run_command")
+    mocker.patch("builtins.print")
+    remote, client = next(iter(ssh_connector.connections.items()))
+
+    ssh_connector._transfer_archive(remote, archive, default_targets)
+
+    mock_run_command.assert_called_once()
+    extract_call = mock_run_command.call_args
+    assert extract_call.args == (client, remote, extract_command(default_targets))
+    assert extract_call.kwargs["stdin"].name == str(archive)
 
 
 def test_check_remote(mocker, ssh_connector, remote_deployment_path):
@@ -92,10 +424,59 @@ def test_check_remote(mocker, ssh_connector, remote_deployment_path):
 
     expected_calls = []
     for remote, client in ssh_connector.connections.items():
-        expected_calls.append(call(client, remote, f"test -d {remote_deployment_path}"))
+        expected_calls.append(
+            call(client, remote, f"timeout 10 test -d {remote_deployment_path}")
+        )
 
     ssh_connector.check_remote(remote_deployment_path)
-    mock_run_command.assert_has_calls(expected_calls)
+    mock_run_command.assert_has_calls(expected_calls, any_order=True)
+
+
+def test_remote_checksums(mocker, ssh_connector, default_targets):
+    target = next(iter(default_targets))
+    mock_run_command = mocker.patch.object(
+        ssh_connector,
+        "_run_command",
+        return_value=f"abcd  {target.remote_path}\n".encode(),
+    )
+    remote, client = next(iter(ssh_connector.connections.items()))
+
+    checksums = ssh_connector._remote_checksums(remote, default_targets)
+
+    mock_run_command.assert_called_once_with(
+        client, remote, checksum_command(default_targets)
+    )
+    assert checksums[target] == "abcd"
+    assert all(checksums[t] is None for t in default_targets - {target})
+
+
+def test_run_script(mocker, ssh_connector):
+    mock_run_command = mocker.patch.object(ssh_connector, "_run_command")
+    remote, client = next(iter(ssh_connector.connections.items()))
+
+    ssh_connector._run_script(remote, "true")
+
+    mock_run_command.assert_called_once_with(client, remote, "true")
+
+
+def test_forward_target(mocker, ssh_connector, default_targets):
+    mock_run_command = mocker.patch.object(ssh_connector, "_run_command")
+    mocker.patch.object(ssh.os, "stat").return_value.st_mode = 0o100755
+    target = next(iter(default_targets))
+
+    ssh_connector._forward_target("root@vm1", "vm2", target)
+
+    mock_run_command.assert_called_once_with(
+        ssh_connector.connections["root@vm1"],
+        "root@vm1",
+        ssh_forward_command(target, "vm2", 0o100755),
+    )
+
+    mock_run_command.side_effect = ConnectorException("[root@vm1] Failed")
+    with pytest.raises(
+        ConnectorException, match=r"^\[vm2\] Failed to forward file from root@vm1"
+    ):
+        ssh_connector._forward_target("root@vm1", "vm2", target)
 
 
 def test_run_command_rc_zero(ssh_connector):
@@ -109,6 +490,21 @@ def test_run_command_rc_zero(ssh_connector):
     client.exec_command.assert_called_once_with("foo")
 
 
+def test_run_command_stdin(ssh_connector):
+    remote, client = next(iter(ssh_connector.connections.items()))
+    mock_stdin = MagicMock(autospec=ChannelFile)
+    mock_stdout = MagicMock(autospec=ChannelFile)
+    mock_stdout.channel.recv_exit_status.return_value = 0
+    client.exec_command.return_value = (mock_stdin, mock_stdout, None)
+    data = b"x" * (ssh.COPY_BUFSIZE + 1)
+
+    ssh_connector._run_command(client, remote, "foo", stdin=io.BytesIO(data))
+
+    written = b"".join(c.args[0] for c in mock_stdin.write.call_args_list)
+    assert written == data
+    mock_stdin.channel.shutdown_write.assert_called_once()
+
+
 def test_run_command_rc_one(ssh_connector):
     remote, client = next(iter(ssh_connector.connections.items()))
     mock_stderr = MagicMock(autospec=ChannelStderrFile)
@@ -132,11 +528,18 @@ def test_run_command_ssh_err(ssh_connector):
     client.exec_command.assert_called_once_with("foo")
 
 
-def test_teardown(ssh_connector):
+def test_teardown(mocker, ssh_connector):
     assert len(ssh_connector.connections) != 0
+    mock_pools = [
+        mocker.patch.object(pool, "close") for pool in ssh_connector.sftp_pools.values()
+    ]
 
     ssh_connector.teardown()
 
+    for pool_close in mock_pools:
+        pool_close.assert_called_once()
+    assert len(ssh_connector.sftp_pools) == 0
+
     ssh_clients = [client for client in ssh_connector.connections.values()]
     assert len(ssh_connector.connections) == 0
     for client in ssh_clients:
@@ -1,77 +1,88 @@
 import argparse
-from copy import deepcopy
+import dataclasses
+import threading
 from unittest.mock import MagicMock, call, mock_open
 
 import pytest
 
 from microovn_rebuilder import cli
-from microovn_rebuilder.cli import NOT_FOUND_TS
-from microovn_rebuilder.remote import BaseConnector, ConnectorException
-from microovn_rebuilder.target import ConfigException
-
-
-@pytest.mark.parametrize("timestamp", [1, NOT_FOUND_TS])
-def test_get_file_timestamps(mocker, timestamp, default_targets):
-    if timestamp == NOT_FOUND_TS:
-        mocker.patch.object(cli.os.path, "getmtime", side_effect=OSError)
-    else:
-        mocker.patch.object(cli.os.path, "getmtime", return_value=timestamp)
-
-    target_ts = cli.get_file_timestamps(default_targets)
-    for target, ts in target_ts.items():
-        assert ts == timestamp
-
-
-def test_get_changed_targets_no_changes(default_targets):
-    old_ts = {target: 1 for target in default_targets}
-    new_ts = deepcopy(old_ts)
+from microovn_rebuilder.daemon import DaemonException
+from microovn_rebuilder.index import ContentIndex
+from microovn_rebuilder.ovn import BuildOptions, make_goals
+from microovn_rebuilder.remote import (
+    BaseConnector,
+    ConnectorException,
+    ConnectorOptions,
+    UpdateException,
+)
+from microovn_rebuilder.report import DeployReport
+from microovn_rebuilder.strip import StripCache
+from microovn_rebuilder.target import ConfigException, Target
+from microovn_rebuilder.watcher import SourceWatcher, WatcherException
+
+
+def test_get_changed_targets(default_targets):
+    changed = set(list(default_targets)[:2])
+    index = MagicMock(spec=ContentIndex)
+    index.is_changed.side_effect = lambda target, remotes: target in changed
+    remotes = ["vm1", "vm2"]
+
+    assert cli.get_changed_targets(default_targets, index, remotes) == changed
+    index.is_changed.assert_has_calls(
+        [call(target, remotes) for target in default_targets], any_order=True
+    )
 
-    changed_targets = cli.get_changed_targets(old_ts, new_ts)
 
-    assert len(changed_targets) == 0
+def test_update_targets(default_targets):
+    connector_mock = MagicMock(spec=BaseConnector)
+    connector_mock.remotes = ["vm1", "vm2"]
+    index = MagicMock(spec=ContentIndex)
+    cli.update_targets(default_targets, connector_mock, index)
+    connector_mock.update_many.assert_called_once_with(default_targets, None)
+    index.mark_deployed.assert_has_calls(
+        [call(target, connector_mock.remotes) for target in default_targets],
+        any_order=True,
+    )
 
 
-def test_get_changed_targets_with_changes(default_targets):
-    old_ts = {target: 1 for target in default_targets}
-    new_ts = {target: 2 for target in default_targets}
+def test_update_targets_failure_not_marked(default_targets):
+    connector_mock = MagicMock(spec=BaseConnector)
+    connector_mock.update_many.side_effect = ConnectorException()
+    index = MagicMock(spec=ContentIndex)
 
-    changed_targets = cli.get_changed_targets(old_ts, new_ts)
-    assert changed_targets == default_targets
+    with pytest.raises(ConnectorException):
+        cli.update_targets(default_targets, connector_mock, index)
 
+    index.mark_deployed.assert_not_called()
 
-def test_get_changed_targets_file_removed(default_targets):
-    old_ts = {target: 1 for target in default_targets}
-    new_ts = {target: NOT_FOUND_TS for target in default_targets}
 
-    changed_targets = cli.get_changed_targets(old_ts, new_ts)
-    assert len(changed_targets) == 0
+def test_update_targets_partial_failure(default_targets):
+    connector_mock = MagicMock(spec=BaseConnector)
+    connector_mock.remotes = ["vm1", "vm2"]
+    connector_mock.update_many.side_effect = UpdateException("[vm1] failed", ["vm2"])
+    index = MagicMock(spec=ContentIndex)
 
+    with pytest.raises(UpdateException):
+        cli.update_targets(default_targets, connector_mock, index)
 
-def test_update_targets(default_targets):
-    connector_mock = MagicMock(spec=BaseConnector)
-    cli.update_targets(default_targets, connector_mock)
-    connector_mock.update.assert_has_calls([call(target) for target in default_targets])
+    # Only remotes updated despite the failure are marked
+    index.mark_deployed.assert_has_calls(
+        [call(target, ["vm2"]) for target in default_targets], any_order=True
+    )
+    assert index.mark_deployed.call_count == len(default_targets)
 
 
 @pytest.mark.parametrize("targets_changed", [True, False])
 def test_watch(mocker, default_targets, local_ovn_path, targets_changed):
-    initial_ts_1 = MagicMock(spec=set)
-    initial_ts_2 = MagicMock(spec=set)
-    current_ts_1 = MagicMock(spec=set)
-    current_ts_2 = MagicMock(spec=set)
-
-    first_run_ts = [initial_ts_1, current_ts_1]
-    second_run_ts = [initial_ts_2, current_ts_2]
-    # Since 'watch' is a function with infinite loop, we'll raise KeyboardInterrupt on the third pass
-    get_ts_returns = [*first_run_ts, *second_run_ts, KeyboardInterrupt]
-
-    concurrent_build_jobs = 10
+    build_options = BuildOptions(jobs=10)
+    report = MagicMock(spec=DeployReport)
     connector = MagicMock(spec=BaseConnector)
+    connector.remotes = ["vm1", "vm2"]
+    connector.strip_cache = None
+    index = MagicMock(spec=ContentIndex)
 
-    mock_get_file_timestamps = mocker.patch.object(
-        cli, "get_file_timestamps", side_effect=get_ts_returns
-    )
-    mocker.patch("builtins.input")
+    # Since 'watch' is a function with infinite loop, we'll raise KeyboardInterrupt on the third pass
+    mocker.patch("builtins.input", side_effect=["", "", KeyboardInterrupt])
     mock_rebuild = mocker.patch.object(cli, "rebuild", return_value=True)
     mock_update_targets = mocker.patch.object(cli, "update_targets")
     mock_print = mocker.patch("builtins.print")
@@ -84,58 +95,611 @@ def test_watch(mocker, default_targets, local_ovn_path, targets_changed):
     else:
         mock_get_changed_targets.return_value = set()
 
-    cli.watch(default_targets, connector, local_ovn_path, concurrent_build_jobs)
+    cli.watch(default_targets, connector, local_ovn_path, build_options, index, report)
 
-    # get_file_timestamps is called two times per loop, we loop twice and on the
-    # third run we raise KeyboardInterrupt to break loop.
-    mock_get_file_timestamps.assert_has_calls(
-        [call(default_targets) for _ in range((2 * 2) + 1)]
-    )
+    index.seed.assert_called_once_with(default_targets, connector.remotes)
     mock_rebuild.assert_has_calls(
-        [call(local_ovn_path, concurrent_build_jobs) for _ in range(2)]
+        [call(local_ovn_path, build_options, cancel=None) for _ in range(2)]
     )
     mock_get_changed_targets.assert_has_calls(
-        [call(*first_run_ts), call(*second_run_ts)]
+        [call(default_targets, index, connector.remotes) for _ in range(2)]
     )
+    # Index is saved after seeding and after each deployment
+    assert index.save.call_count == 3
+    status = "deployed" if targets_changed else "no changes"
+    report.finish_cycle.assert_has_calls([call(status) for _ in range(2)])
+    report.add.assert_called_with(connector.collect_timings.return_value)
 
     if targets_changed:
         mock_update_targets.assert_has_calls(
-            [call(changed_targets, connector) for _ in range(2)]
+            [call(changed_targets, connector, index, None) for _ in range(2)]
         )
         mock_print.assert_has_calls([call()])
     else:
         mock_update_targets.assert_not_called()
         print_calls = [call("[local] No changes in watched files") for _ in range(2)]
         print_calls.append(call())
-        mock_print.assert_has_calls([call()])
+        mock_print.assert_has_calls(print_calls)
 
     connector.teardown.assert_called_once()
 
 
 def test_watch_rebuild_failed(mocker, default_targets, local_ovn_path):
-    mock_get_file_timestamps = mocker.patch.object(cli, "get_file_timestamps")
     mock_get_changed_targets = mocker.patch.object(cli, "get_changed_targets")
     mock_update_targets = mocker.patch.object(cli, "update_targets")
-    mocker.patch("builtins.input")
+    mocker.patch("builtins.input", return_value="")
 
     # Throwing in KeyboardInterrupt from the second call to break infinite loop in 'watch'
     mock_rebuild = mocker.patch.object(
         cli, "rebuild", side_effect=[False, KeyboardInterrupt]
     )
 
-    concurrent_build_jobs = 10
+    build_options = BuildOptions(jobs=10)
+    report = MagicMock(spec=DeployReport)
     connector = MagicMock(spec=BaseConnector)
+    connector.remotes = ["vm1"]
+    connector.strip_cache = None
+    index = MagicMock(spec=ContentIndex)
 
-    cli.watch(default_targets, connector, local_ovn_path, concurrent_build_jobs)
+    cli.watch(default_targets, connector, local_ovn_path, build_options, index, report)
 
-    mock_rebuild.assert_has_calls([call(local_ovn_path, concurrent_build_jobs)])
+    mock_rebuild.assert_has_calls([call(local_ovn_path, build_options, cancel=None)])
 
     # After rebuild returns False, no updates should occur.
     mock_get_changed_targets.assert_not_called()
     mock_update_targets.assert_not_called()
+    report.finish_cycle.assert_called_once_with("build failed")
+    connector.teardown.assert_called_once()
+
+
+def test_watch_deploy_failed(mocker, default_targets, local_ovn_path):
+    mocker.patch("builtins.input", side_effect=["", "", KeyboardInterrupt])
+    mocker.patch.object(cli, "rebuild", return_value=True)
+    connector_error = ConnectorException("[vm1] Failed")
+    mock_deploy = mocker.patch.object(
+        cli, "deploy", side_effect=[connector_error, False]
+    )
+    mock_print = mocker.patch("builtins.print")
+    connector = MagicMock(spec=BaseConnector)
+    connector.remotes = ["vm1"]
+    connector.strip_cache = None
+    index = MagicMock(spec=ContentIndex)
+    report = MagicMock(spec=DeployReport)
+
+    cli.watch(
+        default_targets,
+        connector,
+        local_ovn_path,
+        BuildOptions(jobs=10),
+        index,
+        report,
+    )
+
+    # Failed deployment does not end the session, next one is attempted
+    assert mock_deploy.call_count == 2
+    mock_print.assert_any_call(connector_error)
     connector.teardown.assert_called_once()
 
 
+def test_watch_auto(mocker, default_targets, local_ovn_path):
+    connector = MagicMock(spec=BaseConnector)
+    connector.remotes = ["vm1"]
+    index = MagicMock(spec=ContentIndex)
+    watcher = MagicMock(spec=SourceWatcher)
+    watcher.changed = MagicMock()
+    # First change deploys successfully, second cancels build, third deployment
+    # fails, fourth pass exits the loop.
+    watcher.wait.side_effect = [{"a.c"}, {"b.c"}, {"c.c"}, KeyboardInterrupt]
+    mock_rebuild = mocker.patch.object(cli, "rebuild", side_effect=[True, False, True])
+    connector_error = ConnectorException("[vm1] Failed")
+    mock_deploy = mocker.patch.object(
+        cli, "deploy", side_effect=[False, connector_error]
+    )
+    mock_print = mocker.patch("builtins.print")
+    debounce = 0.5
+    build_options = BuildOptions(jobs=4)
+    report = MagicMock(spec=DeployReport)
+
+    cli.watch_auto(
+        default_targets,
+        connector,
+        local_ovn_path,
+        build_options,
+        index,
+        report,
+        watcher,
+        0.5,
+    )
+
+    index.seed.assert_called_once_with(default_targets, connector.remotes)
+    watcher.start.assert_called_once()
+    watcher.wait.assert_has_calls([call(debounce) for _ in range(4)])
+    mock_rebuild.assert_has_calls(
+        [call(local_ovn_path, build_options, cancel=watcher.changed) for _ in range(3)]
+    )
+    mock_deploy.assert_has_calls(
+        [call(default_targets, connector, index, report, None)] * 2
+    )
+    mock_print.assert_any_call(connector_error)
+    report.finish_cycle.assert_has_calls(
+        [call("no changes"), call("build failed"), call("failed")]
+    )
+    watcher.stop.assert_called_once()
+    connector.teardown.assert_called_once()
+
+
+def test_deploy_staged(mocker, default_targets):
+    connector = MagicMock(spec=BaseConnector)
+    connector.remotes = ["vm1"]
+    index = MagicMock(spec=ContentIndex)
+    mocker.patch.object(cli, "get_changed_targets", return_value=default_targets)
+    mock_update_targets = mocker.patch.object(cli, "update_targets")
+    staged = set(list(default_targets)[:1])
+    report = MagicMock(spec=DeployReport)
+
+    assert cli.deploy(default_targets, connector, index, report, staged)
+
+    index.expand.assert_called_once_with(default_targets)
+    mock_update_targets.assert_called_once_with(
+        default_targets, connector, index, staged
+    )
+    index.save.assert_called_once()
+    report.timed.assert_called_once_with("detect")
+
+
+@pytest.mark.parametrize("built", [True, False])
+def test_build_and_deploy_pipeline(mocker, default_targets, local_ovn_path, built):
+    connector = MagicMock(spec=BaseConnector)
+    index = MagicMock(spec=ContentIndex)
+    build_options = BuildOptions(pipeline=True)
+    cancel = MagicMock()
+    mock_shipper_class = mocker.patch.object(cli, "TargetShipper")
+    shipper = mock_shipper_class.return_value
+    mock_rebuild = mocker.patch.object(cli, "rebuild", return_value=built)
+    mock_deploy = mocker.patch.object(cli, "deploy")
+    report = MagicMock(spec=DeployReport)
+
+    cli.build_and_deploy(
+        default_targets, connector, local_ovn_path, build_options, index, report, cancel
+    )
+
+    mock_shipper_class.assert_called_once_with(default_targets, connector, index)
+    shipper.start.assert_called_once()
+    mock_rebuild.assert_called_once_with(local_ovn_path, build_options, cancel=cancel)
+    shipper.stop.assert_called_once()
+    if built:
+        mock_deploy.assert_called_once_with(
+            default_targets, connector, index, report, shipper.shipped.return_value
+        )
+    else:
+        mock_deploy.assert_not_called()
+
+
+def test_build_and_deploy_pipeline_interrupted(mocker, default_targets):
+    mock_shipper_class = mocker.patch.object(cli, "TargetShipper")
+    mocker.patch.object(cli, "rebuild", side_effect=KeyboardInterrupt)
+    report = MagicMock(spec=DeployReport)
+
+    with pytest.raises(KeyboardInterrupt):
+        cli.build_and_deploy(
+            default_targets,
+            MagicMock(spec=BaseConnector),
+            "/tmp/ovn",
+            BuildOptions(pipeline=True),
+            MagicMock(spec=ContentIndex),
+            report,
+        )
+
+    mock_shipper_class.return_value.stop.assert_called_once()
+    report.finish_cycle.assert_not_called()
+
+
+@pytest.mark.parametrize(
+    "deployed, expected", [(True, "deployed"), (False, "no changes")]
+)
+def test_deploy_changes(mocker, default_targets, deployed, expected):
+    mock_deploy = mocker.patch.object(cli, "deploy", return_value=deployed)
+    connector = MagicMock(spec=BaseConnector)
+    index = MagicMock(spec=ContentIndex)
+    report = MagicMock(spec=DeployReport)
+
+    cli.deploy_changes(default_targets, connector, index, report)
+
+    mock_deploy.assert_called_once_with(default_targets, connector, index, report)
+    report.start_cycle.assert_called_once()
+    report.add.assert_called_once_with(connector.collect_timings.return_value)
+    report.finish_cycle.assert_called_once_with(expected)
+
+
+def test_deploy_changes_failure(mocker, default_targets):
+    mocker.patch.object(cli, "deploy", side_effect=ConnectorException())
+    report = MagicMock(spec=DeployReport)
+
+    with pytest.raises(ConnectorException):
+        cli.deploy_changes(
+            default_targets,
+            MagicMock(spec=BaseConnector),
+            MagicMock(spec=ContentIndex),
+            report,
+        )
+
+    report.finish_cycle.assert_called_once_with("failed")
+
+
+@pytest.mark.parametrize(
+    "services, expected",
+    [
+        ([], ["microovn.chassis", "microovn.ovn-northd"]),
+        (["microovn.ovn-northd"], ["microovn.ovn-northd"]),
+    ],
+)
+def test_restart_services(services, expected):
+    targets = {
+        Target(
+            "northd/ovn-northd",
+            "bin/ovn-northd",
+            "/tmp",
+            service="microovn.ovn-northd",
+            ready_check="northd-ready",
+        ),
+        Target(
+            "controller/ovn-controller",
+            "bin/ovn-controller",
+            "/tmp",
+            service="microovn.chassis",
+            ready_check="chassis-ready",
+        ),
+        Target("utilities/ovn-nbctl", "bin/ovn-nbctl", "/tmp"),
+    }
+    connector = MagicMock(spec=BaseConnector)
+    report = MagicMock(spec=DeployReport)
+
+    cli.restart_services(targets, connector, report, services)
+
+    probes = {
+        "microovn.chassis": "chassis-ready",
+        "microovn.ovn-northd": "northd-ready",
+    }
+    connector.restart.assert_called_once_with(
+        expected, [probes[service] for service in expected]
+    )
+    report.finish_cycle.assert_called_once_with("restarted")
+
+
+def test_restart_services_failure(default_targets):
+    connector = MagicMock(spec=BaseConnector)
+    connector.restart.side_effect = ConnectorException()
+    report = MagicMock(spec=DeployReport)
+
+    with pytest.raises(ConnectorException):
+        cli.restart_services(default_targets, connector, report, ["svc"])
+
+    report.finish_cycle.assert_called_once_with("failed")
+
+
+def test_serve(mocker, default_targets):
+    mock_server_class = mocker.patch.object(cli, "ControlServer")
+    server = mock_server_class.return_value
+    server.serve_forever.side_effect = KeyboardInterrupt
+    mock_build = mocker.patch.object(cli, "build_and_deploy")
+    mock_deploy = mocker.patch.object(cli, "deploy_changes")
+    mock_restart = mocker.patch.object(cli, "restart_services")
+    mocker.patch("builtins.print")
+    connector = MagicMock(spec=BaseConnector)
+    connector.remotes = ["vm1", "vm2"]
+    index = MagicMock(spec=ContentIndex)
+    report = MagicMock(spec=DeployReport)
+    report.last = None
+    build_options = BuildOptions()
+
+    cli.serve(
+        default_targets,
+        connector,
+        "/tmp/ovn",
+        build_options,
+        index,
+        report,
+        "/tmp/rebuilder.sock",
+    )
+
+    index.seed.assert_called_once_with(default_targets, connector.remotes)
+    server.cancel_running.assert_called_once_with()
+    server.__exit__.assert_called_once()
+    connector.teardown.assert_called_once()
+    path, commands, status = mock_server_class.call_args.args
+    assert path == "/tmp/rebuilder.sock"
+    assert status() == {"remotes": ["vm1", "vm2"], "result": None}
+
+    def finish(status: str):
+        def run(*args) -> None:
+            report.last = {"status": status}
+
+        return run
+
+    cancel = threading.Event()
+    mock_build.side_effect = finish("build failed")
+    assert commands["build"]([], cancel) == {
+        "ok": False,
+        "result": {"status": "build failed"},
+    }
+    mock_build.assert_called_once_with(
+        default_targets, connector, "/tmp/ovn", build_options, index, report, cancel
+    )
+
+    mock_deploy.side_effect = finish("deployed")
+    assert commands["deploy"]([], cancel) == {
+        "ok": True,
+        "result": {"status": "deployed"},
+    }
+    mock_deploy.assert_called_once_with(default_targets, connector, index, report)
+
+    mock_restart.side_effect = ConnectorException("[vm1] Failed to restart service")
+    assert commands["restart"](["svc"], cancel) == {
+        "ok": False,
+        "error": "[vm1] Failed to restart service",
+        "result": {"status": "deployed"},
+    }
+    mock_restart.assert_called_once_with(default_targets, connector, report, ["svc"])
+
+
+def test_serve_socket_fail(mocker, default_targets):
+    mocker.patch.object(
+        cli, "ControlServer", side_effect=DaemonException("Another daemon")
+    )
+    mocker.patch("builtins.print")
+    connector = MagicMock(spec=BaseConnector)
+    connector.remotes = ["vm1"]
+
+    with pytest.raises(SystemExit):
+        cli.serve(
+            default_targets,
+            connector,
+            "/tmp/ovn",
+            BuildOptions(),
+            MagicMock(spec=ContentIndex),
+            MagicMock(spec=DeployReport),
+            "/tmp/rebuilder.sock",
+        )
+
+    connector.teardown.assert_called_once()
+
+
+@pytest.fixture()
+def sync_targets(tmp_path):
+    targets = set()
+    for name in ("ovn-northd", "ovn-controller"):
+        (tmp_path / name).write_bytes(name.encode())
+        targets.add(Target(name, f"bin/{name}", str(tmp_path), service=name))
+    missing = Target("ovn-nbctl", "bin/ovn-nbctl", str(tmp_path))
+    return targets | {missing}
+
+
+def test_sync(mocker, sync_targets):
+    mocker.patch("builtins.print")
+    by_name = {target.local_rel_path: target for target in sync_targets}
+    northd, controller = by_name["ovn-northd"], by_name["ovn-controller"]
+    index = ContentIndex()
+    report = MagicMock(spec=DeployReport)
+    connector = MagicMock(spec=BaseConnector)
+    connector.remotes = ["vm1", "vm2"]
+    connector.upload_target.side_effect = lambda target: target
+    digests = {t: index.digest(t.local_path) for t in sync_targets}
+    connector.remote_checksums.return_value = {
+        "vm1": {northd: digests[northd], controller: "stale"},
+        "vm2": {northd: digests[northd], controller: digests[controller]},
+    }
+
+    cli.sync(sync_targets, connector, index, report)
+
+    connector.remote_checksums.assert_called_once_with(sync_targets)
+    connector.sync.assert_called_once_with({"vm1": {controller}})
+    for remote in connector.remotes:
+        assert not index.is_changed(northd, [remote])
+        assert not index.is_changed(controller, [remote])
+    report.finish_cycle.assert_called_once_with("synced")
+
+
+def test_sync_in_sync(mocker, sync_targets):
+    mock_print = mocker.patch("builtins.print")
+    index = ContentIndex()
+    report = MagicMock(spec=DeployReport)
+    connector = MagicMock(spec=BaseConnector)
+    connector.upload_target.side_effect = lambda target: target
+    digests = {t: index.digest(t.local_path) for t in sync_targets}
+    connector.remote_checksums.return_value = {"vm1": digests}
+
+    cli.sync(sync_targets, connector, index, report)
+
+    connector.sync.assert_not_called()
+    mock_print.assert_called_once_with("[local] Remote files match local build")
+    report.finish_cycle.assert_called_once_with("in sync")
+
+
+def test_sync_failure(mocker, sync_targets):
+    mocker.patch("builtins.print")
+    index = MagicMock(spec=ContentIndex)
+    report = MagicMock(spec=DeployReport)
+    connector = MagicMock(spec=BaseConnector)
+    connector.remote_checksums.side_effect = ConnectorException()
+
+    with pytest.raises(ConnectorException):
+        cli.sync(sync_targets, connector, index, report)
+
+    index.mark_deployed.assert_not_called()
+    report.finish_cycle.assert_called_once_with("failed")
+
+
+def test_sync_stripped(mocker, sync_targets, tmp_path):
+    mocker.patch("builtins.print")
+    northd = next(t for t in sync_targets if t.local_rel_path == "ovn-northd")
+    stripped = Target("stripped", northd.remote_rel_path, str(tmp_path))
+    (tmp_path / "stripped").write_bytes(b"stripped")
+    index = ContentIndex()
+    report = MagicMock(spec=DeployReport)
+    connector = MagicMock(spec=BaseConnector)
+    connector.upload_target.side_effect = lambda t: stripped if t == northd else t
+    digests = {t: index.digest(t.local_path) for t in sync_targets}
+    digests[northd] = index.digest(stripped.local_path)
+    connector.remote_checksums.return_value = {"vm1": digests}
+
+    cli.sync(sync_targets, connector, index, report)
+
+    # Remote file matches the stripped copy, deployed digest is the local one
+    connector.sync.assert_not_called()
+    assert not index.is_changed(northd, ["vm1"])
+
+
+@pytest.mark.parametrize(
+    "remotes, expected",
+    [
+        ([], {"vm1", "vm2"}),
+        (["vm2"], {"vm2"}),
+    ],
+)
+def test_upload_debug_info(mocker, default_targets, remotes, expected):
+    mock_print = mocker.patch("builtins.print")
+    connector = MagicMock(spec=BaseConnector)
+    connector.remotes = ["vm1", "vm2"]
+    connector.strip_cache = MagicMock(spec=StripCache)
+    debug_targets = {Target("ovn-northd.debug", "bin/ovn-northd.debug", "/cache")}
+    connector.strip_cache.debug_targets.return_value = debug_targets
+
+    cli.upload_debug_info(default_targets, connector, remotes)
+
+    connector.strip_cache.debug_targets.assert_called_once_with(default_targets)
+    connector.sync.assert_called_once_with(
+        {remote: debug_targets for remote in expected}
+    )
+    mock_print.assert_called_once_with("[local] Uploaded debug info of 1 target(s)")
+
+
+@pytest.mark.parametrize(
+    "remotes, strip_cache, debug_targets, message",
+    [
+        (["vm3"], True, None, "[local] Unknown remote host(s): vm3"),
+        ([], False, None, "[local] No stripped targets"),
+        ([], True, set(), "[local] No stripped targets"),
+        ([], True, ConnectorException("[vm1] failed"), "[vm1] failed"),
+    ],
+)
+def test_upload_debug_info_skipped(
+    mocker, default_targets, remotes, strip_cache, debug_targets, message
+):
+    mock_print = mocker.patch("builtins.print")
+    connector = MagicMock(spec=BaseConnector)
+    connector.remotes = ["vm1"]
+    connector.strip_cache = MagicMock(spec=StripCache) if strip_cache else None
+    if isinstance(debug_targets, Exception):
+        connector.strip_cache.debug_targets.return_value = {MagicMock()}
+        connector.sync.side_effect = debug_targets
+    elif debug_targets is not None:
+        connector.strip_cache.debug_targets.return_value = debug_targets
+
+    cli.upload_debug_info(default_targets, connector, remotes)
+
+    mock_print.assert_called_once()
+    assert str(mock_print.call_args.args[0]) == message
+    if not isinstance(debug_targets, Exception):
+        connector.sync.assert_not_called()
+
+
+def test_watch_debug(mocker, default_targets, local_ovn_path):
+    connector = MagicMock(spec=BaseConnector)
+    connector.remotes = ["vm1", "vm2"]
+    connector.strip_cache = MagicMock(spec=StripCache)
+    index = MagicMock(spec=ContentIndex)
+    mock_input = mocker.patch(
+        "builtins.input", side_effect=["debug vm2", KeyboardInterrupt]
+    )
+    mock_upload_debug_info = mocker.patch.object(cli, "upload_debug_info")
+    mock_build_and_deploy = mocker.patch.object(cli, "build_and_deploy")
+    mocker.patch("builtins.print")
+
+    cli.watch(
+        default_targets,
+        connector,
+        local_ovn_path,
+        BuildOptions(),
+        index,
+        MagicMock(spec=DeployReport),
+    )
+
+    assert "debug [HOST...]" in mock_input.call_args.args[0]
+    mock_upload_debug_info.assert_called_once_with(default_targets, connector, ["vm2"])
+    mock_build_and_deploy.assert_not_called()
+
+
+@pytest.mark.parametrize("targeted", [True, False])
+def test_get_build_options(default_targets, targeted):
+    args = argparse.Namespace(jobs=8, targeted=targeted, check_fresh=True, pipeline=True)
+
+    options = cli.get_build_options(args, default_targets)
+
+    assert options.jobs == 8
+    assert options.check_fresh
+    assert options.pipeline
+    if targeted:
+        assert options.goals == make_goals(default_targets)
+    else:
+        assert options.goals == ()
+
+
+@pytest.mark.parametrize(
+    "compress, compress_below, expected_codec",
+    [
+        (None, None, None),
+        ("xz", None, "xz"),
+        ("xz", 10.0, "xz"),
+        (None, 10.0, cli.DEFAULT_CODEC),
+    ],
+)
+def test_get_connector_options(compress, compress_below, expected_codec):
+    args = argparse.Namespace(
+        parallel=4,
+        bulk=True,
+        delta=True,
+        channels=2,
+        compress=compress,
+        compress_level=3,
+        compress_below=compress_below,
+        pre_exec_timeout=5.0,
+        restart_window=2,
+        ready_timeout=30.0,
+        fanout=1,
+        connect_timeout=3.0,
+        skip_unreachable=True,
+    )
+
+    assert cli.get_connector_options(args) == ConnectorOptions(
+        parallel=4,
+        bulk=True,
+        delta=True,
+        channels=2,
+        compression=expected_codec,
+        compression_level=3,
+        compression_threshold=compress_below,
+        pre_exec_timeout=5.0,
+        restart_window=2,
+        ready_timeout=30.0,
+        fanout=1,
+        connect_timeout=3.0,
+        skip_unreachable=True,
+    )
+
+
+@pytest.mark.parametrize("value", ["ssh=2", "lxd-api=10"])
+def test_parse_type_parallel(value):
+    connector_type, count = value.split("=")
+
+    assert cli.parse_type_parallel(value) == (connector_type, int(count))
+
+
+@pytest.mark.parametrize("value", ["ssh", "ssh=", "=2", "ssh=two", "ssh=0"])
+def test_parse_type_parallel_invalid(value):
+    with pytest.raises(argparse.ArgumentTypeError, match="is not valid"):
+        cli.parse_type_parallel(value)
+
+
 def test_main_parse_config_fail(mocker):
     mock_args = MagicMock(spec=argparse.Namespace)
     mock_args.config = MagicMock()
@@ -170,10 +734,12 @@ def test_main_connector_fail(mocker, default_targets):
     mock_args.ovn_src = MagicMock()
     mock_args.remote_path = MagicMock()
     mock_args.hosts = MagicMock()
+    mock_args.use_async = False
+    mock_args.type_parallel = []
     mock_arg_parse = mocker.patch.object(cli, "parse_args", return_value=mock_args)
 
     mock_parse_config = mocker.patch.object(
-        cli, "parse_config", return_value=default_targets
+        cli, "parse_config", return_value=(default_targets, [])
     )
 
     mock_exception = ConnectorException()
@@ -182,6 +748,7 @@ def test_main_connector_fail(mocker, default_targets):
     mock_create_connector = mocker.patch.object(
         cli, "create_connector", return_value=mock_connector
     )
+    mock_get_options = mocker.patch.object(cli, "get_connector_options")
 
     mock_watch = mocker.patch.object(cli, "watch")
     mock_print = mocker.patch("builtins.print")
@@ -193,7 +760,10 @@ def test_main_connector_fail(mocker, default_targets):
     mock_parse_config.assert_called_with(
         mock_args.config, mock_args.ovn_src, mock_args.remote_path
     )
-    mock_create_connector.assert_called_once_with(mock_args.hosts)
+    mock_get_options.assert_called_once_with(mock_args)
+    mock_create_connector.assert_called_once_with(
+        mock_args.hosts, mock_get_options.return_value, mock_args.use_async, {}
+    )
     mock_connector.check_remote.assert_called_once_with(mock_args.remote_path)
 
     mock_print.assert_called_with(
@@ -209,17 +779,30 @@ def test_main_ok(mocker, default_targets):
     mock_args.ovn_src = MagicMock()
     mock_args.remote_path = MagicMock()
     mock_args.hosts = MagicMock()
+    mock_args.use_async = False
+    mock_args.type_parallel = []
     mock_args.jobs = MagicMock()
+    mock_args.index = MagicMock()
+    mock_args.report = MagicMock()
+    mock_args.sync = False
+    mock_args.auto = False
+    mock_args.daemon = False
     mock_arg_parse = mocker.patch.object(cli, "parse_args", return_value=mock_args)
 
     mock_parse_config = mocker.patch.object(
-        cli, "parse_config", return_value=default_targets
+        cli, "parse_config", return_value=(default_targets, [])
     )
 
     mock_connector = MagicMock(spec=BaseConnector)
     mock_create_connector = mocker.patch.object(
         cli, "create_connector", return_value=mock_connector
     )
+    mock_get_options = mocker.patch.object(cli, "get_connector_options")
+    mock_build_options = mocker.patch.object(cli, "get_build_options")
+
+    mock_index = MagicMock(spec=ContentIndex)
+    mock_index_class = mocker.patch.object(cli, "ContentIndex", return_value=mock_index)
+    mock_report_class = mocker.patch.object(cli, "DeployReport")
 
     mock_watch = mocker.patch.object(cli, "watch")
     mock_print = mocker.patch("builtins.print")
@@ -230,9 +813,196 @@ def test_main_ok(mocker, default_targets):
     mock_parse_config.assert_called_with(
         mock_args.config, mock_args.ovn_src, mock_args.remote_path
     )
-    mock_create_connector.assert_called_once_with(mock_args.hosts)
+    mock_get_options.assert_called_once_with(mock_args)
+    mock_create_connector.assert_called_once_with(
+        mock_args.hosts, mock_get_options.return_value, mock_args.use_async, {}
+    )
     mock_connector.check_remote.assert_called_once_with(mock_args.remote_path)
 
+    mock_index_class.assert_called_once_with(mock_args.index)
+    mock_index.load.assert_called_once()
+    mock_index.expand.assert_called_once_with(default_targets)
+
+    mock_build_options.assert_called_once_with(mock_args, default_targets)
     mock_watch.assert_called_with(
-        default_targets, mock_connector, mock_args.ovn_src, mock_args.jobs
+        default_targets,
+        mock_connector,
+        mock_args.ovn_src,
+        mock_build_options.return_value,
+        mock_index,
+        mock_report_class.return_value,
     )
+    mock_report_class.assert_called_once_with(mock_args.report)
+
+
+@pytest.mark.parametrize("strip", [True, False])
+def test_main_strip_cache(mocker, default_targets, strip):
+    targets = {dataclasses.replace(t, strip=strip) for t in default_targets}
+    mock_args = MagicMock(spec=argparse.Namespace)
+    mock_args.config = MagicMock()
+    mock_args.ovn_src = MagicMock()
+    mock_args.remote_path = MagicMock()
+    mock_args.hosts = MagicMock()
+    mock_args.use_async = False
+    mock_args.type_parallel = []
+    mock_args.index = MagicMock()
+    mock_args.report = None
+    mock_args.sync = False
+    mock_args.auto = False
+    mock_args.daemon = False
+    mocker.patch.object(cli, "parse_args", return_value=mock_args)
+    mocker.patch.object(cli, "parse_config", return_value=(targets, []))
+    mocker.patch.object(cli, "get_connector_options")
+    mocker.patch.object(cli, "get_build_options")
+    mock_connector = MagicMock(spec=BaseConnector)
+    mock_connector.strip_cache = None
+    mocker.patch.object(cli, "create_connector", return_value=mock_connector)
+    mock_index = MagicMock(spec=ContentIndex)
+    mocker.patch.object(cli, "ContentIndex", return_value=mock_index)
+    mocker.patch.object(cli, "DeployReport")
+    mocker.patch.object(cli, "watch")
+
+    cli.main()
+
+    if strip:
+        assert isinstance(mock_connector.strip_cache, StripCache)
+        assert mock_connector.strip_cache.index is mock_index
+    else:
+        assert mock_connector.strip_cache is None
+
+
+@pytest.mark.parametrize("sync_fails", [True, False])
+def test_main_sync(mocker, default_targets, sync_fails):
+    mock_args = MagicMock(spec=argparse.Namespace)
+    mock_args.config = MagicMock()
+    mock_args.ovn_src = MagicMock()
+    mock_args.remote_path = MagicMock()
+    mock_args.hosts = MagicMock()
+    mock_args.use_async = False
+    mock_args.type_parallel = []
+    mock_args.index = MagicMock()
+    mock_args.report = None
+    mock_args.sync = True
+    mock_args.auto = False
+    mock_args.daemon = False
+    mocker.patch.object(cli, "parse_args", return_value=mock_args)
+    mocker.patch.object(cli, "parse_config", return_value=(default_targets, []))
+    mocker.patch.object(cli, "get_connector_options")
+    mocker.patch.object(cli, "get_build_options")
+    mock_connector = MagicMock(spec=BaseConnector)
+    mocker.patch.object(cli, "create_connector", return_value=mock_connector)
+    mock_index = MagicMock(spec=ContentIndex)
+    mocker.patch.object(cli, "ContentIndex", return_value=mock_index)
+    mock_report_class = mocker.patch.object(cli, "DeployReport")
+    mock_sync = mocker.patch.object(cli, "sync")
+    mock_watch = mocker.patch.object(cli, "watch")
+    mock_print = mocker.patch("builtins.print")
+
+    if sync_fails:
+        mock_sync.side_effect = ConnectorException("[vm1] Failed")
+        with pytest.raises(SystemExit):
+            cli.main()
+        mock_print.assert_called_with("Failed to sync remote hosts: [vm1] Failed")
+        mock_connector.teardown.assert_called_once()
+        mock_watch.assert_not_called()
+    else:
+        cli.main()
+        mock_watch.assert_called_once()
+
+    mock_sync.assert_called_once_with(
+        default_targets, mock_connector, mock_index, mock_report_class.return_value
+    )
+
+
+@pytest.mark.parametrize("watcher_fails", [True, False])
+def test_main_auto(mocker, default_targets, watcher_fails):
+    mock_args = MagicMock(spec=argparse.Namespace)
+    mock_args.config = MagicMock()
+    mock_args.remote_path = MagicMock()
+    mock_args.hosts = MagicMock()
+    mock_args.use_async = False
+    mock_args.type_parallel = []
+    mock_args.index = MagicMock()
+    mock_args.report = None
+    mock_args.sync = False
+    mock_args.auto = True
+    mock_args.daemon = False
+    mock_args.debounce = 0.5
+    mock_args.jobs = 4
+    mock_args.ovn_src = "/tmp/ovn"
+    mocker.patch.object(cli, "parse_args", return_value=mock_args)
+    mocker.patch.object(cli, "parse_config", return_value=(default_targets, []))
+    mocker.patch.object(cli, "get_connector_options")
+    mock_build_options = mocker.patch.object(cli, "get_build_options")
+    mock_connector = MagicMock(spec=BaseConnector)
+    mocker.patch.object(cli, "create_connector", return_value=mock_connector)
+    mock_index = MagicMock(spec=ContentIndex)
+    mocker.patch.object(cli, "ContentIndex", return_value=mock_index)
+    mock_report_class = mocker.patch.object(cli, "DeployReport")
+    mock_watcher_class = mocker.patch.object(cli, "SourceWatcher")
+    if watcher_fails:
+        mock_watcher_class.side_effect = WatcherException()
+    mock_watch = mocker.patch.object(cli, "watch")
+    mock_watch_auto = mocker.patch.object(cli, "watch_auto")
+    mocker.patch("builtins.print")
+
+    if watcher_fails:
+        with pytest.raises(SystemExit):
+            cli.main()
+        mock_connector.teardown.assert_called_once()
+        mock_watch_auto.assert_not_called()
+    else:
+        cli.main()
+        mock_watch_auto.assert_called_once_with(
+            default_targets,
+            mock_connector,
+            mock_args.ovn_src,
+            mock_build_options.return_value,
+            mock_index,
+            mock_report_class.return_value,
+            mock_watcher_class.return_value,
+            mock_args.debounce,
+        )
+
+    mock_watcher_class.assert_called_once_with(mock_args.ovn_src)
+    mock_watch.assert_not_called()
+
+
+def test_main_daemon(mocker, default_targets):
+    mock_args = MagicMock(spec=argparse.Namespace)
+    mock_args.config = MagicMock()
+    mock_args.remote_path = MagicMock()
+    mock_args.hosts = MagicMock()
+    mock_args.use_async = False
+    mock_args.type_parallel = []
+    mock_args.index = MagicMock()
+    mock_args.report = None
+    mock_args.sync = False
+    mock_args.auto = False
+    mock_args.daemon = True
+    mock_args.socket = "/tmp/rebuilder.sock"
+    mock_args.ovn_src = "/tmp/ovn"
+    mocker.patch.object(cli, "parse_args", return_value=mock_args)
+    mocker.patch.object(cli, "parse_config", return_value=(default_targets, []))
+    mocker.patch.object(cli, "get_connector_options")
+    mock_build_options = mocker.patch.object(cli, "get_build_options")
+    mock_connector = MagicMock(spec=BaseConnector)
+    mocker.patch.object(cli, "create_connector", return_value=mock_connector)
+    mock_index = MagicMock(spec=ContentIndex)
+    mocker.patch.object(cli, "ContentIndex", return_value=mock_index)
+    mock_report_class = mocker.patch.object(cli, "DeployReport")
+    mock_serve = mocker.patch.object(cli, "serve")
+    mock_watch = mocker.patch.object(cli, "watch")
+
+    cli.main()
+
+    mock_serve.assert_called_once_with(
+        default_targets,
+        mock_connector,
+        mock_args.ovn_src,
+        mock_build_options.return_value,
+        mock_index,
+        mock_report_class.return_value,
+        mock_args.socket,
+    )
+    mock_watch.assert_not_called()
@@ -0,0 +1,232 @@
+import json
+import os
+import socket
+import stat
+import sys
+import threading
+
+import pytest
+
+from microovn_rebuilder import daemon
+from microovn_rebuilder.daemon import (
+    ControlServer,
+    DaemonException,
+    default_socket_path,
+    send_command,
+)
+from microovn_rebuilder.remote import ConnectorException
+
+
+@pytest.fixture()
+def socket_path(tmp_path) -> str:
+    return str(tmp_path / "rebuilder.sock")
+
+
+@pytest.fixture()
+def make_server(socket_path):
+    servers = []
+
+    def make(commands, status=lambda: {}) -> ControlServer:
+        server = ControlServer(socket_path, commands, status)
+        thread = threading.Thread(
+            target=server.serve_forever, kwargs={"poll_interval": 0.01}, daemon=True
+        )
+        thread.start()
+        servers.append((server, thread))
+        return server
+
+    yield make
+    for server, thread in servers:
+        server.shutdown()
+        server.server_close()
+        thread.join()
+
+
+@pytest.mark.parametrize(
+    "runtime_dir, expected", [(None, "/tmp"), ("/run/user/7", "/run/user/7")]
+)
+def test_default_socket_path(monkeypatch, runtime_dir, expected):
+    monkeypatch.delenv("XDG_RUNTIME_DIR", raising=False)
+    if runtime_dir:
+        monkeypatch.setenv("XDG_RUNTIME_DIR", runtime_dir)
+
+    assert default_socket_path() == f"{expected}/microovn-rebuilder-{os.getuid()}.sock"
+
+
+def test_command(make_server, socket_path):
+    make_server({"restart": lambda args, cancel: {"services": args}})
+
+    response = send_command(socket_path, ["restart", "microovn.ovn northd"])
+
+    assert response == {"ok": True, "services": ["microovn.ovn northd"]}
+    # Only the owner can send commands
+    assert stat.S_IMODE(os.stat(socket_path).st_mode) & 0o077 == 0
+
+
+def test_status_while_running(make_server, socket_path):
+    started = threading.Event()
+    release = threading.Event()
+
+    def build(args, cancel):
+        started.set()
+        release.wait(timeout=5)
+        return {"result": "deployed"}
+
+    server = make_server({"build": build}, status=lambda: {"result": "last"})
+    responses = []
+    client = threading.Thread(
+        target=lambda: responses.append(send_command(socket_path, ["build"]))
+    )
+    client.start()
+    assert started.wait(timeout=5)
+
+    # Status is answered while the build is still running
+    assert send_command(socket_path, ["status"]) == {
+        "ok": True,
+        "running": "build",
+        "result": "last",
+    }
+    release.set()
+    client.join()
+
+    assert responses == [{"ok": True, "result": "deployed"}]
+    assert server.running is None
+
+
+def test_commands_run_one_at_a_time(make_server, socket_path):
+    running = []
+    overlapped = []
+
+    def deploy(args, cancel):
+        running.append(args)
+        overlapped.append(len(running) > 1)
+        threading.Event().wait(0.05)
+        running.remove(args)
+        return {}
+
+    make_server({"deploy": deploy})
+    clients = [
+        threading.Thread(target=send_command, args=(socket_path, ["deploy", str(i)]))
+        for i in range(3)
+    ]
+    for client in clients:
+        client.start()
+    for client in clients:
+        client.join()
+
+    assert overlapped == [False, False, False]
+
+
+def test_cancel_running(make_server, socket_path):
+    started = threading.Event()
+    finished = []
+
+    def build(args, cancel):
+        started.set()
+        # Stands in for the build, which stops once it is cancelled
+        assert cancel.wait(timeout=5)
+        finished.append(True)
+        return {"result": "build failed"}
+
+    server = make_server({"build": build})
+    responses = []
+    client = threading.Thread(
+        target=lambda: responses.append(send_command(socket_path, ["build"]))
+    )
+    client.start()
+    assert started.wait(timeout=5)
+
+    server.cancel_running()
+
+    # Running command finished before cancel_running returned
+    assert finished == [True]
+    client.join()
+    assert responses == [{"ok": True, "result": "build failed"}]
+    assert server.execute("build") == {"ok": False, "error": "Daemon is shutting down"}
+
+
+@pytest.mark.parametrize(
+    "line, error",
+    [
+        ("", "Empty command"),
+        ("build 'unterminated", "Invalid command: No closing quotation"),
+        ("rebuild", "Unknown command 'rebuild'. Available commands: status, build"),
+        ("build fail", "[vm1] Failed"),
+    ],
+)
+def test_command_errors(socket_path, line, error):
+    def build(args, cancel):
+        raise ConnectorException("[vm1] Failed")
+
+    server = ControlServer(socket_path, {"build": build}, lambda: {})
+    with server:
+        assert server.execute(line) == {"ok": False, "error": error}
+
+
+def test_server_close_removes_socket(socket_path):
+    server = ControlServer(socket_path, {}, lambda: {})
+    os.unlink(socket_path)
+    server.server_close()
+
+    with ControlServer(socket_path, {}, lambda: {}):
+        assert os.path.exists(socket_path)
+    assert not os.path.exists(socket_path)
+
+
+def test_stale_socket(socket_path):
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as stale:
+        stale.bind(socket_path)
+
+    with ControlServer(socket_path, {}, lambda: {}):
+        with pytest.raises(DaemonException, match="already listening"):
+            ControlServer(socket_path, {}, lambda: {})
+
+
+def test_not_a_socket(socket_path):
+    with open(socket_path, "w") as f:
+        f.write("keep")
+
+    with pytest.raises(DaemonException, match="is not a socket"):
+        ControlServer(socket_path, {}, lambda: {})
+
+    with open(socket_path) as f:
+        assert f.read() == "keep"
+
+
+def test_send_command_no_response(mocker, make_server, socket_path):
+    # Daemon reads the command, but closes the connection without a response
+    mocker.patch.object(
+        daemon._ControlHandler, "handle", lambda self: self.rfile.readline()
+    )
+    make_server({})
+
+    with pytest.raises(DaemonException, match="Invalid response from daemon"):
+        send_command(socket_path, ["status"])
+
+
+@pytest.mark.parametrize("ok", [True, False])
+def test_control_main(mocker, monkeypatch, make_server, socket_path, ok):
+    make_server({"deploy": lambda args, cancel: {"ok": ok}})
+    monkeypatch.setattr(sys, "argv", ["ctl", "--socket", socket_path, "deploy"])
+    mock_print = mocker.patch("builtins.print")
+
+    if ok:
+        daemon.control_main()
+    else:
+        with pytest.raises(SystemExit):
+            daemon.control_main()
+
+    (printed,) = mock_print.call_args.args
+    assert json.loads(printed) == {"ok": ok}
+
+
+def test_control_main_no_daemon(mocker, monkeypatch, socket_path):
+    monkeypatch.setattr(sys, "argv", ["ctl", "--socket", socket_path, "status"])
+    mock_print = mocker.patch("builtins.print")
+
+    with pytest.raises(SystemExit):
+        daemon.control_main()
+
+    assert mock_print.call_args.args[0].startswith(
+        f"Failed to send command to daemon at {socket_path}"
+    )
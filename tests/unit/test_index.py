@@ -0,0 +1,263 @@
+import hashlib
+import os
+from pathlib import Path
+
+import pytest
+
+from microovn_rebuilder import index as index_module
+from microovn_rebuilder.index import ContentIndex, FileRecord, default_index_path
+from microovn_rebuilder.target import Target, TargetPattern
+
+
+@pytest.fixture()
+def target(tmp_path) -> Target:
+    (tmp_path / "northd").mkdir()
+    (tmp_path / "northd" / "ovn-northd").write_bytes(b"northd v1")
+    return Target(
+        local_rel_path="northd/ovn-northd",
+        remote_rel_path="bin/ovn-northd",
+        local_base_path=str(tmp_path),
+        service="microovn.ovn-northd",
+    )
+
+
+@pytest.mark.parametrize("xdg_cache", ["/tmp/xdg", None])
+def test_default_index_path(monkeypatch, xdg_cache):
+    if xdg_cache:
+        monkeypatch.setenv("XDG_CACHE_HOME", xdg_cache)
+        expected_base = Path(xdg_cache)
+    else:
+        monkeypatch.delenv("XDG_CACHE_HOME", raising=False)
+        expected_base = Path.home() / ".cache"
+
+    assert default_index_path() == expected_base / "microovn-rebuilder" / "index.json"
+
+
+def test_digest(target):
+    index = ContentIndex()
+    expected = hashlib.sha256(b"northd v1").hexdigest()
+
+    assert index.digest(target.local_path) == expected
+    assert index.files[str(target.local_path)].digest == expected
+
+
+def test_digest_missing_file(tmp_path):
+    index = ContentIndex()
+    missing = tmp_path / "missing"
+    index.files[str(missing)] = FileRecord(1, 2, 3, "stale")
+
+    assert index.digest(missing) is None
+    assert str(missing) not in index.files
+
+
+def test_digest_unreadable_file(mocker, target):
+    mocker.patch.object(index_module, "hash_file", side_effect=OSError)
+    index = ContentIndex()
+
+    assert index.digest(target.local_path) is None
+
+
+def test_digest_rehash_only_on_stat_change(mocker, target):
+    index = ContentIndex()
+    mock_hash = mocker.patch.object(
+        index_module, "hash_file", wraps=index_module.hash_file
+    )
+
+    first = index.digest(target.local_path)
+    assert index.digest(target.local_path) == first
+    mock_hash.assert_called_once()
+
+    # Relinked file with identical content produces the same digest
+    stat = os.stat(target.local_path)
+    os.utime(target.local_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    assert index.digest(target.local_path) == first
+    assert mock_hash.call_count == 2
+
+    target.local_path.write_bytes(b"northd v2")
+    assert index.digest(target.local_path) != first
+
+
+def test_seed_and_is_changed(target):
+    index = ContentIndex()
+    remotes = ["vm1", "vm2"]
+
+    assert index.is_changed(target, remotes)
+    index.seed([target], remotes)
+    assert not index.is_changed(target, remotes)
+
+    # Seeding does not override known state
+    index.deployed["vm2"][str(target.remote_path)] = "old"
+    index.seed([target], remotes)
+    assert index.is_changed(target, remotes)
+    assert not index.is_changed(target, ["vm1"])
+
+    index.mark_deployed(target, ["vm2"])
+    assert not index.is_changed(target, remotes)
+
+
+def test_is_changed_missing_file(target):
+    index = ContentIndex()
+    target.local_path.unlink()
+
+    assert not index.is_changed(target, ["vm1"])
+
+
+def test_mark_deployed_missing_file(target):
+    index = ContentIndex()
+    target.local_path.unlink()
+
+    index.mark_deployed(target, ["vm1"])
+
+    assert index.deployed == {}
+
+
+def test_save_and_load(tmp_path, target):
+    index_path = tmp_path / "cache" / "index.json"
+    index = ContentIndex(index_path)
+    index.seed([target], ["vm1"])
+    index.save()
+
+    loaded = ContentIndex(index_path)
+    loaded.load()
+
+    assert loaded.files == index.files
+    assert loaded.deployed == index.deployed
+
+
+@pytest.mark.parametrize("content", [None, "{not json", '{"files": {}}', "[]"])
+def test_load_invalid(tmp_path, content):
+    index_path = tmp_path / "index.json"
+    if content is not None:
+        index_path.write_text(content)
+
+    index = ContentIndex(index_path)
+    index.load()
+
+    assert index.files == {}
+    assert index.deployed == {}
+
+
+def test_no_path(target):
+    index = ContentIndex()
+    index.seed([target], ["vm1"])
+
+    # Index without a path is kept only in memory
+    index.save()
+    index.load()
+
+    assert index.deployed
+
+
+def test_list_dir_rescan_only_on_mtime_change(mocker, tmp_path):
+    (tmp_path / "lib").mkdir()
+    (tmp_path / "libovn.so").write_bytes(b"lib")
+    (tmp_path / "link.so").symlink_to(tmp_path / "libovn.so")
+    (tmp_path / "dir-link").symlink_to(tmp_path / "lib")
+    index = ContentIndex()
+    mock_scandir = mocker.patch.object(
+        index_module.os, "scandir", wraps=index_module.os.scandir
+    )
+
+    record = index.list_dir(tmp_path)
+    assert record is not None
+    assert record.files == ("libovn.so",)
+    assert record.links == ("link.so",)
+    assert record.dirs == ("lib",)
+    assert index.list_dir(tmp_path) is record
+    mock_scandir.assert_called_once()
+
+    stat = os.stat(tmp_path)
+    os.utime(tmp_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    rescanned = index.list_dir(tmp_path)
+    assert rescanned is not None and rescanned.files == record.files
+    assert mock_scandir.call_count == 2
+
+
+def test_list_dir_missing(mocker, tmp_path):
+    index = ContentIndex()
+    assert index.list_dir(tmp_path) is not None
+
+    mocker.patch.object(index_module.os, "scandir", side_effect=PermissionError)
+    os.utime(tmp_path, ns=(0, 0))
+    assert index.list_dir(tmp_path) is None
+
+    tmp_path.rmdir()
+    assert index.list_dir(tmp_path) is None
+    assert str(tmp_path) not in index.dirs
+
+
+def test_expand(tmp_path):
+    for path in ["lib/libovn.so", "lib/libovn.a", "utils/ovn-nbctl", "utils/x/tool"]:
+        (tmp_path / path).parent.mkdir(parents=True, exist_ok=True)
+        (tmp_path / path).write_bytes(b"file")
+    base = str(tmp_path)
+    explicit = Target("utils/ovn-nbctl", "bin/ovn-nbctl", base)
+    index = ContentIndex()
+    index.patterns = [
+        TargetPattern(Target("lib/*.so", "lib", base)),
+        TargetPattern(Target("utils/", "bin", base)),
+        TargetPattern(Target("missing/*", "lib", base)),
+        TargetPattern(Target("missing/", "lib", base)),
+    ]
+    targets = {explicit}
+
+    index.expand(targets)
+
+    assert {(t.local_rel_path, t.remote_rel_path) for t in targets} == {
+        ("utils/ovn-nbctl", "bin/ovn-nbctl"),
+        ("lib/libovn.so", "lib/libovn.so"),
+        ("utils/x/tool", "bin/x/tool"),
+    }
+
+    # Removed files are dropped, new files are added and explicit targets kept
+    (tmp_path / "utils" / "x" / "tool").unlink()
+    (tmp_path / "utils" / "ovn-nbctl").unlink()
+    (tmp_path / "lib" / "libovn-new.so").write_bytes(b"file")
+    index.expand(targets)
+
+    assert {t.local_rel_path for t in targets} == {
+        "utils/ovn-nbctl",
+        "lib/libovn.so",
+        "lib/libovn-new.so",
+    }
+
+
+def test_expand_hidden_and_links(tmp_path):
+    for path in [
+        "lib/libovn.so.0.0.0",
+        "lib/.libovn.so.swp",
+        "utils/ovn-nbctl",
+        "utils/.deps/ovn-nbctl.Po",
+        "utils/.hidden",
+        "other/tool",
+    ]:
+        (tmp_path / path).parent.mkdir(parents=True, exist_ok=True)
+        (tmp_path / path).write_bytes(b"file")
+    (tmp_path / "lib" / "libovn.so").symlink_to("libovn.so.0.0.0")
+    (tmp_path / "utils" / "tool").symlink_to("../other/tool")
+    (tmp_path / "utils" / "other").symlink_to("../other")
+    base = str(tmp_path)
+    index = ContentIndex()
+    index.patterns = [
+        TargetPattern(Target("lib/libovn*", "lib", base)),
+        TargetPattern(Target("lib/.libovn*", "lib", base)),
+        TargetPattern(Target("utils/", "bin", base)),
+    ]
+    targets = set()
+
+    index.expand(targets)
+
+    assert {t.local_rel_path for t in targets} == {
+        "lib/libovn.so.0.0.0",
+        "lib/libovn.so",
+        "lib/.libovn.so.swp",
+        "utils/ovn-nbctl",
+    }
+
+
+def test_expand_without_patterns(target):
+    targets = {target}
+
+    ContentIndex().expand(targets)
+
+    assert targets == {target}
@@ -1,4 +1,5 @@
-from subprocess import CompletedProcess
+import subprocess
+import threading
 from unittest.mock import MagicMock, call
 
 import pytest
@@ -8,26 +9,97 @@ from microovn_rebuilder import ovn
 
 @pytest.mark.parametrize("build_rc", [0, 1])
 def test_rebuild_pass(mocker, build_rc, local_ovn_path):
-    mock_result = MagicMock(autospec=CompletedProcess)
-    mock_result.returncode = build_rc
-    mock_result.stdout = b"STDOUT"
-    mock_result.stderr = b"STDERR"
+    mock_process = MagicMock(spec=subprocess.Popen)
+    mock_process.returncode = build_rc
+    mock_process.communicate.return_value = (b"STDOUT", b"STDERR")
 
     mock_print = mocker.patch("builtins.print")
-    mock_run = mocker.patch.object(ovn.subprocess, "run", return_value=mock_result)
+    mock_popen = mocker.patch.object(ovn.subprocess, "Popen", return_value=mock_process)
+    mock_run = mocker.patch.object(ovn.subprocess, "run")
     parallel_jobs = 10
 
-    build_success = ovn.rebuild(local_ovn_path, parallel_jobs)
+    build_success = ovn.rebuild(local_ovn_path, ovn.BuildOptions(jobs=parallel_jobs))
 
     assert build_success == (not bool(build_rc))
-    mock_run.assert_called_once_with(
-        ["make", f"-j{parallel_jobs}"], cwd=local_ovn_path, capture_output=True
+    mock_run.assert_not_called()
+    mock_popen.assert_called_once_with(
+        ["make", f"-j{parallel_jobs}"],
+        cwd=local_ovn_path,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        start_new_session=True,
     )
 
     if not build_success:
-        mock_print.assert_has_calls(
-            [
-                call(mock_result.stdout.decode("utf-8")),
-                call(mock_result.stderr.decode("utf-8")),
-            ]
-        )
+        mock_print.assert_has_calls([call("STDOUT"), call("STDERR")])
+
+
+@pytest.mark.parametrize("cancelled", [True, False])
+def test_rebuild_cancel(mocker, local_ovn_path, cancelled):
+    mock_process = MagicMock(spec=subprocess.Popen)
+    mock_process.pid = 1234
+    mock_process.returncode = 0
+    timeout = subprocess.TimeoutExpired("make", ovn.CANCEL_POLL_INTERVAL)
+    mock_process.communicate.side_effect = [timeout, (b"", b""), (b"", b"")]
+    mocker.patch.object(ovn.subprocess, "Popen", return_value=mock_process)
+    mock_killpg = mocker.patch.object(ovn.os, "killpg")
+    mock_print = mocker.patch("builtins.print")
+    cancel = threading.Event()
+    if cancelled:
+        cancel.set()
+
+    assert ovn.rebuild(local_ovn_path, ovn.BuildOptions(), cancel) != cancelled
+
+    if cancelled:
+        mock_killpg.assert_called_once_with(1234, ovn.signal.SIGTERM)
+        mock_print.assert_called_with("[local] Build cancelled")
+    else:
+        mock_killpg.assert_not_called()
+
+
+def test_rebuild_interrupted(mocker, local_ovn_path):
+    mock_process = MagicMock(spec=subprocess.Popen)
+    mock_process.pid = 1234
+    mock_process.communicate.side_effect = [KeyboardInterrupt, (b"", b"")]
+    mocker.patch.object(ovn.subprocess, "Popen", return_value=mock_process)
+    mock_killpg = mocker.patch.object(ovn.os, "killpg")
+    mocker.patch("builtins.print")
+
+    with pytest.raises(KeyboardInterrupt):
+        ovn.rebuild(local_ovn_path, ovn.BuildOptions())
+
+    mock_killpg.assert_called_once_with(1234, ovn.signal.SIGTERM)
+
+
+def test_make_goals(default_targets):
+    assert ovn.make_goals(default_targets) == (
+        "controller/ovn-controller",
+        "northd/ovn-northd",
+        "utilities/ovn-appctl",
+        "utilities/ovn-nbctl",
+        "utilities/ovn-sbctl",
+        "utilities/ovn-trace",
+    )
+
+
+@pytest.mark.parametrize("fresh_rc", [0, 1, 2])
+def test_rebuild_targeted(mocker, local_ovn_path, fresh_rc):
+    mock_process = MagicMock(spec=subprocess.Popen)
+    mock_process.returncode = 0
+    mock_process.communicate.return_value = (b"", b"")
+    mock_popen = mocker.patch.object(ovn.subprocess, "Popen", return_value=mock_process)
+    mock_run = mocker.patch.object(ovn.subprocess, "run")
+    mock_run.return_value.returncode = fresh_rc
+    mocker.patch("builtins.print")
+    goals = ("controller/ovn-controller", "northd/ovn-northd")
+    options = ovn.BuildOptions(jobs=4, goals=goals, check_fresh=True)
+
+    assert ovn.rebuild(local_ovn_path, options)
+
+    mock_run.assert_called_once_with(
+        ["make", "-q", *goals], cwd=local_ovn_path, capture_output=True
+    )
+    if fresh_rc == 0:
+        mock_popen.assert_not_called()
+    else:
+        assert mock_popen.call_args.args[0] == ["make", "-j4", *goals]
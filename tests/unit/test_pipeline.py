@@ -0,0 +1,139 @@
+import os
+from unittest.mock import MagicMock
+
+import pytest
+
+from microovn_rebuilder import pipeline
+from microovn_rebuilder.index import ContentIndex
+from microovn_rebuilder.remote import BaseConnector, ConnectorException
+from microovn_rebuilder.target import Target
+
+
+@pytest.fixture()
+def targets(tmp_path):
+    (tmp_path / "northd").mkdir()
+    (tmp_path / "northd" / "ovn-northd").write_bytes(b"old northd")
+    return {
+        Target("northd/ovn-northd", "bin/ovn-northd", str(tmp_path), service="n"),
+        Target("controller/ovn-controller", "bin/ovn-controller", str(tmp_path)),
+    }
+
+
+@pytest.fixture()
+def connector():
+    connector = MagicMock(spec=BaseConnector)
+    connector.remotes = ["vm1"]
+    return connector
+
+
+@pytest.fixture()
+def clock(mocker):
+    clock = MagicMock(return_value=100.0)
+    mocker.patch.object(pipeline.time, "monotonic", clock)
+    return clock
+
+
+def _write(target, data):
+    target.local_path.parent.mkdir(exist_ok=True)
+    target.local_path.write_bytes(data)
+
+
+def _by_name(targets, name):
+    return next(t for t in targets if t.local_rel_path.endswith(name))
+
+
+def test_ship_stable_targets(mocker, targets, connector, clock):
+    mocker.patch("builtins.print")
+    index = MagicMock(spec=ContentIndex)
+    index.is_changed.return_value = True
+    shipper = pipeline.TargetShipper(targets, connector, index)
+    shipper._baseline = {t: pipeline._signature(t) for t in targets}
+    northd = _by_name(targets, "ovn-northd")
+    controller = _by_name(targets, "ovn-controller")
+
+    # Files unchanged since the build started are not uploaded
+    shipper.poll()
+    clock.return_value += pipeline.STABLE_AFTER
+    shipper.poll()
+    connector.stage.assert_not_called()
+
+    # Newly written files are uploaded once they stop changing
+    _write(northd, b"new northd")
+    _write(controller, b"new controller")
+    shipper.poll()
+    connector.stage.assert_not_called()
+
+    clock.return_value += pipeline.STABLE_AFTER / 2
+    _write(controller, b"newer controller")
+    os.utime(controller.local_path, ns=(1, 1))
+    shipper.poll()
+    connector.stage.assert_not_called()
+
+    clock.return_value += pipeline.STABLE_AFTER / 2
+    shipper.poll()
+    connector.stage.assert_called_once_with({northd})
+
+    clock.return_value += pipeline.STABLE_AFTER
+    shipper.poll()
+    connector.stage.assert_called_with({controller})
+    assert connector.stage.call_count == 2
+
+    # Uploaded files are not uploaded again, unless they change
+    clock.return_value += pipeline.STABLE_AFTER
+    shipper.poll()
+    assert connector.stage.call_count == 2
+    assert shipper.shipped() == targets
+
+    os.utime(northd.local_path, ns=(2, 2))
+    assert shipper.shipped() == {controller}
+
+
+def test_ship_unchanged_content(mocker, targets, connector, clock):
+    index = MagicMock(spec=ContentIndex)
+    index.is_changed.return_value = False
+    shipper = pipeline.TargetShipper(targets, connector, index)
+    northd = _by_name(targets, "ovn-northd")
+    shipper._baseline = {northd: None}
+
+    shipper.poll()
+    clock.return_value += pipeline.STABLE_AFTER
+    shipper.poll()
+
+    connector.stage.assert_not_called()
+    assert shipper.shipped() == {northd}
+
+
+def test_ship_failure(mocker, targets, connector, clock):
+    mock_print = mocker.patch("builtins.print")
+    index = MagicMock(spec=ContentIndex)
+    index.is_changed.return_value = True
+    error = ConnectorException("[vm1] Failed to upload file")
+    connector.stage.side_effect = error
+    shipper = pipeline.TargetShipper(targets, connector, index)
+    northd = _by_name(targets, "ovn-northd")
+    shipper._baseline = {northd: None}
+
+    for _ in range(3):
+        shipper.poll()
+        clock.return_value += pipeline.STABLE_AFTER
+
+    # Failed upload is not retried until the build finishes
+    connector.stage.assert_called_once_with({northd})
+    mock_print.assert_called_with(error)
+    assert shipper.shipped() == set()
+
+
+def test_start_stop(mocker, targets, connector):
+    mocker.patch.object(pipeline, "POLL_INTERVAL", 0.01)
+    index = MagicMock(spec=ContentIndex)
+    shipper = pipeline.TargetShipper(targets, connector, index)
+    mock_poll = mocker.patch.object(shipper, "poll")
+
+    shipper.start()
+    while not mock_poll.called:
+        pass
+    shipper.stop()
+
+    northd = _by_name(targets, "ovn-northd")
+    assert shipper._baseline[northd] == pipeline._signature(northd)
+    assert shipper._baseline[_by_name(targets, "ovn-controller")] is None
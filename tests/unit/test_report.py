@@ -0,0 +1,123 @@
+import json
+from unittest.mock import MagicMock
+
+import pytest
+
+from microovn_rebuilder import report
+from microovn_rebuilder.report import DeployReport, Timing, TransferProgress
+
+
+@pytest.fixture()
+def clock(mocker):
+    clock = MagicMock(return_value=100.0)
+    mocker.patch.object(report.time, "monotonic", clock)
+    mocker.patch.object(report.time, "time", return_value=1700000000.0)
+    return clock
+
+
+@pytest.mark.parametrize(
+    "size, seconds, expected", [(None, 1.0, None), (100, 0.0, None), (100, 2.0, 50.0)]
+)
+def test_timing_throughput(size, seconds, expected):
+    assert Timing("upload", seconds, size=size).throughput == expected
+
+
+def test_timing_to_json():
+    assert Timing("upload", 2.0, "vm1", "/bin/ovn-northd", 100).to_json() == {
+        "phase": "upload",
+        "seconds": 2.0,
+        "remote": "vm1",
+        "target": "/bin/ovn-northd",
+        "size": 100,
+        "throughput": 50.0,
+    }
+    assert Timing("build", 2.0).to_json() == {"phase": "build", "seconds": 2.0}
+
+
+def test_measure(clock):
+    timings = []
+
+    with pytest.raises(RuntimeError):
+        with report.measure(timings, "restart", remote="vm1"):
+            clock.return_value += 1.5
+            raise RuntimeError()
+
+    assert timings == [Timing("restart", 1.5, remote="vm1")]
+
+
+def test_cycle(mocker, tmp_path, clock):
+    mock_print = mocker.patch("builtins.print")
+    report_path = tmp_path / "reports" / "report.jsonl"
+    deploy_report = DeployReport(report_path)
+
+    for cycle in range(2):
+        deploy_report.start_cycle()
+        with deploy_report.timed("build"):
+            clock.return_value += 10
+        deploy_report.add(
+            [
+                Timing("upload", 1.0, "vm1", "/bin/ovn-northd", 2_000_000),
+                Timing("upload", 1.0, "vm1", "/bin/ovn-nbctl", 4_000_000),
+                Timing("restart", 0.5, "vm1"),
+            ]
+        )
+        deploy_report.finish_cycle("deployed")
+
+    mock_print.assert_any_call("[local] Cycle 2 (deployed) took 10.00s")
+    printed = [c.args[0] for c in mock_print.call_args_list]
+    upload_row = next(line for line in printed if line.lstrip().startswith("upload"))
+    assert upload_row.split() == [
+        "upload",
+        "vm1",
+        "2",
+        "2.00s",
+        "6.0",
+        "MB",
+        "3.0",
+        "MB/s",
+    ]
+
+    records = [json.loads(line) for line in report_path.read_text().splitlines()]
+    assert [record["cycle"] for record in records] == [1, 2]
+    assert records[1]["status"] == "deployed"
+    assert records[1]["duration"] == 10.0
+    assert records[1]["start"] == 1700000000.0
+    assert records[1]["phases"][0] == {"phase": "build", "seconds": 10.0}
+    assert len(records[1]["phases"]) == 4
+    assert deploy_report.last == records[1]
+
+
+def test_cycle_without_timings(mocker, clock):
+    mock_print = mocker.patch("builtins.print")
+    deploy_report = DeployReport()
+
+    deploy_report.start_cycle()
+    deploy_report.add([Timing("upload", 0.0, "vm1", size=10)])
+    deploy_report.finish_cycle("failed")
+    assert len(deploy_report.summary()) == 2
+
+    deploy_report.start_cycle()
+    deploy_report.finish_cycle("build failed")
+
+    mock_print.assert_called_with("[local] Cycle 2 (build failed) took 0.00s")
+    assert deploy_report.summary() == []
+    assert deploy_report.last is not None
+    assert deploy_report.last["cycle"] == 2
+    assert deploy_report.last["status"] == "build failed"
+
+
+def test_transfer_progress(clock):
+    progress = TransferProgress(4_000_000)
+
+    clock.return_value += 2
+    assert progress.advance(1_000_000) == (
+        "[local] Uploaded 1.0 MB of 4.0 MB (25%), about 6s left"
+    )
+    clock.return_value += 1
+    assert progress.advance(3_000_000) == "[local] Uploaded 4.0 MB of 4.0 MB (100%)"
+
+
+def test_transfer_progress_empty(clock):
+    progress = TransferProgress(0)
+
+    assert progress.advance(0) == "[local] Uploaded 0.0 MB of 0.0 MB"
@@ -0,0 +1,156 @@
+import os
+import shutil
+import subprocess
+from pathlib import Path
+
+import pytest
+
+from microovn_rebuilder import strip
+from microovn_rebuilder.index import ContentIndex
+from microovn_rebuilder.remote import ConnectorException
+from microovn_rebuilder.strip import StripCache, default_strip_cache_path
+from microovn_rebuilder.target import Target
+
+
+@pytest.fixture(scope="module")
+def elf_binary(tmp_path_factory) -> Path:
+    """Small executable with debug info."""
+    build_dir = tmp_path_factory.mktemp("build")
+    source = build_dir / "main.c"
+    source.write_text("int main(void) { return 0; }\n")
+    binary = build_dir / "ovn-northd"
+    subprocess.run(["cc", "-g", "-o", str(binary), str(source)], check=True)
+    return binary
+
+
+@pytest.fixture()
+def target(tmp_path, elf_binary) -> Target:
+    local_dir = tmp_path / "ovn" / "northd"
+    local_dir.mkdir(parents=True)
+    shutil.copy2(elf_binary, local_dir / "ovn-northd")
+    return Target(
+        "northd/ovn-northd",
+        "bin/ovn-northd",
+        str(tmp_path / "ovn"),
+        "/root/squashfs-root/",
+        service="microovn.ovn-northd",
+        strip=True,
+    )
+
+
+def _sections(path: Path) -> str:
+    return subprocess.run(
+        ["objdump", "-h", str(path)], capture_output=True, check=True, text=True
+    ).stdout
+
+
+def test_default_strip_cache_path(monkeypatch, tmp_path):
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path))
+    assert default_strip_cache_path() == tmp_path / "microovn-rebuilder" / "stripped"
+
+
+def test_stripped(tmp_path, target):
+    cache = StripCache(tmp_path / "cache")
+
+    stripped = cache.stripped(target)
+
+    digest = ContentIndex().digest(target.local_path)
+    entry = tmp_path / "cache" / str(digest) / "ovn-northd"
+    assert stripped.local_path == entry / "ovn-northd"
+    assert stripped.remote_path == target.remote_path
+    assert stripped.service == target.service
+    assert not stripped.strip
+    assert ".debug_info" in _sections(target.local_path)
+    assert ".debug_info" not in _sections(stripped.local_path)
+    assert ".gnu_debuglink" in _sections(stripped.local_path)
+    assert os.access(stripped.local_path, os.X_OK)
+    assert stripped.local_path.stat().st_size < target.local_path.stat().st_size
+
+
+def test_stripped_cached(mocker, tmp_path, target):
+    cache = StripCache(tmp_path / "cache")
+    first = cache.stripped(target)
+    mock_run = mocker.patch.object(strip.subprocess, "run")
+
+    assert cache.stripped(target) == first
+    assert StripCache(tmp_path / "cache").stripped(target) == first
+    mock_run.assert_not_called()
+
+
+@pytest.mark.parametrize("strip_enabled, exists", [(False, True), (True, False)])
+def test_stripped_unchanged(tmp_path, target, strip_enabled, exists):
+    target = Target(
+        target.local_rel_path,
+        target.remote_rel_path,
+        target.local_base_path if exists else str(tmp_path / "missing"),
+        strip=strip_enabled,
+    )
+    cache = StripCache(tmp_path / "cache")
+
+    assert cache.stripped(target) is target
+    assert not (tmp_path / "cache").exists()
+
+
+def test_stripped_failure(tmp_path, target):
+    target.local_path.write_bytes(b"not an ELF file")
+    cache = StripCache(tmp_path / "cache")
+
+    with pytest.raises(ConnectorException, match=r"\[local\] Failed to strip"):
+        cache.stripped(target)
+
+    assert [p.name for p in (tmp_path / "cache").iterdir()] == []
+
+
+def test_stripped_missing_objcopy(monkeypatch, tmp_path, target):
+    monkeypatch.setattr(strip, "OBJCOPY", str(tmp_path / "no-objcopy"))
+    cache = StripCache(tmp_path / "cache")
+
+    with pytest.raises(ConnectorException, match=r"\[local\] Failed to strip"):
+        cache.stripped(target)
+
+
+def test_stripped_concurrently(mocker, tmp_path, target):
+    cache = StripCache(tmp_path / "cache")
+
+    def rename(src, dst):
+        # Other process stores the same file while this one strips it
+        shutil.copytree(src, dst)
+        raise FileExistsError(dst)
+
+    mocker.patch.object(strip.os, "rename", side_effect=rename)
+
+    stripped = cache.stripped(target)
+
+    assert ".debug_info" not in _sections(stripped.local_path)
+    digest = stripped.local_path.parent.parent.name
+    assert [p.name for p in (tmp_path / "cache").iterdir()] == [digest]
+
+
+def test_prune(monkeypatch, tmp_path, target):
+    monkeypatch.setattr(strip, "MAX_ENTRIES", 1)
+    cache = StripCache(tmp_path / "cache")
+    old = cache.stripped(target)
+    target.local_path.write_bytes(target.local_path.read_bytes() + b"\0")
+    os.utime(old.local_path.parent.parent, ns=(0, 0))
+
+    new = cache.stripped(target)
+
+    assert not old.local_path.exists()
+    assert new.local_path.exists()
+
+
+def test_debug_targets(tmp_path, target):
+    cache = StripCache(tmp_path / "cache")
+    other = Target("utilities/ovn-nbctl", "bin/ovn-nbctl", target.local_base_path)
+    missing = Target("missing", "bin/missing", target.local_base_path, strip=True)
+
+    debug_targets = cache.debug_targets({target, other, missing})
+
+    assert len(debug_targets) == 1
+    debug = debug_targets.pop()
+    assert debug.remote_path == Path("/root/squashfs-root/bin/ovn-northd.debug")
+    assert debug.service is None
+    assert debug.local_path == cache.stripped(target).local_path.with_name(
+        "ovn-northd.debug"
+    )
+    assert ".debug_info" in _sections(debug.local_path)
@@ -2,7 +2,12 @@ from pathlib import Path
 
 import pytest
 
-from microovn_rebuilder.target import ConfigException, Target, parse_config
+from microovn_rebuilder.target import (
+    ConfigException,
+    Target,
+    TargetPattern,
+    parse_config,
+)
 
 
 @pytest.mark.parametrize("remote_path", ["/non/default", None])
@@ -25,6 +30,23 @@ def test_target_class(remote_path):
     assert target.remote_path == Path(expected_remote_base_path, target.remote_rel_path)
 
 
+def test_target_staged():
+    target = Target(
+        "northd/ovn-northd",
+        "bin/ovn-northd",
+        "/home/",
+        service="ovn-northd",
+        pre_exec="true",
+        ready_check="true",
+    )
+
+    staged = target.staged()
+
+    assert staged.local_path == target.local_path
+    assert staged.remote_path == target.staging_path
+    assert staged.service is staged.pre_exec is staged.ready_check is None
+
+
 def test_parse_config_no_file(local_ovn_path, remote_deployment_path):
     with pytest.raises(ConfigException):
         parse_config(
@@ -47,3 +69,65 @@ def test_parse_config_target_parsing_err(
     mocker.patch("builtins.open", mocker.mock_open(read_data=config_data))
     with pytest.raises(ConfigException):
         parse_config("/dev/null", local_ovn_path, remote_deployment_path)
+
+
+def test_parse_config_optional_keys(mocker, local_ovn_path, remote_deployment_path):
+    config_data = """
+targets:
+  - local_path: northd/ovn-northd
+    remote_path: bin/ovn-northd
+    strip: true
+    ready_check: ovn-appctl -t ovn-northd status
+  - local_path: utilities/ovn-nbctl
+    remote_path: bin/ovn-nbctl
+"""
+    mocker.patch("builtins.open", mocker.mock_open(read_data=config_data))
+
+    targets, patterns = parse_config("/dev/null", local_ovn_path, remote_deployment_path)
+
+    assert patterns == []
+    assert {t.local_rel_path: (t.strip, t.ready_check) for t in targets} == {
+        "northd/ovn-northd": (True, "ovn-appctl -t ovn-northd status"),
+        "utilities/ovn-nbctl": (False, None),
+    }
+
+
+def test_parse_config_patterns(mocker, local_ovn_path, remote_deployment_path):
+    config_data = """
+targets:
+  - local_path: lib/.libs/libovn*.so*
+    remote_path: lib
+    service: microovn.chassis
+  - local_path: utilities/
+    remote_path: bin
+"""
+    mocker.patch("builtins.open", mocker.mock_open(read_data=config_data))
+
+    targets, patterns = parse_config("/dev/null", local_ovn_path, remote_deployment_path)
+
+    assert targets == set()
+    libs, utilities = patterns
+    assert (libs.recursive, libs.name_pattern) == (False, "libovn*.so*")
+    assert libs.local_dir == Path(local_ovn_path, "lib/.libs")
+    assert (utilities.recursive, utilities.name_pattern) == (True, "")
+    assert utilities.local_dir == Path(local_ovn_path, "utilities")
+
+
+def test_parse_config_wildcard_in_directory(
+    mocker, local_ovn_path, remote_deployment_path
+):
+    config_data = 'targets: [{"local_path": "lib/*/libovn.so", "remote_path": "lib"}]'
+    mocker.patch("builtins.open", mocker.mock_open(read_data=config_data))
+
+    with pytest.raises(ConfigException, match="wildcards only in its file name"):
+        parse_config("/dev/null", local_ovn_path, remote_deployment_path)
+
+
+def test_target_pattern():
+    pattern = TargetPattern(
+        Target("utilities/", "bin", "/home/ovn", "/remote", service="ovn")
+    )
+
+    assert pattern.target("sub/ovn-nbctl") == Target(
+        "utilities/sub/ovn-nbctl", "bin/sub/ovn-nbctl", "/home/ovn", "/remote", "ovn"
+    )
@@ -0,0 +1,159 @@
+import os
+import subprocess
+import threading
+import time
+from pathlib import Path
+from unittest.mock import MagicMock
+
+import pytest
+
+from microovn_rebuilder import watcher as watcher_module
+from microovn_rebuilder.watcher import Inotify, SourceWatcher, WatcherException
+
+
+@pytest.fixture()
+def source_tree(tmp_path) -> Path:
+    (tmp_path / "northd").mkdir()
+    (tmp_path / "northd" / "northd.c").write_text("int main() {}")
+    (tmp_path / ".git").mkdir()
+    return tmp_path
+
+
+@pytest.fixture()
+def source_watcher(mocker, source_tree):
+    # Source tree in tests is not a git repository
+    mocker.patch.object(SourceWatcher, "_not_ignored", side_effect=lambda paths: paths)
+    watcher = SourceWatcher(str(source_tree))
+    yield watcher
+    watcher.stop()
+
+
+def test_inotify_unavailable(mocker):
+    mocker.patch.object(watcher_module.ctypes, "CDLL", side_effect=OSError("nope"))
+
+    with pytest.raises(WatcherException):
+        Inotify()
+
+
+def test_inotify_init_fails(mocker):
+    libc = MagicMock()
+    libc.inotify_init1.return_value = -1
+    mocker.patch.object(watcher_module.ctypes, "CDLL", return_value=libc)
+
+    with pytest.raises(WatcherException):
+        Inotify()
+
+
+def test_inotify_add_watch_fails(tmp_path):
+    inotify = Inotify()
+    try:
+        with pytest.raises(WatcherException):
+            inotify.add_watch(tmp_path / "missing", watcher_module.WATCH_MASK)
+    finally:
+        inotify.close()
+
+
+def test_watches_skip_hidden_dirs(source_watcher, source_tree):
+    watched = set(source_watcher._dirs.values())
+
+    assert watched == {source_tree, source_tree / "northd"}
+
+
+def test_read_changes(source_watcher, source_tree):
+    (source_tree / "northd" / "northd.c").write_text("int main() { return 1; }")
+    (source_tree / "northd" / "northd.o").write_bytes(b"object")
+    (source_tree / "northd" / ".northd.c.swp").write_bytes(b"swap")
+
+    changes = source_watcher.read_changes(1)
+
+    assert changes == {source_tree / "northd" / "northd.c"}
+
+
+def test_read_changes_timeout(source_watcher):
+    assert source_watcher.read_changes(0) == set()
+
+
+def test_read_changes_new_directory(source_watcher, source_tree):
+    new_dir = source_tree / "controller"
+    new_dir.mkdir()
+    assert source_watcher.read_changes(1) == set()
+
+    (new_dir / "ovn-controller.c").write_text("")
+
+    assert source_watcher.read_changes(1) == {new_dir / "ovn-controller.c"}
+
+
+def test_read_changes_removed_directory(source_watcher, source_tree):
+    (source_tree / "northd" / "northd.c").unlink()
+    (source_tree / "northd").rmdir()
+
+    changes = set()
+    for _ in range(3):
+        changes |= source_watcher.read_changes(0.5)
+
+    assert changes == {source_tree / "northd" / "northd.c"}
+    assert set(source_watcher._dirs.values()) == {source_tree}
+
+
+def test_read_changes_unknown_watch(source_watcher, mocker):
+    mocker.patch.object(
+        source_watcher._inotify, "read", return_value=[(999, 0, "foo.c")]
+    )
+
+    assert source_watcher.read_changes(0) == set()
+
+
+def test_watch_tree_dir_removed(mocker, source_watcher, source_tree):
+    mocker.patch.object(
+        source_watcher._inotify, "add_watch", side_effect=WatcherException()
+    )
+    known = dict(source_watcher._dirs)
+
+    source_watcher._watch_tree(source_tree)
+
+    assert source_watcher._dirs == known
+
+
+def test_wait_debounces(source_watcher, source_tree):
+    source_watcher.start()
+    source_file = source_tree / "northd" / "northd.c"
+
+    def edit() -> None:
+        for i in range(3):
+            source_file.write_text(f"int main() {{ return {i}; }}")
+            (source_tree / "northd" / f"new{i}.h").write_text("")
+            time.sleep(0.1)
+
+    editor = threading.Thread(target=edit)
+    start = time.monotonic()
+    editor.start()
+    changes = source_watcher.wait(0.3)
+    editor.join()
+
+    assert time.monotonic() - start >= 0.5
+    assert source_file in changes
+    assert not source_watcher.changed.is_set()
+
+
+def test_not_ignored(tmp_path):
+    subprocess.run(["git", "init", "-q", str(tmp_path)], check=True)
+    (tmp_path / ".gitignore").write_text("generated.c\n")
+    watcher = SourceWatcher(str(tmp_path))
+    try:
+        source, generated = tmp_path / "source.c", tmp_path / "generated.c"
+
+        assert watcher._not_ignored({source, generated}) == {source}
+        assert watcher._not_ignored({source}) == {source}
+        assert watcher._not_ignored(set()) == set()
+    finally:
+        watcher.stop()
+
+
+def test_not_ignored_no_git(mocker, tmp_path):
+    watcher = SourceWatcher(str(tmp_path))
+    mocker.patch.object(watcher_module.subprocess, "run", side_effect=OSError)
+    try:
+        paths = {tmp_path / "source.c"}
+        assert watcher._not_ignored(paths) == paths
+    finally:
+        watcher.stop()